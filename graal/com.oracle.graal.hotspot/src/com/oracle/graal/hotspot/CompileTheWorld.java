@@ -29,6 +29,7 @@ import static com.oracle.graal.hotspot.CompileTheWorldOptions.CompileTheWorldCla
 import static com.oracle.graal.hotspot.CompileTheWorldOptions.CompileTheWorldConfig;
 import static com.oracle.graal.hotspot.CompileTheWorldOptions.CompileTheWorldExcludeMethodFilter;
 import static com.oracle.graal.hotspot.CompileTheWorldOptions.CompileTheWorldMethodFilter;
+import static com.oracle.graal.hotspot.CompileTheWorldOptions.CompileTheWorldProfile;
 import static com.oracle.graal.hotspot.CompileTheWorldOptions.CompileTheWorldStartAt;
 import static com.oracle.graal.hotspot.CompileTheWorldOptions.CompileTheWorldStopAt;
 import static com.oracle.graal.hotspot.CompileTheWorldOptions.CompileTheWorldVerbose;
@@ -189,6 +190,8 @@ public final class CompileTheWorld {
     private int classFileCounter = 0;
     private AtomicLong compiledMethodsCounter = new AtomicLong();
     private AtomicLong compileTime = new AtomicLong();
+    private AtomicLong compileTimeNanos = new AtomicLong();
+    private AtomicLong compiledBytecodesCounter = new AtomicLong();
     private AtomicLong memoryUsed = new AtomicLong();
 
     private boolean verbose;
@@ -638,6 +641,28 @@ public final class CompileTheWorld {
         }
     }
 
+    /**
+     * Gets the number of methods compiled per second of compile time, summed over all compiler
+     * threads. Unlike the elapsed time, the compile time excludes class loading and resolution.
+     */
+    public long getMethodsPerSecond() {
+        return perSecondOfCompileTime(compiledMethodsCounter.get());
+    }
+
+    /**
+     * Gets the number of bytecodes compiled per second of compile time.
+     *
+     * @see #getMethodsPerSecond()
+     */
+    public long getBytecodesPerSecond() {
+        return perSecondOfCompileTime(compiledBytecodesCounter.get());
+    }
+
+    private long perSecondOfCompileTime(long count) {
+        long nanos = compileTimeNanos.get();
+        return nanos == 0 ? 0 : (long) (count * 1e9 / nanos);
+    }
+
     private synchronized void startThreads() {
         running = true;
         // Wake up any waiting threads
@@ -680,6 +705,7 @@ public final class CompileTheWorld {
     private void compileMethod(HotSpotResolvedJavaMethod method, int counter) {
         try {
             long start = System.currentTimeMillis();
+            long startNanos = System.nanoTime();
             long allocatedAtStart = MemUseTrackerImpl.getCurrentThreadAllocatedBytes();
             int entryBCI = JVMCICompiler.INVOCATION_ENTRY_BCI;
             HotSpotCompilationRequest request = new HotSpotCompilationRequest(method, entryBCI, 0L);
@@ -688,16 +714,27 @@ public final class CompileTheWorld {
             boolean installAsDefault = false;
             CompilationTask task = new CompilationTask(jvmciRuntime, compiler, request, useProfilingInfo, installAsDefault);
             task.runCompilation();
+            long compileNanos = System.nanoTime() - startNanos;
 
             // Invalidate the generated code so the code cache doesn't fill up
             HotSpotInstalledCode installedCode = task.getInstalledCode();
+            int installedCodeSize = 0;
             if (installedCode != null) {
+                installedCodeSize = installedCode.getSize();
                 installedCode.invalidate();
             }
 
             memoryUsed.getAndAdd(MemUseTrackerImpl.getCurrentThreadAllocatedBytes() - allocatedAtStart);
             compileTime.getAndAdd(System.currentTimeMillis() - start);
+            compileTimeNanos.getAndAdd(compileNanos);
+            compiledBytecodesCounter.getAndAdd(method.getCodeSize());
             compiledMethodsCounter.incrementAndGet();
+
+            if (CompileTheWorldProfile.getValue()) {
+                // Printed independent of CompileTheWorldVerbose as this is the output requested
+                TTY.println("CompileTheWorld (%d) : Profile %d us, %d bytecodes, %d bytes installed: %s", counter, compileNanos / 1000, method.getCodeSize(), installedCodeSize,
+                                method.format("%H.%n(%p):%r"));
+            }
         } catch (Throwable t) {
             // Catch everything and print a message
             println("CompileTheWorld (%d) : Error compiling method: %s", counter, method.format("%H.%n(%p):%r"));
@@ -59,6 +59,8 @@ public class CompileTheWorldOptions {
     public static final OptionValue<Boolean> CompileTheWorldMultiThreaded = new OptionValue<>(false);
     @Option(help = "Number of threads to use for multithreaded CTW.  Defaults to Runtime.getRuntime().availableProcessors()", type = OptionType.Debug)
     public static final OptionValue<Integer> CompileTheWorldThreads = new OptionValue<>(0);
+    @Option(help = "Print the compile time, bytecode size and installed code size of each method compiled by CTW", type = OptionType.Debug)
+    public static final OptionValue<Boolean> CompileTheWorldProfile = new OptionValue<>(false);
     // @formatter:on
 
     /**
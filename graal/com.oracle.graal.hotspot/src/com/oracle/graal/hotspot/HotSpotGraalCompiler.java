@@ -101,6 +101,7 @@ public class HotSpotGraalCompiler implements GraalJVMCICompiler {
             TTY.println("CompileTheWorld : iteration " + i);
             CompileTheWorld ctw = new CompileTheWorld(jvmciRuntime, this);
             ctw.compile();
+            TTY.println("CompileTheWorld : iteration %d throughput (%d methods/s, %d bytecodes/s)", i, ctw.getMethodsPerSecond(), ctw.getBytecodesPerSecond());
         }
         System.exit(0);
     }
@@ -0,0 +1,344 @@
+# ----------------------------------------------------------------------------------------------------
+#
+# Copyright (c) 2016, Oracle and/or its affiliates. All rights reserved.
+# DO NOT ALTER OR REMOVE COPYRIGHT NOTICES OR THIS FILE HEADER.
+#
+# This code is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 only, as
+# published by the Free Software Foundation.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# version 2 for more details (a copy is included in the LICENSE file that
+# accompanied this code).
+#
+# You should have received a copy of the GNU General Public License version
+# 2 along with this work; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Please contact Oracle, 500 Oracle Parkway, Redwood Shores, CA 94065 USA
+# or visit www.oracle.com if you need additional information or have any
+# questions.
+#
+# ----------------------------------------------------------------------------------------------------
+
+"""
+A local SQLite database of benchmark results.
+
+Each invocation of a benchmark command is a run. A run records where and on
+what it ran (commit, JVMCI mode, VM, machine, time). Each VM launched by the
+run is an execution that records the VM arguments and each score extracted
+from the output of an execution is stored with the benchmark group, the
+benchmark name and the iteration it was measured in. The state of the host
+before the run (see hostcheck) is stored as one row per property.
+"""
+
+import os, sys, json, time, sqlite3, platform, multiprocessing
+from os.path import join, dirname, expanduser
+
+import mx
+from benchstats import parseScore
+
+"""
+Top level keys of a details file. Result files map each benchmark group to
+the scores of its benchmarks. A details file, which is only written on
+request (-detailsfile), stores these results under 'scores' along with the
+following details. Statistics over repeated executions are stored under
+'statistics' in the same format, with a dictionary of statistics instead of
+each score. The scores of the individual iterations of a benchmark are
+stored under 'iterations', with a list of the iteration scores of each
+execution instead of each score. Likewise, the iteration at which each
+execution of an adaptive benchmark reached a steady state is stored under
+'steadyState'. The unit and the error reported by JMH for each
+microbenchmark are stored under 'units' and 'errors'. The state of the host
+before benchmarking is stored under 'host'.
+"""
+detailKeys = ['statistics', 'iterations', 'steadyState', 'units', 'errors', 'host']
+
+"""
+Benchmark groups whose scores are times, i.e., lower is better. For all
+other groups higher is better.
+"""
+lowerIsBetterGroups = ['DaCapo', 'DaCapo-1stRun', 'Scala-DaCapo', 'Bootstrap', 'Bootstrap-bigHeap', 'Bootstrap-cds', 'CompileTheWorld', 'Startup',
+                       'JMH-avgt', 'JMH-sample', 'JMH-ss']
+
+"""
+Benchmarks (as group:name) that are reported for information and are not
+a measure of performance.
+"""
+informationalBenchmarks = ['Bootstrap:BootstrapMethods', 'Bootstrap-bigHeap:BootstrapMethods', 'Bootstrap-cds:BootstrapMethods']
+
+"""
+Benchmark groups all of whose benchmarks are informational, such as the
+secondary metrics of JMH profilers.
+"""
+informationalGroups = ['JMH-secondary']
+
+def scoreGroups(results):
+    """
+    Gets the benchmark groups ({group : {benchmark : score}}) of 'results',
+    leaving out the details (see detailKeys).
+    """
+    return dict([(k, v) for k, v in results.iteritems() if k not in detailKeys])
+
+def details(results):
+    """
+    Gets the details of 'results' (see detailKeys).
+    """
+    return dict([(k, v) for k, v in results.iteritems() if k in detailKeys])
+
+_schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    command TEXT,
+    commitId TEXT,
+    dirty INTEGER,
+    jvmciMode TEXT,
+    vm TEXT,
+    machine TEXT,
+    os TEXT,
+    arch TEXT,
+    cpus INTEGER
+);
+CREATE TABLE IF NOT EXISTS executions (
+    id INTEGER PRIMARY KEY,
+    run INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    vmArgs TEXT NOT NULL,
+    fork INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS scores (
+    execution INTEGER NOT NULL REFERENCES executions(id),
+    groupName TEXT NOT NULL,
+    benchmark TEXT NOT NULL,
+    iteration INTEGER,
+    score REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hostStates (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS scoresByBenchmark ON scores(groupName, benchmark);
+CREATE VIEW IF NOT EXISTS results AS
+    SELECT runs.id AS run, runs.timestamp, runs.commitId, runs.dirty, runs.jvmciMode, runs.vm, runs.machine,
+           executions.name AS execution, executions.vmArgs, executions.fork,
+           scores.groupName, scores.benchmark, scores.iteration, scores.score
+    FROM scores JOIN executions ON scores.execution = executions.id JOIN runs ON executions.run = runs.id;
+"""
+
+def defaultPath():
+    """
+    Gets the path of the result database, which can be set with the
+    BENCH_RESULTS_DB environment variable.
+    """
+    return mx.get_env('BENCH_RESULTS_DB', join(expanduser('~'), '.mx', 'benchresults.db'))
+
+def _commit(suite):
+    vc = suite.vc
+    if vc is None:
+        return None, None
+    commitId = vc.parent(suite.dir, abortOnError=False)
+    dirty = vc.isDirty(suite.dir, abortOnError=False) if commitId else None
+    return commitId, dirty
+
+class ResultStore:
+    """
+    Opens (and creates if necessary) the result database at 'path'
+    (default: defaultPath()).
+    """
+    def __init__(self, path=None):
+        self.path = path or defaultPath()
+        mx.ensure_dir_exists(dirname(os.path.abspath(self.path)))
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(_schema)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.db.commit()
+        self.close()
+
+    def addRun(self, command, suite, jvmciMode, vm):
+        """
+        Records a new run of 'command' (the mx command line) on the current
+        machine and commit of 'suite' and returns its id.
+        """
+        commitId, dirty = _commit(suite)
+        cursor = self.db.execute('INSERT INTO runs (timestamp, command, commitId, dirty, jvmciMode, vm, machine, os, arch, cpus) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 (time.time(), json.dumps(command), commitId, dirty, jvmciMode, vm, platform.node(), mx.get_os(), mx.get_arch(), multiprocessing.cpu_count()))
+        self.db.commit()
+        return cursor.lastrowid
+
+    def addExecution(self, run, name, vmArgs, groups, fork=0, iterations=None):
+        """
+        Records the scores in 'groups' ({group : {benchmark : score}}) extracted
+        from one execution of the VM with 'vmArgs' for 'run'. The scores of
+        the individual iterations in 'iterations' ({group : {benchmark :
+        [score, ...]}}) are recorded with their iteration number (starting at
+        1). The scores in 'groups' are those reported by the harness for the
+        complete execution and have no iteration number.
+        """
+        cursor = self.db.execute('INSERT INTO executions (run, name, vmArgs, fork) VALUES (?, ?, ?, ?)', (run, name, json.dumps(vmArgs), fork))
+        execution = cursor.lastrowid
+        rows = []
+        for groupName, group in groups.iteritems():
+            for benchmark, score in group.iteritems():
+                rows.append((execution, groupName, benchmark, None, parseScore(score)))
+        for groupName, group in (iterations or {}).iteritems():
+            for benchmark, scores in group.iteritems():
+                for iteration, score in enumerate(scores):
+                    rows.append((execution, groupName, benchmark, iteration + 1, parseScore(score)))
+        self.db.executemany('INSERT INTO scores (execution, groupName, benchmark, iteration, score) VALUES (?, ?, ?, ?, ?)', rows)
+        self.db.commit()
+        return execution
+
+    def addHostState(self, run, state):
+        """
+        Records the state of the host before 'run' (see hostcheck.hostState),
+        storing each value as JSON.
+        """
+        self.db.executemany('INSERT INTO hostStates (run, name, value) VALUES (?, ?, ?)', [(run, name, json.dumps(value)) for name, value in sorted(state.iteritems())])
+        self.db.commit()
+
+    def hostState(self, run):
+        """
+        Gets the state of the host recorded for 'run' or an empty dictionary.
+        """
+        return dict([(row['name'], json.loads(row['value'])) for row in self.query('SELECT name, value FROM hostStates WHERE run = ?', (run,))])
+
+    def query(self, sql, params=()):
+        return self.db.execute(sql, params).fetchall()
+
+    def samples(self, run):
+        """
+        Gets the scores of 'run' as {group : {benchmark : [score per fork]}}.
+        """
+        samples = {}
+        rows = self.query('SELECT groupName, benchmark, score FROM results WHERE run = ? AND iteration IS NULL ORDER BY fork', (run,))
+        if not rows and not self.query('SELECT id FROM runs WHERE id = ?', (run,)):
+            mx.abort('No run ' + str(run) + ' in ' + self.path)
+        for row in rows:
+            samples.setdefault(row['groupName'], {}).setdefault(row['benchmark'], []).append(row['score'])
+        return samples
+
+def fileSamples(path):
+    """
+    Gets the scores in a result file or a details file as {group :
+    {benchmark : [score, ...]}}. If a details file contains statistics for a
+    benchmark, these are all the scores the statistics are based on.
+    """
+    with open(path) as fp:
+        results = json.load(fp)
+    statistics = results.get('statistics', {})
+    if 'scores' in results:
+        results = results['scores']
+    samples = {}
+    for groupName, group in scoreGroups(results).iteritems():
+        for name, score in group.iteritems():
+            stats = statistics.get(groupName, {}).get(name)
+            samples.setdefault(groupName, {})[name] = stats['scores'] if stats else [parseScore(score)]
+    return samples
+
+def _formatTable(header, rows, out):
+    rows = [[('' if v is None else str(v)) for v in row] for row in rows]
+    widths = [max([len(h)] + [len(row[i]) for row in rows]) for i, h in enumerate(header)]
+    fmt = '  '.join(['{:<' + str(w) + '}' for w in widths])
+    print >> out, fmt.format(*header).rstrip()
+    for row in rows:
+        print >> out, fmt.format(*row).rstrip()
+
+def _parseTime(s):
+    for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']:
+        try:
+            return time.mktime(time.strptime(s, fmt))
+        except ValueError:
+            pass
+    mx.abort('Cannot parse time (expected YYYY-MM-DD[ HH:MM[:SS]]): ' + s)
+
+def benchquery(args):
+    """query the benchmark result database
+
+    Without a --sql query, shows the recorded scores matching the given
+    filters, newest first. The database is set with BENCH_RESULTS_DB
+    (default: ~/.mx/benchresults.db)."""
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='mx benchquery', description=benchquery.__doc__)
+    parser.add_argument('--db', help='result database to query', metavar='<path>')
+    parser.add_argument('-g', '--group', help='only show scores of this benchmark group', metavar='<group>')
+    parser.add_argument('-b', '--benchmark', help='only show scores of benchmarks whose name contains this string', metavar='<name>')
+    parser.add_argument('-c', '--commit', help='only show runs of commits starting with this prefix', metavar='<id>')
+    parser.add_argument('-m', '--machine', help='only show runs on this machine', metavar='<host>')
+    parser.add_argument('-M', '--jvmci-mode', help='only show runs in this JVMCI mode', metavar='<mode>')
+    parser.add_argument('--since', help='only show runs started at or after this time', metavar='<YYYY-MM-DD[ HH:MM[:SS]]>')
+    parser.add_argument('--until', help='only show runs started before this time', metavar='<YYYY-MM-DD[ HH:MM[:SS]]>')
+    parser.add_argument('--runs', action='store_true', help='list runs instead of scores')
+    parser.add_argument('--vmargs', action='store_true', help='include the VM arguments of each score')
+    parser.add_argument('-n', '--limit', type=int, default=100, help='maximum number of rows shown (default: 100, 0 for no limit)', metavar='<n>')
+    parser.add_argument('--json', action='store_true', help='print rows as JSON')
+    parser.add_argument('--sql', help='run a custom query (tables: runs, executions, scores, view: results)', metavar='<query>')
+    args = parser.parse_args(args)
+
+    store = ResultStore(args.db)
+    try:
+        if args.sql:
+            rows = store.query(args.sql)
+            header = list(rows[0].keys()) if rows else []
+        else:
+            conditions = []
+            params = []
+            def where(condition, value):
+                if value is not None:
+                    conditions.append(condition)
+                    params.append(value)
+            where('commitId LIKE ?', args.commit + '%' if args.commit else None)
+            where('machine = ?', args.machine)
+            where('jvmciMode = ?', args.jvmci_mode)
+            where('timestamp >= ?', _parseTime(args.since) if args.since else None)
+            where('timestamp < ?', _parseTime(args.until) if args.until else None)
+            if args.runs:
+                where('id IN (SELECT executions.run FROM executions JOIN scores ON scores.execution = executions.id WHERE groupName = ?)', args.group)
+                where('id IN (SELECT executions.run FROM executions JOIN scores ON scores.execution = executions.id WHERE instr(benchmark, ?) > 0)', args.benchmark)
+                header = ['run', 'time', 'commit', 'mode', 'vm', 'machine', 'command']
+                sql = 'SELECT id, timestamp, commitId, dirty, jvmciMode, vm, machine, command FROM runs'
+            else:
+                where('groupName = ?', args.group)
+                where('instr(benchmark, ?) > 0', args.benchmark)
+                header = ['run', 'time', 'commit', 'mode', 'vm', 'machine', 'group', 'benchmark', 'iteration', 'score']
+                sql = 'SELECT run, timestamp, commitId, dirty, jvmciMode, vm, machine, groupName, benchmark, iteration, score, vmArgs FROM results'
+                if args.vmargs:
+                    header.append('VM args')
+            if conditions:
+                sql += ' WHERE ' + ' AND '.join(conditions)
+            sql += ' ORDER BY timestamp DESC' + (', groupName, benchmark, fork, iteration' if not args.runs else '')
+            if args.limit > 0:
+                sql += ' LIMIT %d' % args.limit
+            rows = []
+            for row in store.query(sql, params):
+                commitId = row['commitId']
+                if commitId:
+                    commitId = commitId[:12] + ('+' if row['dirty'] else '')
+                values = [row[0], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['timestamp'])), commitId, row['jvmciMode'], row['vm'], row['machine']]
+                if args.runs:
+                    values.append(' '.join(json.loads(row['command'])))
+                else:
+                    values += [row['groupName'], row['benchmark'], row['iteration'], row['score']]
+                    if args.vmargs:
+                        values.append(' '.join(json.loads(row['vmArgs'])))
+                rows.append(values)
+        if args.json:
+            print >> sys.stdout, json.dumps([dict(zip(header, [v for v in row])) for row in rows], indent=2)
+        else:
+            _formatTable(header, rows, sys.stdout)
+    except sqlite3.Error as e:
+        mx.abort('Error querying ' + store.path + ': ' + str(e))
+    finally:
+        store.close()
@@ -0,0 +1,153 @@
+# ----------------------------------------------------------------------------------------------------
+#
+# Copyright (c) 2016, Oracle and/or its affiliates. All rights reserved.
+# DO NOT ALTER OR REMOVE COPYRIGHT NOTICES OR THIS FILE HEADER.
+#
+# This code is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 only, as
+# published by the Free Software Foundation.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# version 2 for more details (a copy is included in the LICENSE file that
+# accompanied this code).
+#
+# You should have received a copy of the GNU General Public License version
+# 2 along with this work; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Please contact Oracle, 500 Oracle Parkway, Redwood Shores, CA 94065 USA
+# or visit www.oracle.com if you need additional information or have any
+# questions.
+#
+# ----------------------------------------------------------------------------------------------------
+
+"""
+Statistics over the scores of repeated benchmark executions.
+"""
+
+import math
+
+def parseScore(score):
+    """
+    Converts a score as extracted from benchmark output to a float. Some
+    harnesses print a decimal comma depending on the locale.
+    """
+    if isinstance(score, basestring):
+        score = score.replace(',', '.')
+    return float(score)
+
+"""
+Two-sided 97.5% quantiles of Student's t-distribution for 1 to 30 degrees of
+freedom. The normal quantile is used for more degrees of freedom.
+"""
+_t975 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+def tQuantile975(df):
+    if df < 1:
+        return float('nan')
+    if df <= len(_t975):
+        return _t975[int(df) - 1]
+    return 1.960
+
+def mean(values):
+    return sum(values) / float(len(values))
+
+def median(values):
+    return percentile(values, 50)
+
+def percentile(values, p):
+    """
+    Gets the 'p'th percentile of 'values' by linear interpolation between
+    the closest ranks.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100.0
+    lower = int(math.floor(k))
+    upper = int(math.ceil(k))
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+def stddev(values):
+    """
+    Gets the sample standard deviation of 'values'.
+    """
+    if len(values) < 2:
+        return 0.0
+    m = mean(values)
+    return math.sqrt(sum([(v - m) ** 2 for v in values]) / (len(values) - 1))
+
+def outliers(values):
+    """
+    Gets the values outside of Tukey's fences (1.5 times the interquartile
+    range beyond the first and third quartile). At least 4 values are needed.
+    """
+    if len(values) < 4:
+        return []
+    q1 = percentile(values, 25)
+    q3 = percentile(values, 75)
+    fence = 1.5 * (q3 - q1)
+    return [v for v in values if v < q1 - fence or v > q3 + fence]
+
+def summarize(scores):
+    """
+    Computes the statistics of the scores of one benchmark, one score per
+    execution. The 95% confidence interval is that of the mean, based on
+    Student's t-distribution.
+    """
+    values = [parseScore(s) for s in scores]
+    n = len(values)
+    m = mean(values)
+    sd = stddev(values)
+    halfWidth = tQuantile975(n - 1) * sd / math.sqrt(n) if n > 1 else 0.0
+    return {
+        'n' : n,
+        'mean' : m,
+        'median' : median(values),
+        'stddev' : sd,
+        'min' : min(values),
+        'max' : max(values),
+        'ci95' : [m - halfWidth, m + halfWidth],
+        'outliers' : outliers(values),
+        'scores' : values,
+    }
+
+def geomean(values):
+    """
+    Gets the geometric mean of 'values', which must all be positive.
+    """
+    return math.exp(sum([math.log(v) for v in values]) / len(values))
+
+def welch(a, b):
+    """
+    Computes Welch's t statistic and its (Welch-Satterthwaite) degrees of
+    freedom for the difference of the means of 'a' and 'b'. Returns None if
+    either sample has fewer than 2 values.
+    """
+    if len(a) < 2 or len(b) < 2:
+        return None
+    va = stddev(a) ** 2 / len(a)
+    vb = stddev(b) ** 2 / len(b)
+    if va + vb == 0:
+        # identical values within each sample
+        return (0.0 if mean(a) == mean(b) else float('inf'), len(a) + len(b) - 2)
+    t = (mean(b) - mean(a)) / math.sqrt(va + vb)
+    df = (va + vb) ** 2 / (va ** 2 / (len(a) - 1) + vb ** 2 / (len(b) - 1))
+    return (t, df)
+
+def significant(a, b):
+    """
+    Determines if the means of 'a' and 'b' differ at the 5% significance
+    level (two-sided Welch's t-test). Returns None if this cannot be decided
+    because a sample has fewer than 2 values.
+    """
+    result = welch(a, b)
+    if result is None:
+        return None
+    t, df = result
+    # rounding the degrees of freedom down is conservative
+    return abs(t) > tQuantile975(max(1, int(df)))
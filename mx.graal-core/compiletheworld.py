@@ -0,0 +1,400 @@
+# ----------------------------------------------------------------------------------------------------
+#
+# Copyright (c) 2016, Oracle and/or its affiliates. All rights reserved.
+# DO NOT ALTER OR REMOVE COPYRIGHT NOTICES OR THIS FILE HEADER.
+#
+# This code is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 only, as
+# published by the Free Software Foundation.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# version 2 for more details (a copy is included in the LICENSE file that
+# accompanied this code).
+#
+# You should have received a copy of the GNU General Public License version
+# 2 along with this work; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Please contact Oracle, 500 Oracle Parkway, Redwood Shores, CA 94065 USA
+# or visit www.oracle.com if you need additional information or have any
+# questions.
+#
+# ----------------------------------------------------------------------------------------------------
+
+"""
+Support for running CompileTheWorld (see com.oracle.graal.hotspot.CompileTheWorld)
+in several VMs and merging their results, and for reusing the results of class
+path entries that did not change since the last run.
+"""
+
+import os, re, json, time, math, bisect, hashlib, zipfile, subprocess
+from os.path import join, exists, isdir, isfile
+
+import mx
+import benchstats
+import jimage
+from parallelvms import JobPool, Job, jobOutput, fail
+
+def countClasses(classpath, jdkHome):
+    """
+    Counts the class files CompileTheWorld iterates over for 'classpath'.
+    The class file counter of CompileTheWorld, to which the
+    CompileTheWorldStartAt and CompileTheWorldStopAt options refer, runs
+    across all entries of the class path. Entries CompileTheWorld skips
+    (i.e., that do not exist) do not count.
+    """
+    count = 0
+    for entry in classpath.split(os.pathsep):
+        if entry.endswith('.zip') or entry.endswith('.jar'):
+            with zipfile.ZipFile(entry) as zf:
+                count += len([n for n in zf.namelist() if n.endswith('.class') and not n.endswith('/')])
+        elif entry.endswith('.jimage'):
+            if isfile(entry):
+                count += len([e for e in _jimageEntries(entry, jdkHome) if e.endswith('.class')])
+        elif isdir(entry):
+            for _, _, files in os.walk(entry):
+                count += len([f for f in files if f.endswith('.class')])
+    return count
+
+def _jimageEntries(path, jdkHome):
+    try:
+        with jimage.JImage(path) as image:
+            return image.names()
+    except jimage.UnsupportedJImageError:
+        pass
+    tool = join(jdkHome, 'bin', mx.exe_suffix('jimage'))
+    if not exists(tool):
+        mx.abort('Cannot count the classes in ' + path + ' without ' + tool)
+    entries = []
+    module = [None]
+    def out(line):
+        line = line.strip()
+        if line.startswith('Module: '):
+            module[0] = line[len('Module: '):]
+        elif line and module[0]:
+            entries.append('/' + module[0] + '/' + line)
+    mx.run([tool, 'list', path], out=out)
+    return entries
+
+def shardRanges(total, shards):
+    """
+    Splits the class files 1 to 'total' into 'shards' contiguous ranges of
+    nearly equal size, given as (startAt, stopAt) tuples of inclusive bounds.
+    """
+    shards = max(1, min(shards, total))
+    ranges = []
+    for i in range(shards):
+        ranges.append((i * total // shards + 1, (i + 1) * total // shards))
+    return ranges
+
+_doneRE = re.compile(r"^CompileTheWorld : Done \((?P<classes>[0-9]+) classes, (?P<methods>[0-9]+) methods, (?:(?P<elapsed>[0-9]+) ms elapsed, (?P<compileTime>[0-9]+) ms compile time|(?P<time>[0-9]+) ms), (?P<memory>[0-9]+) bytes of memory used\)")
+_errorRE = re.compile(r"^CompileTheWorld \((?P<counter>[0-9]+)\) : Error compiling method: (?P<method>.*)$")
+_skipRE = re.compile(r"^CompileTheWorld \((?P<counter>[0-9]+)\) : Skipping (?P<cls>\S+) (?P<reason>.*)$")
+_profileRE = re.compile(r"^CompileTheWorld \((?P<counter>[0-9]+)\) : Profile (?P<us>[0-9]+) us, (?P<bytecodes>[0-9]+) bytecodes, (?P<installed>[0-9]+) bytes installed: (?P<method>.*)$")
+
+class CTWResult:
+    """
+    The counts, times and failures reported by a CompileTheWorld VM, as
+    extracted from its output by 'eat'.
+    """
+    def __init__(self, name, startAt=1):
+        self.name = name
+        self.startAt = startAt
+        self.done = False
+        self.classes = 0
+        self.methods = 0
+        self.elapsed = 0
+        self.compileTime = 0
+        self.memory = 0
+        self.errors = []
+        self.skipped = []
+        self.profile = []
+        self.retcode = None
+
+    def eat(self, line):
+        """
+        Processes a line of output. Returns False if the line is a method
+        profile (see CompileTheWorldOptions.CompileTheWorldProfile).
+        """
+        if ' : Profile ' in line:
+            m = _profileRE.match(line)
+            if m:
+                self.profile.append((int(m.group('us')), int(m.group('bytecodes')), int(m.group('installed')), m.group('method')))
+                return False
+        m = _doneRE.match(line)
+        if m:
+            self.done = True
+            # the class counter includes the classes before 'startAt'
+            self.classes = int(m.group('classes')) - (self.startAt - 1)
+            self.methods = int(m.group('methods'))
+            if m.group('time') is not None:
+                self.compileTime = int(m.group('time'))
+            else:
+                self.elapsed = int(m.group('elapsed'))
+                self.compileTime = int(m.group('compileTime'))
+            self.memory = int(m.group('memory'))
+            return True
+        m = _errorRE.match(line)
+        if m:
+            self.errors.append((int(m.group('counter')), m.group('method')))
+            return True
+        m = _skipRE.match(line)
+        if m:
+            self.skipped.append((int(m.group('counter')), m.group('cls'), m.group('reason')))
+        return True
+
+    def failed(self):
+        return self.retcode != 0 or not self.done
+
+def run(vmArgs, classpath, shards, runVm, jdkHome, profile=False, slowest=20, cache=None, fullReport=False):
+    """
+    Runs CompileTheWorld over 'classpath'. 'vmArgs' is the command line of a
+    single CompileTheWorld VM and is run with 'runVm'. If 'shards' is
+    greater than 1, the classes are compiled in that many concurrent VMs (see
+    runShards). If 'profile' is true, the compile time and code sizes of
+    each method are reported (see reportProfile) instead of being printed.
+
+    If 'cache' is not None, each class path entry is compiled separately and
+    only if 'cache' has no result for it (see CTWCache). If 'fullReport' is
+    true, the cached results are included in the report.
+    """
+    if profile:
+        vmArgs = ['-G:+CompileTheWorldProfile'] + vmArgs
+    start = time.time()
+    cached = []
+    if cache is None:
+        results = _compile(vmArgs, classpath, shards, runVm, jdkHome, 'CompileTheWorld')
+    else:
+        results = []
+        for entry in classpath.split(os.pathsep):
+            if not exists(entry):
+                # CompileTheWorld skips such entries as well
+                continue
+            result = cache.get(entry)
+            if result:
+                mx.log('CompileTheWorld : Unchanged since the last run: {} ({} classes, {} methods, {} errors)'.format(entry, result.classes, result.methods, len(result.errors)))
+                cached.append(result)
+                continue
+            entryArgs = [('-G:CompileTheWorldClasspath=' + entry) if a.startswith('-G:CompileTheWorldClasspath=') else a for a in vmArgs]
+            result = merge(entry, _compile(entryArgs, entry, shards, runVm, jdkHome, entry))
+            if not result.failed():
+                cache.put(entry, result)
+            results.append(result)
+        if not results:
+            mx.log('CompileTheWorld : Nothing changed since the last run')
+    elapsed = int((time.time() - start) * 1000)
+
+    reported = results + cached if fullReport else results
+    if reported and (shards > 1 or cache is not None):
+        report(reported, elapsed)
+    if profile:
+        reportProfile(reported, slowest)
+    failed = [r.name for r in results if r.failed()]
+    if failed:
+        fail('CompileTheWorld failed in ' + ', '.join(failed))
+
+def _compile(vmArgs, classpath, shards, runVm, jdkHome, name):
+    if shards > 1:
+        return runShards(vmArgs, classpath, shards, runVm, jdkHome)
+    result = CTWResult(name)
+    log = jobOutput()
+    def out(line):
+        if result.eat(line):
+            log.write(line)
+    result.retcode = runVm(vmArgs, nonZeroIsFatal=False, out=out, err=subprocess.STDOUT)
+    return [result]
+
+def merge(name, results):
+    """
+    Merges the results of the VMs that compiled disjoint parts of the same
+    classes into a single CTWResult.
+    """
+    merged = CTWResult(name)
+    merged.done = all([r.done for r in results])
+    merged.retcode = max([r.retcode for r in results], key=abs)
+    for r in results:
+        merged.classes += r.classes
+        merged.methods += r.methods
+        merged.elapsed = max(merged.elapsed, r.elapsed)
+        merged.compileTime += r.compileTime
+        merged.memory += r.memory
+        merged.errors += r.errors
+        merged.skipped += r.skipped
+        merged.profile += r.profile
+    return merged
+
+def _hashPath(path, digest):
+    if isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for f in sorted(files):
+                digest.update(os.path.relpath(join(root, f), path))
+                _hashPath(join(root, f), digest)
+    else:
+        with open(path, 'rb') as fp:
+            while True:
+                chunk = fp.read(1 << 20)
+                if not chunk:
+                    break
+                digest.update(chunk)
+
+class CTWCache:
+    """
+    The CompileTheWorld results of class path entries, keyed by the content
+    of the entry (a jar, zip, jimage or class directory) and by the compiler
+    and options that compiled it. The latter are identified by the content
+    of 'compilerJars' and by 'vmArgs' (without the class path option), so
+    that a new Graal build or different options invalidate all results.
+    """
+    def __init__(self, directory, compilerJars, vmArgs):
+        self.directory = directory
+        digest = hashlib.sha1()
+        for jar in compilerJars:
+            _hashPath(jar, digest)
+        for arg in vmArgs:
+            if not arg.startswith('-G:CompileTheWorldClasspath='):
+                digest.update(arg + '\0')
+        self.compilerHash = digest.hexdigest()
+
+    def _path(self, entry):
+        digest = hashlib.sha1()
+        _hashPath(entry, digest)
+        return join(self.directory, digest.hexdigest() + '-' + self.compilerHash + '.json')
+
+    def get(self, entry):
+        """
+        Gets the cached result for 'entry' or None if there is none.
+        """
+        path = self._path(entry)
+        if not exists(path):
+            return None
+        try:
+            with open(path) as fp:
+                values = json.load(fp)
+        except ValueError:
+            mx.warn('Ignoring corrupt CompileTheWorld cache entry ' + path)
+            return None
+        result = CTWResult(entry)
+        result.__dict__.update(values)
+        result.name = entry
+        return result
+
+    def put(self, entry, result):
+        mx.ensure_dir_exists(self.directory)
+        path = self._path(entry)
+        # write to a temporary file first so that an interrupted run does not leave a partial entry
+        with open(path + '.tmp', 'w') as fp:
+            json.dump(result.__dict__, fp)
+        os.rename(path + '.tmp', path)
+
+def runShards(vmArgs, classpath, shards, runVm, jdkHome):
+    """
+    Runs CompileTheWorld over 'classpath' in 'shards' concurrent VMs, each
+    compiling a contiguous range of the class files by means of the
+    CompileTheWorldStartAt and CompileTheWorldStopAt options. The output of
+    each VM is shown once it completes. Returns the CTWResult of each VM.
+    """
+    total = countClasses(classpath, jdkHome)
+    if total == 0:
+        mx.abort('No classes found in ' + classpath)
+    ranges = shardRanges(total, shards)
+    mx.log('CompileTheWorld : Splitting {} classes into {} shards'.format(total, len(ranges)))
+
+    def runShard(job, startAt, stopAt):
+        result = job.ctwResult
+        # shown by Job.get() once the shard completes
+        log = jobOutput()
+        def out(line):
+            if result.eat(line):
+                log.write(line)
+        shardArgs = ['-G:CompileTheWorldStartAt=' + str(startAt), '-G:CompileTheWorldStopAt=' + str(stopAt)] + vmArgs
+        result.retcode = runVm(shardArgs, nonZeroIsFatal=False, out=out, err=subprocess.STDOUT)
+        return result
+
+    results = []
+    with JobPool(len(ranges)) as pool:
+        jobs = []
+        for i, (startAt, stopAt) in enumerate(ranges):
+            name = 'CTW-shard-{}-of-{}'.format(i + 1, len(ranges))
+            job = Job(name, lambda job, startAt=startAt, stopAt=stopAt: runShard(job, startAt, stopAt))
+            job.ctwResult = CTWResult(name + ' [classes {}-{}]'.format(startAt, stopAt), startAt)
+            jobs.append(pool.submit(job))
+        for job in jobs:
+            results.append(job.get())
+    return results
+
+def report(results, elapsed):
+    """
+    Prints the merged results of several CompileTheWorld VMs or class path entries.
+    """
+    mx.log('')
+    for r in results:
+        status = 'exit code {}'.format(r.retcode) if r.retcode != 0 else ('ok' if r.done else 'incomplete')
+        mx.log('{}: {} classes, {} methods, {} ms compile time, {} errors ({})'.format(r.name, r.classes, r.methods, r.compileTime, len(r.errors), status))
+    errors = sorted([e for r in results for e in r.errors])
+    skipped = sorted([s for r in results for s in r.skipped])
+    for counter, cls, reason in skipped:
+        mx.log('CompileTheWorld ({}) : Skipped {} {}'.format(counter, cls, reason))
+    for counter, method in errors:
+        mx.log('CompileTheWorld ({}) : Error compiling method: {}'.format(counter, method))
+    mx.log('CompileTheWorld : Done ({} classes, {} methods, {} ms elapsed, {} ms compile time, {} bytes of memory used) [{} VMs, {} errors]'.format(
+        sum([r.classes for r in results]), sum([r.methods for r in results]), elapsed, sum([r.compileTime for r in results]),
+        sum([r.memory for r in results]), len(results), len(errors)))
+
+"""
+Upper bounds (in microseconds) of the buckets of the compile time histogram.
+"""
+_histogramBuckets = [100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000]
+
+def _formatMicros(us):
+    if us >= 1000000:
+        return '{:.1f} s'.format(us / 1000000.0)
+    if us >= 1000:
+        return '{:.1f} ms'.format(us / 1000.0)
+    return '{} us'.format(us)
+
+def reportProfile(results, slowest=20):
+    """
+    Prints the distribution of the compile times and code sizes of the methods
+    profiled by CompileTheWorld (see CompileTheWorldOptions.CompileTheWorldProfile)
+    and the 'slowest' methods with the highest compile times.
+    """
+    profile = [p for r in results for p in r.profile]
+    if not profile:
+        mx.log('CompileTheWorld : No method profiles found')
+        return
+    times = sorted([p[0] for p in profile])
+    bytecodes = sorted([p[1] for p in profile])
+    installed = sorted([p[2] for p in profile])
+
+    mx.log('')
+    mx.log('CompileTheWorld : Profiled {} methods ({} total compile time)'.format(len(profile), _formatMicros(sum(times))))
+    mx.log('{:<22} {:>12} {:>12} {:>12} {:>12} {:>12}'.format('', 'p50', 'p90', 'p99', 'max', 'mean'))
+    for label, values, fmt in [('compile time', times, _formatMicros), ('bytecode size', bytecodes, str), ('installed code size', installed, str)]:
+        mx.log('{:<22} {:>12} {:>12} {:>12} {:>12} {:>12}'.format(label,
+            fmt(int(benchstats.percentile(values, 50))), fmt(int(benchstats.percentile(values, 90))), fmt(int(benchstats.percentile(values, 99))),
+            fmt(values[-1]), fmt(int(benchstats.mean(values)))))
+
+    mx.log('')
+    mx.log('Compile time histogram:')
+    counts = [0] * (len(_histogramBuckets) + 1)
+    for t in times:
+        counts[bisect.bisect_left(_histogramBuckets, t)] += 1
+    widest = max(counts)
+    lower = 0
+    for i, count in enumerate(counts):
+        if i < len(_histogramBuckets):
+            label = '{} - {}'.format(_formatMicros(lower), _formatMicros(_histogramBuckets[i]))
+            lower = _histogramBuckets[i]
+        else:
+            label = '> ' + _formatMicros(lower)
+        if count:
+            mx.log('  {:>22} {:>8} {:>6.2f}% {}'.format(label, count, 100.0 * count / len(times), '#' * int(math.ceil(50.0 * count / widest))))
+
+    if slowest > 0:
+        mx.log('')
+        mx.log('Slowest {} methods:'.format(min(slowest, len(profile))))
+        for us, codeSize, installedSize, method in sorted(profile, reverse=True)[:slowest]:
+            mx.log('  {:>10} {:>8} bytecodes {:>8} bytes installed  {}'.format(_formatMicros(us), codeSize, installedSize, method))
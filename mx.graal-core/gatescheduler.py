@@ -0,0 +1,331 @@
+# ----------------------------------------------------------------------------------------------------
+#
+# Copyright (c) 2016, Oracle and/or its affiliates. All rights reserved.
+# DO NOT ALTER OR REMOVE COPYRIGHT NOTICES OR THIS FILE HEADER.
+#
+# This code is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 only, as
+# published by the Free Software Foundation.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# version 2 for more details (a copy is included in the LICENSE file that
+# accompanied this code).
+#
+# You should have received a copy of the GNU General Public License version
+# 2 along with this work; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Please contact Oracle, 500 Oracle Parkway, Redwood Shores, CA 94065 USA
+# or visit www.oracle.com if you need additional information or have any
+# questions.
+#
+# ----------------------------------------------------------------------------------------------------
+
+
+"""
+Runs gate tasks that declare their dependencies and resource needs as a task
+graph. With more than one job, independent tasks run at once on one machine:
+each task gets a disjoint set of CPUs (see parallelvms) and a share of the
+memory budget while a task marked as exclusive (such as a build) runs alone.
+
+Each task still completes as a mx_gate.Task in the declared order and the
+gate stops at the first failed task: no further tasks are started once a
+task has failed.
+
+The tasks of a batch (such as the bootstrap tests) take up a single job and
+up to 'batchJobs' of them run at once. The time and status of each task of
+a batch are summarized once the last of them has completed or one of them
+has failed.
+"""
+
+import os, sys, time, shutil, tempfile, threading
+import mx
+from mx_gate import Task
+from parallelvms import Job, availableCpus, setThreadAffinity, installThreadStreams, createLog, runJob
+
+"""
+Maximum number of gate tasks run at once by runGateTasks. Defaults to the
+value of the GATE_JOBS environment variable.
+"""
+parallelJobs = int(mx.get_env('GATE_JOBS', '1'))
+
+"""
+Maximum number of tasks of a batch run at once by runGateTasks. Defaults to
+the value of the GATE_BATCH_JOBS environment variable.
+"""
+batchJobs = int(mx.get_env('GATE_BATCH_JOBS', '1'))
+
+"""
+Memory (in MB) shared by the gate tasks running at once. Defaults to the
+value of the GATE_MEMORY environment variable or else the physical memory.
+"""
+memoryBudget = mx.get_env('GATE_MEMORY')
+
+def physicalMemory():
+    """
+    Gets the physical memory of this machine in MB or None if it is unknown.
+    """
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+class GateTask:
+    """
+    A node of a gate task graph. 'func' is called with the working directory
+    of the task (None for the current directory) and reports a failure by
+    raising an exception. As calling mx.abort while other tasks are running
+    would kill their programs too, 'func' should report a failure with
+    parallelvms.fail instead (run_vm does so). The task only starts
+    once the tasks in 'deps' have completed (or were skipped by the gate task
+    filters). While running, it needs 'cores' CPUs (None for all of them) and
+    'memory' MB. An 'exclusive' task runs without any other task and a
+    'scratch' task runs in a fresh scratch directory. 'batch' is the name of
+    the batch the task belongs to (if any).
+    """
+    def __init__(self, title, func, deps=None, cores=1, memory=1024, exclusive=False, scratch=False, batch=None):
+        self.title = title
+        self.func = func
+        self.deps = deps or []
+        self.cores = cores
+        self.memory = memory
+        self.exclusive = exclusive
+        self.scratch = scratch
+        self.batch = batch
+
+    def __str__(self):
+        return self.title
+
+def runGateTasks(gateTasks, tasks, jobs=None, jobsPerBatch=None):
+    """
+    Runs 'gateTasks', which must be in an order consistent with their
+    dependencies, as gate tasks. If 'jobs' (default: 'parallelJobs') or, for
+    the tasks of a batch, 'jobsPerBatch' (default: 'batchJobs') is greater
+    than 1, up to that many independent tasks run at once (see
+    _Scheduler). Their output is shown and their tasks complete in the order
+    of 'gateTasks'.
+    """
+    declared = set()
+    for gateTask in gateTasks:
+        for dep in gateTask.deps:
+            if dep not in declared:
+                mx.abort('Gate task ' + str(gateTask) + ' is declared before its dependency ' + str(dep))
+        declared.add(gateTask)
+
+    jobs = parallelJobs if jobs is None else jobs
+    jobsPerBatch = batchJobs if jobsPerBatch is None else jobsPerBatch
+    if jobs <= 1 and (jobsPerBatch <= 1 or not [t for t in gateTasks if t.batch]):
+        for gateTask in gateTasks:
+            with Task(gateTask.title, tasks) as t:
+                if t: gateTask.func(None)
+        return
+
+    # Apply the gate task filters before any task is started. Each Task is
+    # only created once its job has completed as creating it logs its
+    # beginning and starts its timer.
+    selected = [gateTask for gateTask in gateTasks if not skippedByFilters(gateTask.title)]
+    lastOfBatch = dict([(gateTask.batch, gateTask) for gateTask in selected if gateTask.batch])
+    with _Scheduler(selected, jobs, jobsPerBatch) as scheduler:
+        for gateTask in selected:
+            gateTask = scheduler.wait(gateTask)
+            try:
+                with Task(gateTask.title, tasks) as t:
+                    if t: scheduler.get(gateTask, t)
+            except BaseException:
+                if gateTask.batch:
+                    scheduler.summarize(gateTask.batch)
+                raise
+            if gateTask.batch and lastOfBatch[gateTask.batch] is gateTask:
+                scheduler.summarize(gateTask.batch)
+
+def skippedByFilters(title):
+    """
+    Determines if the gate task filters (see mx_gate.Task) skip the task
+    'title' without creating a Task. Like creating a Task, this consumes a
+    matching --start-at filter and must therefore be called for the tasks in
+    the order of the gate.
+    """
+    startAt = getattr(Task, 'startAtFilter', None)
+    if startAt:
+        if startAt in title:
+            Task.startAtFilter = None
+            return False
+        return True
+    filters = getattr(Task, 'filters', None)
+    if filters:
+        matched = any([f in title for f in filters])
+        return matched if getattr(Task, 'filtersExclude', False) else not matched
+    return False
+
+class _Scheduler:
+    """
+    Starts the gate tasks as soon as their dependencies have completed and
+    the CPUs and memory they need are free. Ready tasks are considered in
+    their declared order but a task that does not fit may be overtaken by a
+    later one, except for an exclusive task which waits for all running tasks
+    to complete and blocks the tasks after it until it is done. The running
+    tasks of a batch count as one of 'jobs'.
+
+    Scheduling decisions are made by the thread waiting for a result (see
+    get) whenever a task has completed.
+    """
+    def __init__(self, gateTasks, jobs, batchJobs):
+        self.order = list(gateTasks)
+        self.pending = list(gateTasks)
+        self.scheduled = set(gateTasks)
+        self.jobs = jobs
+        self.batchJobs = batchJobs
+        self.freeCpus = availableCpus()
+        self.totalCpus = len(self.freeCpus)
+        self.totalMemory = int(memoryBudget) if memoryBudget else physicalMemory()
+        self.freeMemory = self.totalMemory
+        self.running = {}
+        self.started = {}
+        self.failed = None
+        self.lock = threading.Condition()
+
+    def __enter__(self):
+        self.logDir = tempfile.mkdtemp(prefix='mx-gate-')
+        self.savedStreams = (sys.stdout, sys.stderr)
+        self.streams = installThreadStreams()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        sys.stdout, sys.stderr = self.savedStreams
+        if exc_type is None:
+            shutil.rmtree(self.logDir, ignore_errors=True)
+
+    def _needs(self, gateTask):
+        if gateTask.exclusive or gateTask.cores is None:
+            cores = self.totalCpus
+        else:
+            cores = min(gateTask.cores, self.totalCpus)
+        if self.totalMemory is None:
+            memory = 0
+        elif gateTask.exclusive:
+            memory = self.totalMemory
+        else:
+            memory = min(gateTask.memory, self.totalMemory)
+        return cores, memory
+
+    def _ready(self, gateTask):
+        for dep in gateTask.deps:
+            if dep in self.scheduled:
+                job = self.started.get(dep)
+                if job is None or not job.done():
+                    return False
+        return True
+
+    def _admits(self, gateTask):
+        if gateTask.batch:
+            running = len([t for t in self.running if t.batch == gateTask.batch])
+            if running:
+                return running < self.batchJobs
+        batches = set([t.batch for t in self.running if t.batch])
+        return len([t for t in self.running if not t.batch]) + len(batches) < self.jobs
+
+    def _schedule(self):
+        if self.failed:
+            return
+        for gateTask in list(self.pending):
+            if any([t.exclusive for t in self.running]):
+                return
+            if not self._ready(gateTask) or not self._admits(gateTask):
+                continue
+            cores, memory = self._needs(gateTask)
+            if gateTask.exclusive and self.running:
+                return
+            if cores <= len(self.freeCpus) and memory <= self.freeMemory:
+                self._start(gateTask, cores, memory)
+            elif gateTask.exclusive:
+                return
+
+    def _start(self, gateTask, cores, memory):
+        cpus = self.freeCpus[:cores]
+        self.freeCpus = self.freeCpus[cores:]
+        if self.totalMemory is not None:
+            self.freeMemory -= memory
+        self.pending.remove(gateTask)
+        job = Job(gateTask.title, lambda job: gateTask.func(job.cwd), scratch=gateTask.scratch)
+        createLog(job, self.logDir)
+        self.running[gateTask] = (cpus, memory)
+        self.started[gateTask] = job
+        thread = threading.Thread(target=self._run, args=(gateTask, job, cpus))
+        # Tasks must not keep mx alive after an abort
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, gateTask, job, cpus):
+        setThreadAffinity(cpus)
+        runJob(job, cpus, self.streams)
+        with self.lock:
+            cpus, memory = self.running.pop(gateTask)
+            self.freeCpus = sorted(self.freeCpus + cpus)
+            if self.totalMemory is not None:
+                self.freeMemory += memory
+            if job.excInfo and not self.failed:
+                self.failed = gateTask
+            self.lock.notify_all()
+
+    def wait(self, gateTask):
+        """
+        Waits until 'gateTask' has completed or will not be started because
+        another task failed. Returns the task to report next: 'gateTask' or,
+        if it was not started, the failed task.
+        """
+        with self.lock:
+            while True:
+                self._schedule()
+                job = self.started.get(gateTask)
+                if job is not None and job.done():
+                    return gateTask
+                if job is None and self.failed and not self.running:
+                    return self.failed
+                # wait with a timeout so that the main thread remains interruptible
+                self.lock.wait(1)
+
+    def get(self, gateTask, task=None):
+        """
+        Waits for 'gateTask' to complete, shows its output and re-raises the
+        exception it raised (see Job.get). Aborts if it was not started
+        because another task failed. If given, the start of the mx_gate.Task
+        'task' is moved so that it reports how long the job of 'gateTask' took
+        rather than how long the gate waited for it. The job log shows when it
+        started.
+        """
+        self.wait(gateTask)
+        job = self.started.get(gateTask)
+        if job is None:
+            self.started[self.failed].showLog()
+            mx.abort('Not run as ' + self.failed.title + ' failed')
+        if task is not None:
+            task.start = time.time() - job.duration
+        job.get()
+
+    def summarize(self, batch):
+        """
+        Waits until the tasks of 'batch' have completed (or will not be
+        started because a task failed) and logs the time and status of each.
+        """
+        members = [t for t in self.order if t.batch == batch]
+        with self.lock:
+            while True:
+                self._schedule()
+                if all([t in self.started and self.started[t].done() for t in members]):
+                    break
+                if self.failed and not [t for t in self.running if t.batch == batch]:
+                    break
+                self.lock.wait(1)
+        jobs = [self.started.get(t) for t in members]
+        ran = [job for job in jobs if job is not None]
+        elapsed = max([job.start + job.duration for job in ran]) - min([job.start for job in ran]) if ran else 0.0
+        failed = len([job for job in ran if job.excInfo])
+        mx.log('%s: %d passed, %d failed, %d not run in %.1f s (%d at once)' % (batch, len(ran) - failed, failed, len(jobs) - len(ran), elapsed, self.batchJobs))
+        width = max([len(t.title) for t in members])
+        for t, job in zip(members, jobs):
+            if job is None:
+                mx.log('  %-*s %9s  not run' % (width, t.title, ''))
+            else:
+                mx.log('  %-*s %7.1f s  %s' % (width, t.title, job.duration, 'FAILED' if job.excInfo else 'OK'))
@@ -0,0 +1,272 @@
+# ----------------------------------------------------------------------------------------------------
+#
+# Copyright (c) 2016, Oracle and/or its affiliates. All rights reserved.
+# DO NOT ALTER OR REMOVE COPYRIGHT NOTICES OR THIS FILE HEADER.
+#
+# This code is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 only, as
+# published by the Free Software Foundation.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# version 2 for more details (a copy is included in the LICENSE file that
+# accompanied this code).
+#
+# You should have received a copy of the GNU General Public License version
+# 2 along with this work; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Please contact Oracle, 500 Oracle Parkway, Redwood Shores, CA 94065 USA
+# or visit www.oracle.com if you need additional information or have any
+# questions.
+#
+# ----------------------------------------------------------------------------------------------------
+
+
+"""
+Pre-flight checks of the host a benchmark runs on.
+
+Before measuring, bench records the state of the machine that is known to
+perturb scores: load average, CPU frequency governors, turbo boost, free
+memory, the transparent huge page mode and, when measured, other processes
+using CPU time and the timing noise estimated by a short calibration loop.
+The state is stored with the results so that a suspicious change in scores
+can be traced to the host. Conditions that are transient (load, competing
+processes, noise) make the host noisy and can be waited for or refused.
+"""
+
+import os, re, sys, time, glob
+import mx
+import benchstats
+from parallelvms import availableCpus
+
+"""
+Maximum 1 minute load average per available CPU of a quiet host. Defaults
+to the value of the BENCH_MAX_LOAD environment variable.
+"""
+maxLoad = float(mx.get_env('BENCH_MAX_LOAD', '0.25'))
+
+"""
+CPU usage (in percent of one CPU) above which another process competes with
+the benchmark. Defaults to the value of the BENCH_MAX_PROCESS_CPU
+environment variable.
+"""
+maxProcessCpu = float(mx.get_env('BENCH_MAX_PROCESS_CPU', '10'))
+
+"""
+Maximum coefficient of variation of the calibration loop times of a quiet
+host. Defaults to the value of the BENCH_MAX_NOISE environment variable.
+"""
+maxNoise = float(mx.get_env('BENCH_MAX_NOISE', '0.05'))
+
+"""
+Seconds to wait for a noisy host to become quiet before refusing to run.
+Defaults to the value of the BENCH_HOST_WAIT environment variable.
+"""
+maxWait = int(mx.get_env('BENCH_HOST_WAIT', '600'))
+
+def _read(path):
+    try:
+        with open(path) as fp:
+            return fp.read().strip()
+    except IOError:
+        return None
+
+def loadAverage():
+    """
+    Gets the 1, 5 and 15 minute load averages or None if unknown.
+    """
+    try:
+        return list(os.getloadavg())
+    except (AttributeError, OSError):
+        return None
+
+def governors():
+    """
+    Gets the sorted list of distinct CPU frequency scaling governors of the
+    available CPUs (e.g. ['powersave']) or None if unknown.
+    """
+    values = set()
+    for cpu in availableCpus():
+        governor = _read('/sys/devices/system/cpu/cpu{}/cpufreq/scaling_governor'.format(cpu))
+        if governor:
+            values.add(governor)
+    return sorted(values) or None
+
+def turbo():
+    """
+    Determines if the CPUs may run above their nominal frequency (Intel
+    Turbo Boost or AMD Turbo Core). Returns None if unknown.
+    """
+    noTurbo = _read('/sys/devices/system/cpu/intel_pstate/no_turbo')
+    if noTurbo is not None:
+        return noTurbo == '0'
+    boost = _read('/sys/devices/system/cpu/cpufreq/boost')
+    if boost is not None:
+        return boost == '1'
+    return None
+
+def availableMemory():
+    """
+    Gets the memory (in MB) available for starting new processes without
+    swapping or None if unknown.
+    """
+    meminfo = _read('/proc/meminfo')
+    if meminfo:
+        m = re.search(r'^MemAvailable:\s+(\d+) kB', meminfo, re.MULTILINE) or re.search(r'^MemFree:\s+(\d+) kB', meminfo, re.MULTILINE)
+        if m:
+            return int(m.group(1)) // 1024
+    return None
+
+def transparentHugePages():
+    """
+    Gets the transparent huge page mode (always, madvise or never) or None if
+    unknown.
+    """
+    enabled = _read('/sys/kernel/mm/transparent_hugepage/enabled')
+    if enabled:
+        m = re.search(r'\[(\w+)\]', enabled)
+        if m:
+            return m.group(1)
+    return None
+
+def _cpuTimes():
+    """
+    Gets the CPU time (in clock ticks) used so far by each process as
+    {pid : (name, ticks)}.
+    """
+    times = {}
+    for stat in glob.glob('/proc/[0-9]*/stat'):
+        content = _read(stat)
+        if not content:
+            # the process has exited
+            continue
+        # the name is in parentheses and may contain spaces
+        end = content.rfind(')')
+        fields = content[end + 2:].split()
+        times[int(content.split(' ', 1)[0])] = (content[content.find('(') + 1:end], int(fields[11]) + int(fields[12]))
+    return times
+
+def competingProcesses(interval=1.0):
+    """
+    Gets the processes other than mx that used more than 'maxProcessCpu'
+    percent of a CPU during 'interval' seconds as a list of [pid, name, cpu
+    percentage], busiest first. Returns None if unknown.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    ticksPerSecond = os.sysconf('SC_CLK_TCK')
+    before = _cpuTimes()
+    time.sleep(interval)
+    after = _cpuTimes()
+    processes = []
+    for pid, (name, ticks) in after.iteritems():
+        if pid == os.getpid() or pid not in before:
+            continue
+        cpu = 100.0 * (ticks - before[pid][1]) / ticksPerSecond / interval
+        if cpu > maxProcessCpu:
+            processes.append([pid, name, round(cpu, 1)])
+    return sorted(processes, key=lambda p: -p[2])
+
+def calibrate(rounds=20, work=200000):
+    """
+    Times 'rounds' executions of a fixed CPU-bound loop and returns the
+    coefficient of variation of their times as an estimate of the timing
+    noise of the host, together with the median time in milliseconds.
+    """
+    times = []
+    # the first round warms up caches and is not timed
+    for _ in range(rounds + 1):
+        start = time.time()
+        x = 0
+        for i in xrange(work):
+            x = (x * 31 + i) & 0xffff
+        times.append(time.time() - start)
+    times = times[1:]
+    mean = benchstats.mean(times)
+    noise = benchstats.stddev(times) / mean if mean > 0 else 0.0
+    return round(noise, 4), round(benchstats.median(times) * 1000, 2)
+
+def hostState(measure=False):
+    """
+    Records the state of the host as a dictionary that can be stored as JSON.
+    Values that cannot be determined on this platform are None. Finding the
+    competing processes and the calibration take about a second each and
+    are only done if 'measure' is true (the values are None otherwise).
+    """
+    # read before measuring as the measurements add to the load
+    state = {'loadAverage' : loadAverage()}
+    state.update({
+        'cpus' : len(availableCpus()),
+        'governors' : governors(),
+        'turbo' : turbo(),
+        'availableMemory' : availableMemory(),
+        'transparentHugePages' : transparentHugePages(),
+        'competingProcesses' : None,
+        'noise' : None,
+        'calibrationLoopTime' : None,
+    })
+    if measure:
+        state['competingProcesses'] = competingProcesses()
+        state['noise'], state['calibrationLoopTime'] = calibrate()
+    return state
+
+def problems(state):
+    """
+    Gets the descriptions of the transient conditions in 'state' that make
+    the host too noisy to benchmark on.
+    """
+    result = []
+    load = state['loadAverage']
+    if load is not None and load[0] > maxLoad * state['cpus']:
+        result.append('load average {:.2f} exceeds {:.2f}'.format(load[0], maxLoad * state['cpus']))
+    for pid, name, cpu in state['competingProcesses'] or []:
+        result.append('process {} ({}) uses {}% CPU'.format(pid, name, cpu))
+    if state['noise'] is not None and state['noise'] > maxNoise:
+        result.append('calibration noise {:.1%} exceeds {:.1%}'.format(state['noise'], maxNoise))
+    return result
+
+def warnings(state):
+    """
+    Gets the descriptions of the settings in 'state' that make scores vary
+    with the temperature or power management of the host. These are not
+    transient and are only reported.
+    """
+    result = []
+    if state['governors'] and state['governors'] != ['performance']:
+        result.append('CPU frequency governor is ' + ', '.join(state['governors']) + ' instead of performance')
+    if state['turbo']:
+        result.append('turbo boost is enabled')
+    return result
+
+def check(policy='record'):
+    """
+    Records the state of the host before benchmarking. If the host is noisy,
+    'policy' determines whether to just 'record' this, to 'wait' up to
+    'maxWait' seconds for the host to become quiet (and refuse to run if it
+    does not) or to 'refuse' to run. The 'measure' policy records like
+    'record' but also measures the competing processes and the noise of the
+    host (see hostState), which 'wait' and 'refuse' always do. Returns the
+    state of the host, which lists its problems under 'problems'.
+    """
+    if policy not in ['record', 'measure', 'wait', 'refuse']:
+        mx.abort('Unknown host check policy: ' + policy)
+    if policy == 'measure':
+        policy = 'record'
+        measure = True
+    else:
+        measure = policy != 'record'
+    deadline = time.time() + maxWait
+    while True:
+        state = hostState(measure)
+        state['problems'] = problems(state)
+        if not state['problems'] or policy == 'record':
+            break
+        if policy == 'refuse' or time.time() >= deadline:
+            mx.abort('Host is too noisy to benchmark on:\n  ' + '\n  '.join(state['problems']))
+        mx.log('Waiting for a quiet host: ' + '; '.join(state['problems']))
+        time.sleep(10)
+    for problem in state['problems'] + warnings(state):
+        mx.warn('Benchmark host: ' + problem)
+    return state
@@ -0,0 +1,165 @@
+# ----------------------------------------------------------------------------------------------------
+#
+# Copyright (c) 2016, Oracle and/or its affiliates. All rights reserved.
+# DO NOT ALTER OR REMOVE COPYRIGHT NOTICES OR THIS FILE HEADER.
+#
+# This code is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 only, as
+# published by the Free Software Foundation.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# version 2 for more details (a copy is included in the LICENSE file that
+# accompanied this code).
+#
+# You should have received a copy of the GNU General Public License version
+# 2 along with this work; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Please contact Oracle, 500 Oracle Parkway, Redwood Shores, CA 94065 USA
+# or visit www.oracle.com if you need additional information or have any
+# questions.
+#
+# ----------------------------------------------------------------------------------------------------
+
+"""
+Reads the resources of a JDK9 jimage file (e.g. lib/modules/bootmodules.jimage)
+without starting a JVM. This follows the format read by jdk.internal.jimage.BasicImageReader:
+
+    header     magic, version, flags, resource count, table length,
+               locations size and strings size (u4 each, native byte order)
+    redirect   table length s4 values (for looking up names by hash)
+    offsets    table length u4 offsets of the locations of the resources
+    locations  the attribute streams of the resource locations
+    strings    NUL terminated (modified) UTF-8 strings
+    resources  the content of the resources
+
+Only uncompressed resources are supported.
+"""
+
+import mmap, struct
+
+_MAGIC = 0xCAFEDADA
+_MAJOR_VERSION = 1
+_HEADER_SIZE = 7 * 4
+
+# location attribute kinds (see jdk.internal.jimage.ImageLocation)
+_ATTRIBUTE_END = 0
+_ATTRIBUTE_MODULE = 1
+_ATTRIBUTE_PARENT = 2
+_ATTRIBUTE_BASE = 3
+_ATTRIBUTE_EXTENSION = 4
+_ATTRIBUTE_OFFSET = 5
+_ATTRIBUTE_COMPRESSED = 6
+_ATTRIBUTE_UNCOMPRESSED = 7
+_ATTRIBUTE_COUNT = 8
+
+class UnsupportedJImageError(Exception):
+    """
+    Raised for a jimage file whose format or resource encoding is not supported.
+    """
+    pass
+
+class JImage:
+    """
+    A jimage file mapped into memory. Use as a context manager or call close().
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._readHeader()
+        except:
+            self.close()
+            raise
+
+    def _readHeader(self):
+        if len(self._map) < _HEADER_SIZE:
+            raise UnsupportedJImageError(self.path + ' is too small to be a jimage file')
+        for order in '<>':
+            if struct.unpack_from(order + 'I', self._map, 0)[0] == _MAGIC:
+                self._order = order
+                break
+        else:
+            raise UnsupportedJImageError(self.path + ' is not a jimage file')
+        _, version, _, self.resourceCount, self._tableLength, locationsSize, stringsSize = struct.unpack_from(self._order + '7I', self._map, 0)
+        if version >> 16 != _MAJOR_VERSION:
+            raise UnsupportedJImageError('Unsupported jimage version {}.{} of {}'.format(version >> 16, version & 0xffff, self.path))
+        self._offsetsStart = _HEADER_SIZE + self._tableLength * 4
+        self._locationsStart = self._offsetsStart + self._tableLength * 4
+        self._stringsStart = self._locationsStart + locationsSize
+        self._indexSize = self._stringsStart + stringsSize
+        if self._indexSize > len(self._map):
+            raise UnsupportedJImageError(self.path + ' is truncated')
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _string(self, offset):
+        start = self._stringsStart + offset
+        return self._map[start:self._map.find('\0', start)]
+
+    def _location(self, offset):
+        """
+        Decodes the attribute stream at 'offset' in the locations. Each
+        attribute is a byte holding its kind (upper 5 bits) and the length
+        of its value minus 1 (lower 3 bits) followed by the big-endian value.
+        """
+        attributes = [0] * _ATTRIBUTE_COUNT
+        i = self._locationsStart + offset
+        while True:
+            b = ord(self._map[i])
+            kind = b >> 3
+            if kind == _ATTRIBUTE_END:
+                break
+            if kind >= _ATTRIBUTE_COUNT:
+                raise UnsupportedJImageError('Invalid location attribute {} in {}'.format(kind, self.path))
+            value = 0
+            for j in range(i + 1, i + 2 + (b & 0x7)):
+                value = (value << 8) | ord(self._map[j])
+            attributes[kind] = value
+            i += 2 + (b & 0x7)
+        return attributes
+
+    def _name(self, attributes):
+        name = ''
+        if attributes[_ATTRIBUTE_MODULE]:
+            name += '/' + self._string(attributes[_ATTRIBUTE_MODULE]) + '/'
+        if attributes[_ATTRIBUTE_PARENT]:
+            name += self._string(attributes[_ATTRIBUTE_PARENT]) + '/'
+        name += self._string(attributes[_ATTRIBUTE_BASE])
+        if attributes[_ATTRIBUTE_EXTENSION]:
+            name += '.' + self._string(attributes[_ATTRIBUTE_EXTENSION])
+        return name
+
+    def _locations(self):
+        for i in range(self._tableLength):
+            offset = struct.unpack_from(self._order + 'I', self._map, self._offsetsStart + i * 4)[0]
+            attributes = self._location(offset)
+            yield self._name(attributes), attributes
+
+    def names(self):
+        """
+        Gets the names of all resources, e.g. "/java.base/java/lang/Object.class".
+        """
+        return [name for name, _ in self._locations()]
+
+    def resources(self, prefix=''):
+        """
+        Generates a (name, content) tuple for each resource whose name starts
+        with 'prefix'. The content of one resource is read at a time.
+        """
+        for name, attributes in self._locations():
+            if name.startswith(prefix):
+                if attributes[_ATTRIBUTE_COMPRESSED]:
+                    raise UnsupportedJImageError('Compressed resource ' + name + ' in ' + self.path + ' is not supported')
+                start = self._indexSize + attributes[_ATTRIBUTE_OFFSET]
+                yield name, self._map[start:start + attributes[_ATTRIBUTE_UNCOMPRESSED]]
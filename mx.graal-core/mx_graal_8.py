@@ -36,9 +36,10 @@ from mx_jvmci import get_vm as _jvmci_get_vm
 from mx_jvmci import run_vm as _jvmci_run_vm
 from mx_gate import Task
 from sanitycheck import _noneAsEmptyList
+from parallelvms import captureOutput, jobOutput, currentJob, fail
 
 from mx_unittest import unittest
-from mx_graal_bench import dacapo
+from mx_graal_bench import dacapo, addMicrobenchArguments, selectMicrobenchmarks, runMicrobench, jmhClasspath
 import mx_gate
 import mx_unittest
 
@@ -56,6 +57,23 @@ def get_vm():
         assert isinstance(vm, str)
         return vm
 
+def get_jvmci_mode():
+    """
+    Gets the currently selected JVMCI mode or None if the JVMCI version
+    does not support modes.
+    """
+    if JVMCI_VERSION >= 9:
+        return _jvmci_get_vm().jvmciMode
+    return None
+
+def sharedArchiveOptions():
+    """
+    Gets the VM options for using a class data sharing archive of the Graal
+    classes. Always None as JVMCI loads Graal with its own class loader on
+    JDK8 and the archive only covers classes of the boot class path.
+    """
+    return None
+
 class GraalJDKDeployedDist(JvmciJDKDeployedDist):
     def __init__(self, name, compilers=False, updatesGraalProperties=False):
         JvmciJDKDeployedDist.__init__(self, name, compilers=compilers)
@@ -109,13 +127,20 @@ mx_gate.add_jacoco_excluded_annotations(['@Snippet', '@ClassSubstitution'])
 # looks for internal JMH benchmarks (i.e. those that
 # depend on the JMH library).
 def microbench(args):
-    """run JMH microbenchmark projects"""
+    """run JMH microbenchmark projects
+
+    The JMH results are recorded in the benchmark result database and
+    reported in the format of bench (see mx_graal_bench.runMicrobench)."""
+    command = ['microbench'] + args
     parser = ArgumentParser(prog='mx microbench', description=microbench.__doc__,
                             usage="%(prog)s [command options|VM options] [-- [JMH options]]")
     parser.add_argument('--jar', help='Explicitly specify micro-benchmark location')
+    addMicrobenchArguments(parser)
     known_args, args = parser.parse_known_args(args)
 
     vmArgs, jmhArgs = mx.extract_VM_args(args, useDoubleDash=True)
+    if not selectMicrobenchmarks(known_args, jmhArgs):
+        return
     if JVMCI_VERSION < 9:
         if isJVMCIEnabled(get_vm()) and '-XX:-UseJVMCIClassLoader' not in vmArgs:
             vmArgs = ['-XX:-UseJVMCIClassLoader'] + vmArgs
@@ -139,12 +164,8 @@ def microbench(args):
         if not forking:
             args += vmArgs
     else:
-        # find all projects with a direct JMH dependency
-        jmhProjects = []
-        for p in mx.projects_opt_limit_to_suites():
-            if 'JMH' in [x.name for x in p.deps]:
-                jmhProjects.append(p.name)
-        cp = mx.classpath(jmhProjects)
+        # the projects with a direct JMH dependency
+        cp = jmhClasspath()
 
         # execute JMH runner
         args = ['-cp', cp]
@@ -162,7 +183,7 @@ def microbench(args):
 
         forkedVmArgs = map(quoteSpace, jdk.parseVmArgs(vmArgs))
         args += ['--jvmArgsPrepend', ' '.join(['-' + jvm] + forkedVmArgs)]
-    run_vm(args + jmhArgs)
+    runMicrobench(command, known_args, vmArgs, jmhArgs, lambda jmhArgs: run_vm(args + jmhArgs))
 
 def ctw(args, extraVMarguments=None):
     """run CompileTheWorld"""
@@ -172,6 +193,11 @@ def ctw(args, extraVMarguments=None):
     parser = ArgumentParser(prog='mx ctw')
     parser.add_argument('--ctwopts', action='store', help='space separated JVMCI options used for CTW compilations (default: --ctwopts="' + defaultCtwopts + '")', default=defaultCtwopts, metavar='<options>')
     parser.add_argument('--cp', '--jar', action='store', help='jar or class path denoting classes to compile', metavar='<path>')
+    parser.add_argument('--shards', action='store', type=int, default=1, help='number of VMs, each compiling a contiguous part of the classes, to run in parallel (default: 1)', metavar='<n>')
+    parser.add_argument('--profile', action='store_true', help='report the distribution of per-method compile times and code sizes and the slowest methods')
+    parser.add_argument('--slowest', action='store', type=int, default=20, help='number of slowest methods listed by --profile (default: 20)', metavar='<n>')
+    parser.add_argument('--incremental', action='store_true', help='only compile the class path entries that changed since the last run with the same Graal build and options')
+    parser.add_argument('--full-report', action='store_true', dest='fullReport', help='include the results of the unchanged class path entries in the report of --incremental')
 
     args, vmargs = parser.parse_known_args(args)
 
@@ -193,9 +219,11 @@ def ctw(args, extraVMarguments=None):
     vmargs = ['-Djava.awt.headless=true'] + vmargs
 
     vm = get_vm()
+    jvmciCtw = True
     if JVMCI_VERSION >= 9:
         jvmciMode = _jvmci_get_vm().jvmciMode
         if jvmciMode == 'disabled':
+            jvmciCtw = False
             vmargs += ['-XX:+CompileTheWorld', '-Xbootclasspath/p:' + cp]
         else:
             if jvmciMode == 'jit':
@@ -207,9 +235,20 @@ def ctw(args, extraVMarguments=None):
                 vmargs += ['-XX:+BootstrapJVMCI']
             vmargs += ['-G:CompileTheWorldClasspath=' + cp, '-XX:-UseJVMCIClassLoader', 'com.oracle.graal.hotspot.CompileTheWorld']
         else:
+            jvmciCtw = False
             vmargs += ['-XX:+CompileTheWorld', '-Xbootclasspath/p:' + cp]
 
-    run_vm(vmargs + _noneAsEmptyList(extraVMarguments))
+    if args.shards > 1 or args.profile or args.incremental:
+        if not jvmciCtw:
+            mx.abort('--shards, --profile and --incremental are only supported for CompileTheWorld with JVMCI')
+        vmargs += _noneAsEmptyList(extraVMarguments)
+        import compiletheworld
+        cache = None
+        if args.incremental:
+            cache = compiletheworld.CTWCache(join(_suite.get_output_root(), 'ctwcache'), [d.dist().path for d in jdkDeployedDists], vmargs)
+        compiletheworld.run(vmargs, cp, args.shards, run_vm, get_jvmci_jdk().home, profile=args.profile, slowest=args.slowest, cache=cache, fullReport=args.fullReport)
+    else:
+        run_vm(vmargs + _noneAsEmptyList(extraVMarguments))
 
 class UnitTestRun:
     def __init__(self, name, args):
@@ -217,10 +256,21 @@ class UnitTestRun:
         self.args = args
 
     def run(self, suites, tasks, extraVMarguments=None):
+        import unittestshards
+        if unittestshards.shardCount > 1:
+            with Task(self.name + ': hosted-product ' + ','.join(suites), tasks) as t:
+                if t: self._runShards(suites, extraVMarguments)
+            return
         for suite in suites:
             with Task(self.name + ': hosted-product ' + suite, tasks) as t:
                 if t: unittest(['--suite', suite, '--fail-fast'] + self.args + _noneAsEmptyList(extraVMarguments))
 
+    def _runShards(self, suites, extraVMarguments):
+        import unittestshards
+        # the shards are launched with run_vm so that their output is captured
+        unittestshards.run(suites, unittestshards.shardCount, ['--fail-fast'] + self.args + _noneAsEmptyList(extraVMarguments),
+                           vmLauncher=('Graal VM launcher', _unittest_vm_launcher))
+
 class BootstrapTest:
     def __init__(self, name, vmbuild, args, suppress=None):
         self.name = name
@@ -231,12 +281,22 @@ class BootstrapTest:
     def run(self, tasks, extraVMarguments=None):
         with VM('jvmci', self.vmbuild):
             with Task(self.name + ':' + self.vmbuild, tasks) as t:
-                if t:
-                    if self.suppress:
-                        out = mx.DuplicateSuppressingStream(self.suppress).write
-                    else:
-                        out = None
-                    run_vm(self.args + _noneAsEmptyList(extraVMarguments) + ['-XX:-TieredCompilation', '-XX:+BootstrapJVMCI', '-version'], out=out)
+                if t: self._bootstrap(extraVMarguments)
+
+    def _bootstrap(self, extraVMarguments):
+        if self.suppress:
+            # the output of a batch task goes to the log of its job
+            out = mx.DuplicateSuppressingStream(self.suppress, jobOutput()).write
+        else:
+            out = None
+        # the VM is given explicitly as the tasks of a batch run at once and
+        # they must not abort each other (see parallelvms.fail)
+        if run_vm(self.args + _noneAsEmptyList(extraVMarguments) + ['-XX:-TieredCompilation', '-XX:+BootstrapJVMCI', '-version'], vm='jvmci', vmbuild=self.vmbuild, nonZeroIsFatal=False, out=out) != 0:
+            fail(self.name + ':' + self.vmbuild + ' failed')
+
+    def gateTask(self, extraVMarguments=None):
+        from gatescheduler import GateTask
+        return GateTask(self.name + ':' + self.vmbuild, lambda cwd: self._bootstrap(extraVMarguments), cores=2, memory=2048, batch='Bootstrap')
 
 class MicrobenchRun:
     def __init__(self, name, args):
@@ -245,7 +305,7 @@ class MicrobenchRun:
 
     def run(self, tasks, extraVMarguments=None):
         with Task(self.name + ': hosted-product ', tasks) as t:
-            if t: microbench(_noneAsEmptyList(extraVMarguments) + ['--'] + self.args)
+            if t: microbench(['--noresultdb'] + _noneAsEmptyList(extraVMarguments) + ['--'] + self.args)
 
 def compiler_gate_runner(suites, unit_test_runs, bootstrap_tests, tasks, extraVMarguments=None):
 
@@ -273,16 +333,14 @@ def compiler_gate_runner(suites, unit_test_runs, bootstrap_tests, tasks, extraVM
         if t: buildvms(['--vms', 'jvmci', '--builds', 'fastdebug,product'])
 
     # bootstrap tests
-    for b in bootstrap_tests:
-        b.run(tasks, extraVMarguments)
+    import gatescheduler
+    gatescheduler.runGateTasks([b.gateTask(extraVMarguments) for b in bootstrap_tests], tasks)
 
     # run dacapo sanitychecks
     for vmbuild in ['fastdebug', 'product']:
-        for test in sanitycheck.getDacapos(level=sanitycheck.SanityCheckLevel.Gate, gateBuildLevel=vmbuild, extraVmArguments=extraVMarguments) \
-                + sanitycheck.getScalaDacapos(level=sanitycheck.SanityCheckLevel.Gate, gateBuildLevel=vmbuild, extraVmArguments=extraVMarguments):
-            with Task(str(test) + ':' + vmbuild, tasks) as t:
-                if t and not test.test('jvmci'):
-                    t.abort(test.name + ' Failed')
+        tests = sanitycheck.getDacapos(level=sanitycheck.SanityCheckLevel.Gate, gateBuildLevel=vmbuild, extraVmArguments=extraVMarguments) \
+                + sanitycheck.getScalaDacapos(level=sanitycheck.SanityCheckLevel.Gate, gateBuildLevel=vmbuild, extraVmArguments=extraVMarguments)
+        sanitycheck.runGateTests(tests, tasks, ':' + vmbuild)
 
     # ensure -Xbatch still works
     with VM('jvmci', 'product'):
@@ -344,6 +402,15 @@ graal_simple_bootstrap_tests = [
 
 
 def _graal_gate_runner(args, tasks):
+    import gatescheduler, unittestshards
+    if args.sanitycheck_fail_fast:
+        sanitycheck.failFastMode = True
+    if args.sanitycheck_jobs:
+        sanitycheck.parallelJobs = args.sanitycheck_jobs
+    if args.unittest_shards:
+        unittestshards.shardCount = args.unittest_shards
+    if args.batch_jobs:
+        gatescheduler.batchJobs = args.batch_jobs
     if args.simple:
         compiler_simple_gate_runner(['graal-core', 'truffle'], graal_unit_test_runs, graal_simple_bootstrap_tests, tasks, args.extra_vm_argument)
     else:
@@ -352,6 +419,10 @@ def _graal_gate_runner(args, tasks):
 mx_gate.add_gate_runner(_suite, _graal_gate_runner)
 mx_gate.add_gate_argument('--extra-vm-argument', action='append', help='add extra vm argument to gate tasks if applicable (multiple occurrences allowed)')
 mx_gate.add_gate_argument('--simple', action='store_true', help='only run simple task set')
+mx_gate.add_gate_argument('--sanitycheck-fail-fast', action='store_true', help='terminate a sanity check VM as soon as a failure shows up in its output')
+mx_gate.add_gate_argument('--sanitycheck-jobs', action='store', type=int, help='number of DaCapo sanity checks to run at once (default: 1)', metavar='<n>')
+mx_gate.add_gate_argument('--unittest-shards', action='store', type=int, help='number of VMs the unit tests are split across (default: 1)', metavar='<n>')
+mx_gate.add_gate_argument('--batch-jobs', action='store', type=int, help='number of tasks of a batch (e.g. the bootstrap tests) to run at once (default: 1)', metavar='<n>')
 
 def jdkartifactstats(args):
     """show stats about JDK deployed Graal artifacts"""
@@ -428,16 +499,22 @@ def _translateGOption(arg):
         arg = '-Dgraal.' + arg[len('-G:'):]
     return arg
 
-def run_vm(*positionalargs, **kwargs):
+def run_vm(args, vm=None, nonZeroIsFatal=True, out=None, err=None, cwd=None, timeout=None, debugLevel=None, vmbuild=None):
     """run a Java program by executing the java executable in a Graal JDK"""
 
-    # convert positional args to a list so the first element can be updated
-    positionalargs = list(positionalargs)
-    args = positionalargs[0]
     if '-G:+PrintFlags' in args and '-Xcomp' not in args:
         mx.warn('Using -G:+PrintFlags may have no effect without -Xcomp as Graal initialization is lazy')
-    positionalargs[0] = map(_translateGOption, args)
-    return _jvmci_run_vm(*positionalargs, **kwargs)
+    args = map(_translateGOption, args)
+    out, err = captureOutput(out, err)
+    # a job reports a failed VM with a JobFailure instead of mx.abort (see parallelvms.fail)
+    inJob = currentJob() is not None
+    retcode = _jvmci_run_vm(args, vm=vm, nonZeroIsFatal=nonZeroIsFatal and not inJob, out=out, err=err, cwd=cwd, timeout=timeout, debugLevel=debugLevel, vmbuild=vmbuild)
+    if retcode != 0 and nonZeroIsFatal:
+        fail('The VM exited with code ' + str(retcode))
+    return retcode
+
+def _unittest_vm_launcher(vmArgs, mainClass, mainClassArgs):
+    run_vm(vmArgs + [mainClass] + mainClassArgs)
 
 def _unittest_config_participant(config):
     vmArgs, mainClass, mainClassArgs = config
@@ -450,8 +527,8 @@ mx_unittest.add_config_participant(_unittest_config_participant)
 mx.update_commands(_suite, {
     'vm': [run_vm, '[-options] class [args...]'],
     'jdkartifactstats' : [jdkartifactstats, ''],
-    'ctw': [ctw, '[-vmoptions|noinline|nocomplex|full]'],
-    'microbench' : [microbench, '[VM options] [-- [JMH options]]'],
+    'ctw': [ctw, '[--shards n] [--profile] [--incremental] [-vmoptions|noinline|nocomplex|full]'],
+    'microbench' : [microbench, '[--list] [--resultfile file] [--detailsfile file] [--resultdb file|--noresultdb] [VM options] [-- [JMH options]]'],
 })
 
 class GraalArchiveParticipant(JVMCIArchiveParticipant):
@@ -25,24 +25,40 @@
 # ----------------------------------------------------------------------------------------------------
 
 import os
-from os.path import join, exists, abspath
+from os.path import join, exists, abspath, dirname, basename
 from argparse import ArgumentParser
 import sanitycheck
+import parallelvms
+import hashlib
 import re
+import tempfile
+import threading
+import collections
 
 import mx
+import mx_graal_core
 from mx_gate import Task
+from parallelvms import captureOutput, jobOutput, currentJob, fail
 from sanitycheck import _noneAsEmptyList
 
 from mx_unittest import unittest
-from mx_graal_bench import dacapo
+from mx_graal_bench import addMicrobenchArguments, selectMicrobenchmarks, runMicrobench, jmhClasspath
 import mx_gate
 import mx_unittest
 
 _suite = mx.suite('graal-core')
 
-_jdk = mx.get_jdk(tag='default')
-assert _jdk.javaCompliance >= "1.9"
+assert mx_graal_core.jdkDescriptor.javaCompliance >= "1.9"
+
+def _get_jdk():
+    """
+    Gets the default JDK. This is not done while loading this module as it
+    runs the JDK (see mx_graal_core.jdkDescriptor).
+    """
+    descriptor = mx_graal_core.jdkDescriptor
+    if descriptor.jdk is None:
+        descriptor.jdk = mx.get_jdk(tag='default')
+    return descriptor.jdk
 
 def isJVMCIEnabled(vm):
     return True
@@ -61,25 +77,42 @@ def get_vm():
 
 class JVMCIMode:
     """
-    A context manager for setting the current JVMCI mode.
+    A context manager for setting the current JVMCI mode. The mode is set for
+    the current thread only as gate tasks may run in several threads at once
+    (see gatescheduler).
     """
     def __init__(self, jvmciMode=None):
         self.update(jvmciMode)
 
     def update(self, jvmciMode=None):
         assert jvmciMode is None or jvmciMode in _jvmciModes, jvmciMode
-        self.jvmciMode = jvmciMode or _vm.jvmciMode
+        self.jvmciMode = jvmciMode or get_jvmci_mode()
 
     def __enter__(self):
-        global _vm
-        self.previousVm = _vm
-        _vm = self
+        self.previousVm = getattr(_vmState, 'vm', None)
+        _vmState.vm = self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        global _vm
-        _vm = self.previousVm
+        _vmState.vm = self.previousVm
 
+"""
+The JVMCI mode selected by the -M option and the innermost JVMCIMode context
+of each thread.
+"""
 _vm = JVMCIMode(jvmciMode='hosted')
+_vmState = threading.local()
+
+def _currentVm():
+    return getattr(_vmState, 'vm', None) or _vm
+
+def get_jvmci_mode():
+    """
+    Gets the currently selected JVMCI mode.
+    """
+    return _currentVm().jvmciMode
+
+# jobs run in the JVMCI mode of the thread creating them
+parallelvms.jobContexts.append(lambda: JVMCIMode(get_jvmci_mode()))
 
 class BootClasspathDist(object):
     """
@@ -112,13 +145,20 @@ mx_gate.add_jacoco_excluded_annotations(['@Snippet', '@ClassSubstitution'])
 # looks for internal JMH benchmarks (i.e. those that
 # depend on the JMH library).
 def microbench(args):
-    """run JMH microbenchmark projects"""
+    """run JMH microbenchmark projects
+
+    The JMH results are recorded in the benchmark result database and
+    reported in the format of bench (see mx_graal_bench.runMicrobench)."""
+    command = ['microbench'] + args
     parser = ArgumentParser(prog='mx microbench', description=microbench.__doc__,
                             usage="%(prog)s [command options|VM options] [-- [JMH options]]")
     parser.add_argument('--jar', help='Explicitly specify micro-benchmark location')
+    addMicrobenchArguments(parser)
     known_args, args = parser.parse_known_args(args)
 
     vmArgs, jmhArgs = mx.extract_VM_args(args, useDoubleDash=True)
+    if not selectMicrobenchmarks(known_args, jmhArgs):
+        return
 
     # look for -f in JMH arguments
     forking = True
@@ -139,12 +179,8 @@ def microbench(args):
         if not forking:
             args += vmArgs
     else:
-        # find all projects with a direct JMH dependency
-        jmhProjects = []
-        for p in mx.projects_opt_limit_to_suites():
-            if 'JMH' in [x.name for x in p.deps]:
-                jmhProjects.append(p.name)
-        cp = mx.classpath(jmhProjects)
+        # the projects with a direct JMH dependency
+        cp = jmhClasspath()
 
         # execute JMH runner
         args = ['-cp', cp]
@@ -159,9 +195,9 @@ def microbench(args):
                 return '"' + s + '"'
             return s
 
-        forkedVmArgs = map(quoteSpace, _parseVmArgs(_jdk, vmArgs))
+        forkedVmArgs = map(quoteSpace, _parseVmArgs(_get_jdk(), vmArgs))
         args += ['--jvmArgsPrepend', ' '.join(['-' + jvm] + forkedVmArgs)]
-    run_vm(args + jmhArgs)
+    runMicrobench(command, known_args, vmArgs, jmhArgs, lambda jmhArgs: run_vm(args + jmhArgs))
 
 def ctw(args, extraVMarguments=None):
     """run CompileTheWorld"""
@@ -171,6 +207,11 @@ def ctw(args, extraVMarguments=None):
     parser = ArgumentParser(prog='mx ctw')
     parser.add_argument('--ctwopts', action='store', help='space separated JVMCI options used for CTW compilations (default: --ctwopts="' + defaultCtwopts + '")', default=defaultCtwopts, metavar='<options>')
     parser.add_argument('--cp', '--jar', action='store', help='jar or class path denoting classes to compile', metavar='<path>')
+    parser.add_argument('--shards', action='store', type=int, default=1, help='number of VMs, each compiling a contiguous part of the classes, to run in parallel (default: 1)', metavar='<n>')
+    parser.add_argument('--profile', action='store_true', help='report the distribution of per-method compile times and code sizes and the slowest methods')
+    parser.add_argument('--slowest', action='store', type=int, default=20, help='number of slowest methods listed by --profile (default: 20)', metavar='<n>')
+    parser.add_argument('--incremental', action='store_true', help='only compile the class path entries that changed since the last run with the same Graal build and options')
+    parser.add_argument('--full-report', action='store_true', dest='fullReport', help='include the results of the unchanged class path entries in the report of --incremental')
 
     args, vmargs = parser.parse_known_args(args)
 
@@ -181,20 +222,42 @@ def ctw(args, extraVMarguments=None):
     if args.cp:
         cp = os.path.abspath(args.cp)
     else:
-        cp = join(_jdk.home, 'lib', 'modules', 'bootmodules.jimage')
+        cp = join(_get_jdk().home, 'lib', 'modules', 'bootmodules.jimage')
         vmargs.append('-G:CompileTheWorldExcludeMethodFilter=sun.awt.X11.*.*')
 
     # suppress menubar and dock when running on Mac; exclude x11 classes as they may cause vm crashes (on Solaris)
     vmargs = ['-Djava.awt.headless=true'] + vmargs
 
-    if _vm.jvmciMode == 'disabled':
+    if get_jvmci_mode() == 'disabled':
         vmargs += ['-XX:+CompileTheWorld', '-Xbootclasspath/p:' + cp]
     else:
-        if _vm.jvmciMode == 'jit':
+        if get_jvmci_mode() == 'jit':
             vmargs += ['-XX:+BootstrapJVMCI']
         vmargs += ['-G:CompileTheWorldClasspath=' + cp, 'com.oracle.graal.hotspot.CompileTheWorld']
 
-    run_vm(vmargs + _noneAsEmptyList(extraVMarguments))
+    if args.shards > 1 or args.profile or args.incremental:
+        if get_jvmci_mode() == 'disabled':
+            mx.abort('--shards, --profile and --incremental are only supported for CompileTheWorld with JVMCI')
+        vmargs += _noneAsEmptyList(extraVMarguments)
+        import compiletheworld
+        cache = None
+        if args.incremental:
+            cache = compiletheworld.CTWCache(join(_suite.get_output_root(), 'ctwcache'), [d.dist().path for d in _bootClasspathDists], vmargs)
+        compiletheworld.run(vmargs, cp, args.shards, run_vm, _get_jdk().home, profile=args.profile, slowest=args.slowest, cache=cache, fullReport=args.fullReport)
+    else:
+        run_vm(vmargs + _noneAsEmptyList(extraVMarguments))
+
+def _jvmciModeTask(title, jvmciMode, func, **kwargs):
+    """
+    Creates a GateTask that calls 'func' with its working directory while
+    'jvmciMode' is the current JVMCI mode. The other arguments are those of
+    GateTask.
+    """
+    from gatescheduler import GateTask
+    def run(cwd):
+        with JVMCIMode(jvmciMode):
+            func(cwd)
+    return GateTask(title, run, **kwargs)
 
 class UnitTestRun:
     def __init__(self, name, args):
@@ -202,10 +265,32 @@ class UnitTestRun:
         self.args = args
 
     def run(self, suites, tasks, extraVMarguments=None):
+        import unittestshards
+        if unittestshards.shardCount > 1:
+            with Task(self.name + ': hosted-product ' + ','.join(suites), tasks) as t:
+                if t: self._runShards(suites, extraVMarguments)
+            return
         for suite in suites:
             with Task(self.name + ': hosted-product ' + suite, tasks) as t:
                 if t: unittest(['--suite', suite, '--fail-fast'] + self.args + _noneAsEmptyList(extraVMarguments))
 
+    def _runShards(self, suites, extraVMarguments):
+        import unittestshards
+        unittestshards.run(suites, unittestshards.shardCount, ['--fail-fast'] + self.args + _noneAsEmptyList(extraVMarguments))
+
+    def gateTasks(self, suites, extraVMarguments=None):
+        import unittestshards
+        if unittestshards.shardCount > 1:
+            shards = unittestshards.shardCount
+            return [_jvmciModeTask(self.name + ': hosted-product ' + ','.join(suites), 'hosted',
+                                   lambda cwd: self._runShards(suites, extraVMarguments),
+                                   cores=2 * shards, memory=2048 * shards)]
+        def unittestTask(suite):
+            return _jvmciModeTask(self.name + ': hosted-product ' + suite, 'hosted',
+                                  lambda cwd: unittest(['--suite', suite, '--fail-fast'] + self.args + _noneAsEmptyList(extraVMarguments)),
+                                  cores=4, memory=4096)
+        return [unittestTask(suite) for suite in suites]
+
 class BootstrapTest:
     def __init__(self, name, vmbuild, args, suppress=None):
         self.name = name
@@ -215,12 +300,20 @@ class BootstrapTest:
     def run(self, tasks, extraVMarguments=None):
         with JVMCIMode('jit'):
             with Task(self.name, tasks) as t:
-                if t:
-                    if self.suppress:
-                        out = mx.DuplicateSuppressingStream(self.suppress).write
-                    else:
-                        out = None
-                    run_vm(self.args + _noneAsEmptyList(extraVMarguments) + ['-XX:-TieredCompilation', '-XX:+BootstrapJVMCI', '-version'], out=out)
+                if t: self._bootstrap(extraVMarguments)
+
+    def _bootstrap(self, extraVMarguments):
+        if self.suppress:
+            # the output of a batch task goes to the log of its job
+            out = mx.DuplicateSuppressingStream(self.suppress, jobOutput()).write
+        else:
+            out = None
+        # the bootstraps of a batch run at once and must not abort each other (see parallelvms.fail)
+        if run_vm(self.args + _noneAsEmptyList(extraVMarguments) + ['-XX:-TieredCompilation', '-XX:+BootstrapJVMCI', '-version'], nonZeroIsFatal=False, out=out) != 0:
+            fail(self.name + ' failed')
+
+    def gateTask(self, extraVMarguments=None, deps=None):
+        return _jvmciModeTask(self.name, 'jit', lambda cwd: self._bootstrap(extraVMarguments), deps=deps, cores=2, memory=2048, batch='Bootstrap')
 
 class MicrobenchRun:
     def __init__(self, name, args):
@@ -229,50 +322,73 @@ class MicrobenchRun:
 
     def run(self, tasks, extraVMarguments=None):
         with Task(self.name + ': hosted-product ', tasks) as t:
-            if t: microbench(_noneAsEmptyList(extraVMarguments) + ['--'] + self.args)
+            if t: microbench(['--noresultdb'] + _noneAsEmptyList(extraVMarguments) + ['--'] + self.args)
 
-def compiler_gate_runner(suites, unit_test_runs, bootstrap_tests, tasks, extraVMarguments=None):
+    def gateTask(self, extraVMarguments=None):
+        return _jvmciModeTask(self.name + ': hosted-product ', 'hosted',
+                              lambda cwd: microbench(['--noresultdb'] + _noneAsEmptyList(extraVMarguments) + ['--'] + self.args),
+                              cores=2, memory=2048)
+
+def _sanityTestTask(test, title, vm='jvmci', jvmciMode=None, extraVmOpts=None, deps=None):
+    """
+    Creates a GateTask running 'test' as a sanity test in its own scratch
+    directory (unless the test has a working directory of its own).
+    """
+    from gatescheduler import GateTask
+    def run(cwd):
+        if not test.test(vm, cwd=cwd, extraVmOpts=extraVmOpts):
+            fail(test.name + ' Failed')
+    if jvmciMode:
+        return _jvmciModeTask(title, jvmciMode, run, deps=deps, cores=2, memory=2048, scratch=test.defaultCwd is None)
+    return GateTask(title, run, deps=deps, cores=2, memory=2048, scratch=test.defaultCwd is None)
+
+def compiler_gate_tasks(suites, unit_test_runs, bootstrap_tests, extraVMarguments=None):
+    """
+    Gets the task graph of the compiler gate. The tasks needing Graal as the
+    JIT compiler depend on the first bootstrap test as none of them can pass
+    if Graal cannot even bootstrap.
+    """
+    gateTasks = []
 
     # Run unit tests in hosted mode
-    with JVMCIMode('hosted'):
-        for r in unit_test_runs:
-            r.run(suites, tasks, extraVMarguments)
+    for r in unit_test_runs:
+        gateTasks.extend(r.gateTasks(suites, extraVMarguments))
 
     # Run microbench in hosted mode (only for testing the JMH setup)
-    with JVMCIMode('hosted'):
-        for r in [MicrobenchRun('Microbench', ['TestJMH'])]:
-            r.run(tasks, extraVMarguments)
+    for r in [MicrobenchRun('Microbench', ['TestJMH'])]:
+        gateTasks.append(r.gateTask(extraVMarguments))
 
     # Run ctw against rt.jar on server-hosted-jvmci
-    with JVMCIMode('hosted'):
-        with Task('CTW:hosted', tasks) as t:
-            if t: ctw(['--ctwopts', '-Inline +ExitVMOnException', '-esa', '-G:+CompileTheWorldMultiThreaded', '-G:-InlineDuringParsing', '-G:-CompileTheWorldVerbose', '-XX:ReservedCodeCacheSize=300m'], _noneAsEmptyList(extraVMarguments))
+    gateTasks.append(_jvmciModeTask('CTW:hosted', 'hosted',
+                                    lambda cwd: ctw(['--ctwopts', '-Inline +ExitVMOnException', '-esa', '-G:+CompileTheWorldMultiThreaded', '-G:-InlineDuringParsing', '-G:-CompileTheWorldVerbose', '-XX:ReservedCodeCacheSize=300m'], _noneAsEmptyList(extraVMarguments)),
+                                    cores=4, memory=2048))
 
     # bootstrap tests
+    bootstrap = []
     for b in bootstrap_tests:
-        b.run(tasks, extraVMarguments)
+        gateTasks.append(b.gateTask(extraVMarguments, deps=bootstrap[:1]))
+        bootstrap.append(gateTasks[-1])
 
     # run dacapo sanitychecks
-    for test in sanitycheck.getDacapos(level=sanitycheck.SanityCheckLevel.Gate, gateBuildLevel='release', extraVmArguments=extraVMarguments) \
-            + sanitycheck.getScalaDacapos(level=sanitycheck.SanityCheckLevel.Gate, gateBuildLevel='release', extraVmArguments=extraVMarguments):
-        with Task(str(test) + ':' + 'release', tasks) as t:
-            if t and not test.test('jvmci'):
-                t.abort(test.name + ' Failed')
+    tests = sanitycheck.getDacapos(level=sanitycheck.SanityCheckLevel.Gate, gateBuildLevel='release', extraVmArguments=extraVMarguments) \
+            + sanitycheck.getScalaDacapos(level=sanitycheck.SanityCheckLevel.Gate, gateBuildLevel='release', extraVmArguments=extraVMarguments)
+    for test in tests:
+        gateTasks.append(_sanityTestTask(test, str(test) + ':release', deps=bootstrap[:1]))
 
     # ensure -Xbatch still works
-    with JVMCIMode('jit'):
-        with Task('DaCapo_pmd:BatchMode', tasks) as t:
-            if t: dacapo(_noneAsEmptyList(extraVMarguments) + ['-Xbatch', 'pmd'])
+    gateTasks.append(_sanityTestTask(sanitycheck.getDacapo('pmd'), 'DaCapo_pmd:BatchMode', get_vm(), 'jit', _noneAsEmptyList(extraVMarguments) + ['-Xbatch'], deps=bootstrap[:1]))
 
     # ensure benchmark counters still work
-    with JVMCIMode('jit'):
-        with Task('DaCapo_pmd:BenchmarkCounters:product', tasks) as t:
-            if t: dacapo(_noneAsEmptyList(extraVMarguments) + ['-G:+LIRProfileMoves', '-G:+GenericDynamicCounters', '-XX:JVMCICounterSize=10', 'pmd'])
+    gateTasks.append(_sanityTestTask(sanitycheck.getDacapo('pmd'), 'DaCapo_pmd:BenchmarkCounters:product', get_vm(), 'jit', _noneAsEmptyList(extraVMarguments) + ['-G:+LIRProfileMoves', '-G:+GenericDynamicCounters', '-XX:JVMCICounterSize=10'], deps=bootstrap[:1]))
 
     # ensure -Xcomp still works
-    with JVMCIMode('jit'):
-        with Task('XCompMode:product', tasks) as t:
-            if t: run_vm(_noneAsEmptyList(extraVMarguments) + ['-Xcomp', '-version'])
+    gateTasks.append(_jvmciModeTask('XCompMode:product', 'jit', lambda cwd: run_vm(_noneAsEmptyList(extraVMarguments) + ['-Xcomp', '-version']), deps=bootstrap[:1]))
+
+    return gateTasks
+
+def compiler_gate_runner(suites, unit_test_runs, bootstrap_tests, tasks, extraVMarguments=None):
+    import gatescheduler
+    gatescheduler.runGateTasks(compiler_gate_tasks(suites, unit_test_runs, bootstrap_tests, extraVMarguments), tasks)
 
 
 graal_unit_test_runs = [
@@ -322,6 +438,16 @@ graal_simple_bootstrap_tests = [
 
 
 def _graal_gate_runner(args, tasks):
+    import gatescheduler, unittestshards
+    if args.sanitycheck_fail_fast:
+        sanitycheck.failFastMode = True
+    if args.gate_jobs or args.sanitycheck_jobs:
+        # the DaCapo sanity checks are scheduled with the other gate tasks
+        gatescheduler.parallelJobs = args.gate_jobs or args.sanitycheck_jobs
+    if args.unittest_shards:
+        unittestshards.shardCount = args.unittest_shards
+    if args.batch_jobs:
+        gatescheduler.batchJobs = args.batch_jobs
     if args.simple:
         compiler_simple_gate_runner(['graal-core', 'truffle'], graal_unit_test_runs, graal_simple_bootstrap_tests, tasks, args.extra_vm_argument)
     else:
@@ -330,13 +456,79 @@ def _graal_gate_runner(args, tasks):
 mx_gate.add_gate_runner(_suite, _graal_gate_runner)
 mx_gate.add_gate_argument('--extra-vm-argument', action='append', help='add extra vm argument to gate tasks if applicable (multiple occurrences allowed)')
 mx_gate.add_gate_argument('--simple', action='store_true', help='only run simple task set')
+mx_gate.add_gate_argument('--sanitycheck-fail-fast', action='store_true', help='terminate a sanity check VM as soon as a failure shows up in its output')
+mx_gate.add_gate_argument('--sanitycheck-jobs', action='store', type=int, help='same as --gate-jobs', metavar='<n>')
+mx_gate.add_gate_argument('--unittest-shards', action='store', type=int, help='number of VMs the unit tests are split across (default: 1)', metavar='<n>')
+mx_gate.add_gate_argument('--batch-jobs', action='store', type=int, help='number of tasks of a batch (e.g. the bootstrap tests) to run at once (default: 1)', metavar='<n>')
+mx_gate.add_gate_argument('--gate-jobs', action='store', type=int, help='number of independent gate tasks to run at once (default: 1)', metavar='<n>')
 
 def _unittest_vm_launcher(vmArgs, mainClass, mainClassArgs):
     run_vm(vmArgs + [mainClass] + mainClassArgs)
 
 mx_unittest.set_vm_launcher('JDK9 VM launcher', _unittest_vm_launcher)
 
+"""
+The most recently used results of _parseVmArgs, keyed by its arguments and
+the state they depend on (see _parseVmArgsKey). At most
+'_parsedVmArgsLimit' results are kept.
+"""
+_parsedVmArgs = collections.OrderedDict()
+_parsedVmArgsLimit = 64
+
+def _parseVmArgsKey(jdk, args, addDefaultArgs):
+    """
+    Gets the key of the _parsedVmArgs entry for the given arguments. Besides
+    the arguments, the key includes the JVMCI mode and the path and
+    modification time of each boot class path distribution so that a mode
+    switch or rebuilt distribution is never served from the cache.
+    """
+    bcpDists = [mx.distribution('truffle:TRUFFLE_API')]
+    if _jvmciModes[get_jvmci_mode()]:
+        bcpDists.extend([d.dist() for d in _bootClasspathDists])
+    stamps = tuple([(d.path, os.path.getmtime(d.path) if exists(d.path) else None) for d in bcpDists])
+    jacocoArgs = tuple(_noneAsEmptyList(mx_gate.get_jacoco_agent_args()))
+    return (jdk.home, tuple(args), addDefaultArgs, get_jvmci_mode(), _compilers[-1], jacocoArgs, stamps, _useSharedArchive)
+
 def _parseVmArgs(jdk, args, addDefaultArgs=True):
+    """
+    Translates 'args' into the arguments of the java launcher of 'jdk'. The
+    result is memoized as the same VM arguments are parsed for many VM
+    launches (e.g. in the gate).
+    """
+    _warnVmArgs(args)
+    key = _parseVmArgsKey(jdk, args, addDefaultArgs)
+    parsed = _parsedVmArgs.pop(key, None)
+    if parsed is None:
+        parsed = _doParseVmArgs(jdk, args, addDefaultArgs)
+        if len(_parsedVmArgs) >= _parsedVmArgsLimit:
+            # evict the least recently used result
+            _parsedVmArgs.popitem(last=False)
+    _parsedVmArgs[key] = parsed
+    return list(parsed)
+
+def _warnVmArgs(args):
+    """
+    Warns about VM arguments in 'args' that may not have the intended effect.
+    This is done for every VM launch, including those whose parsed arguments
+    are taken from _parsedVmArgs.
+    """
+    if '-G:+PrintFlags' in args and '-Xcomp' not in args:
+        mx.warn('Using -G:+PrintFlags may have no effect without -Xcomp as Graal initialization is lazy')
+    if '-version' in args:
+        ignoredArgs = args[args.index('-version') + 1:]
+        if  len(ignoredArgs) > 0:
+            mx.log("Warning: The following options will be ignored by the vm because they come after the '-version' argument: " + ' '.join(ignoredArgs))
+
+def _bootClasspath():
+    """
+    Gets the entries VMs put on the boot class path in the current JVMCI mode.
+    """
+    bcp = [mx.distribution('truffle:TRUFFLE_API').classpath_repr()]
+    if _jvmciModes[get_jvmci_mode()]:
+        bcp.extend([d.get_classpath_repr() for d in _bootClasspathDists])
+    return bcp
+
+def _doParseVmArgs(jdk, args, addDefaultArgs):
     args = mx.expand_project_in_args(args, insitu=False)
     jacocoArgs = mx_gate.get_jacoco_agent_args()
     if jacocoArgs:
@@ -359,12 +551,11 @@ def _parseVmArgs(jdk, args, addDefaultArgs=True):
         return arg
     args = map(translateGOption, args)
 
-    if '-G:+PrintFlags' in args and '-Xcomp' not in args:
-        mx.warn('Using -G:+PrintFlags may have no effect without -Xcomp as Graal initialization is lazy')
-
-    bcp = [mx.distribution('truffle:TRUFFLE_API').classpath_repr()]
-    if _jvmciModes[_vm.jvmciMode]:
-        bcp.extend([d.get_classpath_repr() for d in _bootClasspathDists])
+    bcp = _bootClasspath()
+    if _useSharedArchive and not [a for a in args if a.startswith('-Xshare:') or a.startswith('-XX:SharedArchiveFile=') or a.startswith('-XX:DumpLoadedClassList=')]:
+        archive = _sharedArchive(jdk, bcp)
+        if archive:
+            args = ['-XX:+UnlockDiagnosticVMOptions', '-XX:SharedArchiveFile=' + archive, '-Xshare:auto'] + args
 
     args = ['-Xbootclasspath/p:' + os.pathsep.join(bcp)] + args
 
@@ -378,20 +569,211 @@ def _parseVmArgs(jdk, args, addDefaultArgs=True):
     # Set the default JVMCI compiler
     jvmciCompiler = _compilers[-1]
     args = ['-Djvmci.compiler=' + jvmciCompiler] + args
-
-    if '-version' in args:
-        ignoredArgs = args[args.index('-version') + 1:]
-        if  len(ignoredArgs) > 0:
-            mx.log("Warning: The following options will be ignored by the vm because they come after the '-version' argument: " + ' '.join(ignoredArgs))
     return jdk.processArgs(args, addDefaultArgs=addDefaultArgs)
 
 def run_java(jdk, args, nonZeroIsFatal=True, out=None, err=None, cwd=None, timeout=None, env=None, addDefaultArgs=True):
 
     args = _parseVmArgs(jdk, args, addDefaultArgs=addDefaultArgs)
-
-    jvmciModeArgs = _jvmciModes[_vm.jvmciMode]
-    cmd = [jdk.java] + ['-' + get_vm()] + jvmciModeArgs + args
-    return mx.run(cmd, nonZeroIsFatal=nonZeroIsFatal, out=out, err=err, cwd=cwd)
+    out, err = captureOutput(out, err)
+    # a job reports a failed VM with a JobFailure instead of mx.abort (see parallelvms.fail)
+    inJob = currentJob() is not None
+
+    jvmciModeArgs = _jvmciModes[get_jvmci_mode()]
+    cmd = [jdk.java] + ['-' + get_vm()] + jvmciModeArgs
+    if sum([len(arg) + 1 for arg in cmd + args]) > _argFileThreshold and _supportsArgFiles(jdk):
+        properties, args = _extractSystemProperties(args)
+        argFile = _writeArgFile(args)
+        try:
+            retcode = mx.run(cmd + properties + ['@' + argFile], nonZeroIsFatal=nonZeroIsFatal and not inJob, out=out, err=err, cwd=cwd)
+        finally:
+            os.remove(argFile)
+    else:
+        retcode = mx.run(cmd + args, nonZeroIsFatal=nonZeroIsFatal and not inJob, out=out, err=err, cwd=cwd)
+    if retcode != 0 and nonZeroIsFatal:
+        fail(jdk.java + ' exited with code ' + str(retcode))
+    return retcode
+
+"""
+Length of a java command line above which its arguments are passed in an
+argument file (@argfile) if the JDK supports it. Long class paths can
+exceed the command line limit of the OS (32K characters on Windows) and
+make spawning the process more expensive.
+"""
+_argFileThreshold = int(mx.get_env('MX_ARGFILE_THRESHOLD', '32000'))
+
+_argFileSupport = {}
+
+def _supportsArgFiles(jdk):
+    """
+    Determines if the java launcher of 'jdk' expands @argfiles, which early
+    JDK9 builds do not.
+    """
+    supported = _argFileSupport.get(jdk.home)
+    if supported is None:
+        argFile = _writeArgFile(['-version'])
+        try:
+            supported = mx.run([jdk.java, '@' + argFile], nonZeroIsFatal=False, out=lambda line: None, err=lambda line: None) == 0
+        finally:
+            os.remove(argFile)
+        _argFileSupport[jdk.home] = supported
+        if not supported:
+            mx.log('The java launcher of ' + jdk.home + ' does not support @argfiles')
+    return supported
+
+"""
+VM options that take the next argument as their value.
+"""
+_vmOptionsWithValue = ['-cp', '-classpath', '-addmods', '-limitmods', '-mp', '-modulepath', '-upgrademodulepath']
+
+def _extractSystemProperties(args):
+    """
+    Splits the system properties (-D options) off the VM options in 'args'
+    and returns them and the remaining arguments. System properties stay on
+    the command line when the other arguments are passed in an argfile as
+    they can identify a VM process (see sanitycheck.TerminatableVM).
+    """
+    properties = []
+    rest = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if not arg.startswith('-') or arg in ['-jar', '-m']:
+            # the main class (or module) and the program arguments follow
+            break
+        if arg.startswith('-D'):
+            properties.append(arg)
+        else:
+            rest.append(arg)
+            if arg in _vmOptionsWithValue and i + 1 < len(args):
+                i += 1
+                rest.append(args[i])
+        i += 1
+    return properties, rest + args[i:]
+
+def _writeArgFile(args):
+    """
+    Writes 'args' to a temporary argument file, one quoted argument per line.
+    """
+    fd, argFile = tempfile.mkstemp(prefix='mx_graal_', suffix='.args')
+    with os.fdopen(fd, 'w') as fp:
+        for arg in args:
+            fp.write('"' + arg.replace('\\', '\\\\').replace('"', '\\"') + '"\n')
+    return argFile
+
+"""
+Determines if VMs use a class data sharing archive of the classes loaded
+while Graal bootstraps (see cdsarchive). Set by the --cds option and
+defaults to the value of the GRAAL_CDS environment variable.
+"""
+_useSharedArchive = mx.get_env('GRAAL_CDS', 'false').lower() == 'true'
+
+_sharedArchiveLock = threading.Lock()
+
+def _sharedArchivePath(jdk, bcp):
+    """
+    Gets the path of the class data sharing archive for 'jdk' and the boot
+    class path 'bcp'. Its name includes a hash of the JDK and one of the size
+    and modification time of each boot class path entry so that rebuilding a
+    jar selects a new archive (the VM refuses an archive whose jars changed).
+    """
+    digest = hashlib.sha1()
+    for entry in bcp:
+        digest.update(entry)
+        if exists(entry):
+            st = os.stat(entry)
+            digest.update(' {} {!r}\n'.format(st.st_size, st.st_mtime))
+    jdkHash = hashlib.sha1(jdk.home).hexdigest()[:10]
+    return join(_suite.get_output_root(), 'cds', jdkHash + '-' + digest.hexdigest()[:16] + '.jsa')
+
+def _sharedArchive(jdk, bcp, force=False):
+    """
+    Gets the class data sharing archive for 'jdk' and 'bcp', creating it if
+    it does not exist or 'force' is true. Returns None if the archive cannot
+    be created or used with 'jdk'. This is remembered for 'jdk' so that VMs
+    fall back to running without an archive until cdsarchive is run again.
+    """
+    path = _sharedArchivePath(jdk, bcp)
+    cdsDir = dirname(path)
+    jdkHash = basename(path).split('-')[0]
+    unsupported = join(cdsDir, jdkHash + '.unsupported')
+    with _sharedArchiveLock:
+        if not force:
+            if exists(path):
+                return path
+            if exists(unsupported):
+                return None
+        mx.ensure_dir_exists(cdsDir)
+        mx.log('Creating class data sharing archive ' + path)
+        reason = _createSharedArchive(jdk, path)
+        if reason:
+            with open(unsupported, 'w') as fp:
+                fp.write(reason)
+            mx.warn('Running VMs without class data sharing archive as ' + reason)
+            return None
+        # archives of previous builds of the jars are no longer usable
+        for name in os.listdir(cdsDir):
+            if name.startswith(jdkHash) and join(cdsDir, name) != path:
+                os.remove(join(cdsDir, name))
+        return path
+
+def _createSharedArchive(jdk, path):
+    """
+    Creates the class data sharing archive 'path' from the classes loaded by
+    a bootstrap of Graal (or just the start-up of the VM if JVMCI is
+    disabled). Returns the reason why this failed or None.
+    """
+    classList = path[:-len('.jsa')] + '.classlist'
+    tmp = path + '.tmp'
+    output = []
+    def run(args, jvmciMode=None):
+        del output[:]
+        with JVMCIMode(jvmciMode):
+            return run_java(jdk, args, nonZeroIsFatal=False, out=output.append, err=output.append)
+    def failure(step):
+        return step + ':\n' + ''.join(output[-20:])
+    if _jvmciModes[get_jvmci_mode()]:
+        record = (['-XX:-TieredCompilation', '-XX:+BootstrapJVMCI', '-version'], 'jit')
+    else:
+        record = (['-version'], None)
+    try:
+        if run(['-XX:DumpLoadedClassList=' + classList] + record[0], record[1]) != 0:
+            return failure('recording the loaded classes failed')
+        if run(['-XX:+UnlockDiagnosticVMOptions', '-XX:SharedClassListFile=' + classList, '-XX:SharedArchiveFile=' + tmp, '-Xshare:dump']) != 0:
+            return failure('dumping the archive failed')
+        if run(['-XX:+UnlockDiagnosticVMOptions', '-XX:SharedArchiveFile=' + tmp, '-Xshare:on', '-version']) != 0:
+            return failure('the archive cannot be used')
+        os.rename(tmp, path)
+        return None
+    finally:
+        for f in [classList, tmp]:
+            if exists(f):
+                os.remove(f)
+
+def sharedArchiveOptions():
+    """
+    Gets the VM options for using the class data sharing archive of the
+    current boot class path, creating the archive if necessary. Returns None
+    if the default JDK cannot use such an archive.
+    """
+    archive = _sharedArchive(_get_jdk(), _bootClasspath())
+    if archive is None:
+        return None
+    return ['-XX:+UnlockDiagnosticVMOptions', '-XX:SharedArchiveFile=' + archive, '-Xshare:auto']
+
+def cdsarchive(args):
+    """create a class data sharing archive of the classes loaded while Graal bootstraps
+
+    The archive includes the classes of the Graal and Truffle jars on the
+    boot class path. It is used by every VM if mx is run with --cds (or
+    GRAAL_CDS=true), which also creates it if it does not exist for the
+    current jars. If the JDK cannot create or use the archive, the VMs run
+    without it until this command succeeds."""
+    parser = ArgumentParser(prog='mx cdsarchive', description=cdsarchive.__doc__)
+    parser.parse_args(args)
+    archive = _sharedArchive(_get_jdk(), _bootClasspath(), force=True)
+    if archive is None:
+        mx.abort('Cannot create a class data sharing archive with ' + _get_jdk().home)
+    mx.log(archive)
 
 _JVMCI_JDK_TAG = 'jvmci'
 
@@ -405,7 +787,7 @@ class GraalJVMCI9JDKConfig(mx.JDKConfig):
 
 class GraalJDKFactory(mx.JDKFactory):
     def getJDKConfig(self):
-        return GraalJVMCI9JDKConfig(_jdk)
+        return GraalJVMCI9JDKConfig(_get_jdk())
 
     def description(self):
         return "JVMCI JDK with Graal"
@@ -417,7 +799,7 @@ mx.addJDKFactory(_JVMCI_JDK_TAG, mx.JavaCompliance('9'), GraalJDKFactory())
 def run_vm(args, vm=None, nonZeroIsFatal=True, out=None, err=None, cwd=None, timeout=None, debugLevel=None, vmbuild=None):
     """run a Java program by executing the java executable in a JVMCI JDK"""
 
-    return run_java(_jdk, args, nonZeroIsFatal=nonZeroIsFatal, out=out, err=err, cwd=cwd, timeout=timeout)
+    return run_java(_get_jdk(), args, nonZeroIsFatal=nonZeroIsFatal, out=out, err=err, cwd=cwd, timeout=timeout)
 
 class GraalArchiveParticipant:
     def __init__(self, dist):
@@ -450,29 +832,61 @@ class GraalArchiveParticipant:
 
 mx.update_commands(_suite, {
     'vm': [run_vm, '[-options] class [args...]'],
-    'ctw': [ctw, '[-vmoptions|noinline|nocomplex|full]'],
-    'microbench' : [microbench, '[VM options] [-- [JMH options]]'],
+    'ctw': [ctw, '[--shards n] [--profile] [--incremental] [-vmoptions|noinline|nocomplex|full]'],
+    'microbench' : [microbench, '[--list] [--resultfile file] [--detailsfile file] [--resultdb file|--noresultdb] [VM options] [-- [JMH options]]'],
+    'cdsarchive' : [cdsarchive, ''],
 })
 
 mx.add_argument('-M', '--jvmci-mode', action='store', choices=sorted(_jvmciModes.viewkeys()), help='the JVM variant type to build/run (default: ' + _vm.jvmciMode + ')')
 
+mx.add_argument('--cds', action='store_true', help='run VMs with a class data sharing archive of the classes loaded while Graal bootstraps (see cdsarchive)')
+
 def mx_post_parse_cmd_line(opts):
+    global _useSharedArchive
     if opts.jvmci_mode is not None:
         _vm.update(opts.jvmci_mode)
+    if opts.cds:
+        _useSharedArchive = True
     for dist in [d.dist() for d in _bootClasspathDists]:
         dist.set_archiveparticipant(GraalArchiveParticipant(dist))
 
+def _JVMCI_library_path():
+    return join(_suite.get_output_root(), abspath(mx_graal_core.jdkDescriptor.home)[1:], 'jvmci.jar')
+
+def _JVMCI_library_sha1(path):
+    """
+    Gets the SHA1 of 'path' or None if it does not exist. The SHA1 is cached
+    in a file next to 'path' and recomputed only if the size or modification
+    time of 'path' changed.
+    """
+    if not exists(path):
+        return None
+    st = os.stat(path)
+    key = '{} {!r}'.format(st.st_size, st.st_mtime)
+    stamp = path + '.stamp'
+    if exists(stamp):
+        with open(stamp) as fp:
+            cached = fp.read().rsplit(' ', 1)
+        if len(cached) == 2 and cached[0] == key:
+            return cached[1]
+    sha1 = mx.sha1OfFile(path)
+    with open(stamp, 'w') as fp:
+        fp.write(key + ' ' + sha1)
+    return sha1
+
 def _update_JVMCI_library():
     """
-    Updates the "path" and "sha1" attributes of the "JVMCI" library to
-    refer to a jvmci.jar created from the JVMCI classes in JDK9.
+    Creates jvmci.jar from the JVMCI classes in JDK9 if it does not exist or
+    is older than them and sets the "path" and "sha1" attributes of the
+    "JVMCI" library to refer to it. This is done when mx_graal_9 is loaded
+    and is cheap once jvmci.jar is up to date: the JDK is not started and the
+    SHA1 of jvmci.jar is cached (see _JVMCI_library_sha1).
     """
-    suiteDict = _suite.suiteDict
-    jvmciLib = suiteDict['libraries']['JVMCI']
-    d = join(_suite.get_output_root(), abspath(_jdk.home)[1:])
-    path = join(d, 'jvmci.jar')
+    path = _JVMCI_library_path()
+    d = dirname(path)
+    jdkHome = mx_graal_core.jdkDescriptor.home
 
-    explodedModule = join(_jdk.home, 'modules', 'jdk.vm.ci')
+    explodedModule = join(jdkHome, 'modules', 'jdk.vm.ci')
     if exists(explodedModule):
         jarInputs = {}
         newestJarInput = None
@@ -492,17 +906,53 @@ def _update_JVMCI_library():
                         contents = fp.read()
                         arc.zf.writestr(arcname, contents)
     else:
-        # Use the jdk.internal.jimage utility since it's the only way
-        # to partially read .jimage files as the JDK9 jimage tool
-        # does not support partial extraction.
-        bootmodules = join(_jdk.home, 'lib', 'modules', 'bootmodules.jimage')
+        bootmodules = join(jdkHome, 'lib', 'modules', 'bootmodules.jimage')
         if not exists(bootmodules):
             mx.abort('Could not find JVMCI classes at ' + bootmodules + ' or ' + explodedModule)
         if not exists(path) or mx.TimeStampFile(bootmodules).isNewerThan(path):
             mx.ensure_dir_exists(d)
-            javaSource = join(d, 'ExtractJVMCI.java')
-            with open(javaSource, 'w') as fp:
-                print >> fp, """import java.io.FileOutputStream;
+            import jimage
+            try:
+                _extract_JVMCI_classes(bootmodules, path)
+            except jimage.UnsupportedJImageError as e:
+                mx.log(str(e) + ', extracting the JVMCI classes with jdk.internal.jimage')
+                _extract_JVMCI_classes_with_java(bootmodules, path)
+            if not exists(path):
+                mx.abort('Could not find the JVMCI classes in ' + bootmodules)
+
+    jvmciLib = _suite.suiteDict['libraries']['JVMCI']
+    jvmciLib['path'] = path
+    jvmciLib['sha1'] = _JVMCI_library_sha1(path)
+
+def _extract_JVMCI_classes(bootmodules, path):
+    """
+    Writes the jdk.vm.ci module entries of the 'bootmodules' jimage to the
+    jar 'path' (if there are any) without starting a JVM.
+    """
+    import jimage, zipfile
+    prefix = '/jdk.vm.ci/'
+    tmp = path + '.tmp'
+    count = 0
+    try:
+        with jimage.JImage(bootmodules) as image:
+            with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for name, contents in image.resources(prefix):
+                    zf.writestr(name[len(prefix):], contents)
+                    count += 1
+        if count != 0:
+            os.rename(tmp, path)
+    finally:
+        if exists(tmp):
+            os.remove(tmp)
+
+def _extract_JVMCI_classes_with_java(bootmodules, path):
+    # Use the jdk.internal.jimage utility as it supports every jimage
+    # format and compression of the JDK while the JDK9 jimage tool
+    # does not support partial extraction.
+    d = dirname(path)
+    javaSource = join(d, 'ExtractJVMCI.java')
+    with open(javaSource, 'w') as fp:
+        print >> fp, """import java.io.FileOutputStream;
     import java.util.jar.JarEntry;
     import java.util.jar.JarOutputStream;
     import jdk.internal.jimage.BasicImageReader;
@@ -528,12 +978,7 @@ def _update_JVMCI_library():
     }
     }
     """
-            mx.run([_jdk.javac, '-d', d, javaSource])
-            mx.run([_jdk.java, '-cp', d, 'ExtractJVMCI', bootmodules, path])
-            if not exists(path):
-                mx.abort('Could not find the JVMCI classes in ' + bootmodules)
-
-    jvmciLib['path'] = path
-    jvmciLib['sha1'] = mx.sha1OfFile(path)
+    mx.run([_get_jdk().javac, '-d', d, javaSource])
+    mx.run([_get_jdk().java, '-cp', d, 'ExtractJVMCI', bootmodules, path])
 
 _update_JVMCI_library()
@@ -25,39 +25,198 @@
 # ----------------------------------------------------------------------------------------------------
 
 import sanitycheck
+import benchstats
 import itertools
 import json
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from os.path import join, exists, dirname
 
 import mx
 import mx_graal_core
-
-def _run_benchmark(args, availableBenchmarks, runBenchmark):
+from sanitycheck import _noneAsEmptyList
+
+def _extractOption(args, name, convert=None):
+    """
+    Removes option 'name' and the value following it from 'args' (up to a
+    '--' separator) and returns the value converted with 'convert'. Returns
+    None if the option is absent.
+    """
+    end = args.index('--') if '--' in args else len(args)
+    if name not in args[:end]:
+        return None
+    index = args.index(name)
+    if index + 1 >= end:
+        mx.abort(name + ' must be followed by a value')
+    value = args[index + 1]
+    del args[index:index + 2]
+    if convert:
+        try:
+            value = convert(value)
+        except ValueError:
+            mx.abort('Invalid value for ' + name + ': ' + value)
+    return value
+
+def _benchForks(test, vm, forks, extraVmOpts, store=None, run=None, details=None):
+    """
+    Runs 'test' as a benchmark in 'forks' consecutive VMs and returns the
+    scores of each execution as {group : {benchmark : [score, ...]}}. The
+    iteration scores and the steady-state iteration of each execution are
+    added to 'details' under 'iterations' and 'steadyState' as {group :
+    {benchmark : [value, ...]}}. The scores are recorded in 'store' for
+    'run' if a store is given.
+    """
+    samples = {}
+    for fork in range(forks):
+        if forks > 1:
+            mx.log('{}: fork {} of {}'.format(test.name, fork + 1, forks))
+        iterations = {}
+        steadyStates = {}
+        groups = test.bench(vm, extraVmOpts=extraVmOpts, iterations=iterations, steadyStates=steadyStates)
+        if store and groups:
+            store.addExecution(run, test.name, test.vmOpts + _noneAsEmptyList(extraVmOpts), groups, fork=fork, iterations=iterations)
+        for groupName, group in groups.iteritems():
+            for name, score in group.iteritems():
+                samples.setdefault(groupName, {}).setdefault(name, []).append(score)
+        if details is not None:
+            for key, values in [('iterations', iterations), ('steadyState', steadyStates)]:
+                for groupName, group in values.iteritems():
+                    for name, value in group.iteritems():
+                        details.setdefault(key, {}).setdefault(groupName, {}).setdefault(name, []).append(value)
+    return samples
+
+def _mergeSamples(samples, other):
+    for groupName, group in other.iteritems():
+        for name, scores in group.iteritems():
+            samples.setdefault(groupName, {}).setdefault(name, []).extend(scores)
+
+def _results(samples, details=None):
+    """
+    Creates the results ({group : {benchmark : score}}) from the scores of
+    one or more executions. If there is more than one score for a benchmark,
+    its score is the mean and the statistics of its scores are added to the
+    results under 'statistics'. The 'details' of each execution (see
+    _benchForks) are added as well. The details are only written to a
+    details file (see _writeResults).
+    """
+    results = dict(details or {})
+    statistics = {}
+    for groupName, group in samples.iteritems():
+        for name, scores in group.iteritems():
+            if len(scores) == 1:
+                results.setdefault(groupName, {})[name] = scores[0]
+            else:
+                stats = benchstats.summarize(scores)
+                results.setdefault(groupName, {})[name] = stats['mean']
+                statistics.setdefault(groupName, {})[name] = stats
+    if statistics:
+        results['statistics'] = statistics
+        mx.log('{:<16} {:<24} {:>3} {:>12} {:>12} {:>10} {:>27}'.format('group', 'benchmark', 'n', 'mean', 'median', 'stddev', '95% confidence interval'))
+        for groupName, group in sorted(statistics.iteritems()):
+            for name, stats in sorted(group.iteritems()):
+                mx.log('{:<16} {:<24} {:>3} {:>12.2f} {:>12.2f} {:>10.2f} {:>13.2f} - {:<11.2f}'.format(groupName, name, stats['n'], stats['mean'], stats['median'], stats['stddev'], stats['ci95'][0], stats['ci95'][1]).rstrip())
+                if stats['outliers']:
+                    mx.warn('{} {}: outlier scores {}'.format(groupName, name, ', '.join([str(v) for v in stats['outliers']])))
+    return results
+
+def _writeResults(results, resultFile, detailsFile=None):
+    """
+    Writes the scores of 'results' ({group : {benchmark : score}}) to the log
+    and to 'resultFile' and, if requested, the scores along with the details
+    of 'results' to 'detailsFile' (see benchresults.detailKeys).
+    """
+    import benchresults
+    scores = benchresults.scoreGroups(results)
+    mx.log(json.dumps(scores))
+    if resultFile:
+        with open(resultFile, 'w') as f:
+            f.write(json.dumps(scores))
+    if detailsFile:
+        details = benchresults.details(results)
+        details['scores'] = scores
+        with open(detailsFile, 'w') as f:
+            f.write(json.dumps(details))
+
+def _extractForks(args):
+    """
+    Removes the -forks option from 'args' and returns its value or None if
+    it is absent. Aborts if the value is less than 1.
+    """
+    forks = _extractOption(args, '-forks', int)
+    if forks is not None and forks < 1:
+        mx.abort('-forks must be at least 1')
+    return forks
+
+def _extractFlag(args, name):
+    """
+    Removes flag 'name' from 'args' (up to a '--' separator) and returns
+    whether it was present.
+    """
+    end = args.index('--') if '--' in args else len(args)
+    if name not in args[:end]:
+        return False
+    args.remove(name)
+    return True
+
+def _run_benchmark(args, availableBenchmarks, createTest, sanityTest=False, createAdaptiveTest=None):
+    """
+    Runs the benchmarks selected by 'args' that are created by 'createTest(bm,
+    harnessArgs)'. If 'availableBenchmarks' is None, a single composite
+    benchmark is run instead. Unless forks or a result file are requested,
+    the tests run as sanity tests if 'sanityTest' is true. With -adaptive,
+    the tests are created by 'createAdaptiveTest' and run as benchmarks.
+    """
+    forks = _extractForks(args)
+    resultFile = _extractOption(args, '-resultfile')
+    detailsFile = _extractOption(args, '-detailsfile')
+    if createAdaptiveTest and _extractFlag(args, '-adaptive'):
+        createTest = createAdaptiveTest
+        if forks is None:
+            forks = 1
 
     vmOpts, benchmarksAndOptions = mx.extract_VM_args(args, useDoubleDash=availableBenchmarks is None)
 
     if availableBenchmarks is None:
         harnessArgs = benchmarksAndOptions
-        return runBenchmark(None, harnessArgs, vmOpts)
+        benchmarks = [None]
+    else:
+        if len(benchmarksAndOptions) == 0:
+            mx.abort('at least one benchmark name or "all" must be specified')
+        benchmarks = list(itertools.takewhile(lambda x: not x.startswith('-'), benchmarksAndOptions))
+        harnessArgs = benchmarksAndOptions[len(benchmarks):]
 
-    if len(benchmarksAndOptions) == 0:
-        mx.abort('at least one benchmark name or "all" must be specified')
-    benchmarks = list(itertools.takewhile(lambda x: not x.startswith('-'), benchmarksAndOptions))
-    harnessArgs = benchmarksAndOptions[len(benchmarks):]
+        if 'all' in benchmarks:
+            benchmarks = availableBenchmarks
+        else:
+            for bm in benchmarks:
+                if bm not in availableBenchmarks:
+                    mx.abort('unknown benchmark: ' + bm + '\nselect one of: ' + str(availableBenchmarks))
 
-    if 'all' in benchmarks:
-        benchmarks = availableBenchmarks
-    else:
+    vm = mx_graal_core.get_vm()
+    if forks is None and resultFile is None and detailsFile is None:
+        failed = []
         for bm in benchmarks:
-            if bm not in availableBenchmarks:
-                mx.abort('unknown benchmark: ' + bm + '\nselect one of: ' + str(availableBenchmarks))
-
-    failed = []
+            test = createTest(bm, harnessArgs)
+            if sanityTest:
+                passed = test.test(vm, extraVmOpts=vmOpts)
+            else:
+                passed = test.bench(vm, extraVmOpts=vmOpts)
+            if not passed:
+                failed.append(test.name)
+        if len(failed) != 0:
+            mx.abort('Benchmark failures: ' + str(failed))
+        return
+
+    samples = {}
+    details = {}
     for bm in benchmarks:
-        if not runBenchmark(bm, harnessArgs, vmOpts):
-            failed.append(bm)
-
-    if len(failed) != 0:
-        mx.abort('Benchmark failures: ' + str(failed))
+        _mergeSamples(samples, _benchForks(createTest(bm, harnessArgs), vm, 1 if forks is None else forks, vmOpts, details=details))
+    _writeResults(_results(samples, details), resultFile, detailsFile)
 
 def deoptalot(args):
     """bootstrap a VM with DeoptimizeALot and VerifyOops on
@@ -80,20 +239,30 @@ def longtests(args):
     dacapo(['100', 'eclipse', '-esa'])
 
 def dacapo(args):
-    """run one or more DaCapo benchmarks"""
+    """run one or more DaCapo benchmarks
+
+    With -forks n, each benchmark is run in n VMs and the statistics of its
+    scores are reported (and written to the file given with -detailsfile).
+    With -adaptive, each benchmark is run until its iteration times reach a
+    steady state instead of for a fixed number of iterations."""
 
-    def launcher(bm, harnessArgs, extraVmOpts):
-        return sanitycheck.getDacapo(bm, harnessArgs).test(mx_graal_core.get_vm(), extraVmOpts=extraVmOpts)
+    def createAdaptiveTest(bm, harnessArgs):
+        return sanitycheck.getDacapo(bm, ['-n', str(sanitycheck.steadyStateMaxIterations)] + harnessArgs, adaptive=True)
 
-    _run_benchmark(args, sanitycheck.dacapoSanityWarmup.keys(), launcher)
+    _run_benchmark(args, sanitycheck.dacapoSanityWarmup.keys(), sanitycheck.getDacapo, sanityTest=True, createAdaptiveTest=createAdaptiveTest)
 
 def scaladacapo(args):
-    """run one or more Scala DaCapo benchmarks"""
+    """run one or more Scala DaCapo benchmarks
 
-    def launcher(bm, harnessArgs, extraVmOpts):
-        return sanitycheck.getScalaDacapo(bm, harnessArgs).test(mx_graal_core.get_vm(), extraVmOpts=extraVmOpts)
+    With -forks n, each benchmark is run in n VMs and the statistics of its
+    scores are reported (and written to the file given with -detailsfile).
+    With -adaptive, each benchmark is run until its iteration times reach a
+    steady state instead of for a fixed number of iterations."""
 
-    _run_benchmark(args, sanitycheck.dacapoScalaSanityWarmup.keys(), launcher)
+    def createAdaptiveTest(bm, harnessArgs):
+        return sanitycheck.getScalaDacapo(bm, ['-n', str(sanitycheck.steadyStateMaxIterations)] + harnessArgs, adaptive=True)
+
+    _run_benchmark(args, sanitycheck.dacapoScalaSanityWarmup.keys(), sanitycheck.getScalaDacapo, sanityTest=True, createAdaptiveTest=createAdaptiveTest)
 
 
 """
@@ -104,25 +273,43 @@ extraBenchmarks = []
 def bench(args):
     """run benchmarks and parse their output for results
 
-    Results are JSON formated : {group : {benchmark : score}}."""
-    resultFile = None
-    if '-resultfile' in args:
-        index = args.index('-resultfile')
-        if index + 1 < len(args):
-            resultFile = args[index + 1]
-            del args[index]
-            del args[index]
-        else:
-            mx.abort('-resultfile must be followed by a file name')
-    resultFileCSV = None
-    if '-resultfilecsv' in args:
-        index = args.index('-resultfilecsv')
-        if index + 1 < len(args):
-            resultFileCSV = args[index + 1]
-            del args[index]
-            del args[index]
-        else:
-            mx.abort('-resultfilecsv must be followed by a file name')
+    Results are JSON formated : {group : {benchmark : score}}. With -forks n,
+    each benchmark is run in n VMs and its score is the mean of its scores.
+    With -adaptive, the DaCapo benchmarks run until their iteration times
+    reach a steady state (see sanitycheck.SteadyStateListener) and their
+    score is the steady-state score. All scores are also recorded in the
+    benchmark result database (see benchquery) unless -noresultdb is given.
+
+    With -detailsfile file, the results are written to file under 'scores'
+    along with the statistics of the scores of each benchmark run in several
+    VMs ('statistics'), the scores of all iterations of the DaCapo benchmarks
+    and of ctw-throughput (the compile throughput of CompileTheWorld
+    iterations over a fixed corpus) as {group : {benchmark : [[score, ...]
+    per VM]}} ('iterations'), the iteration at which each adaptive benchmark
+    reached a steady state ('steadyState') and the state of the host
+    ('host').
+
+    Before running the benchmarks, the state of the host (load, CPU
+    frequency governor, turbo boost, available memory and transparent huge
+    pages) is recorded in the details and in the result database (see
+    hostcheck). With -hostcheck measure, the competing processes and the
+    noise of a calibration loop are measured and recorded as well. If the
+    host is noisy, -hostcheck wait waits for it to become quiet and
+    -hostcheck refuse aborts instead of just recording this. Both measure
+    the host like -hostcheck measure."""
+    command = ['bench'] + args
+    resultFile = _extractOption(args, '-resultfile')
+    detailsFile = _extractOption(args, '-detailsfile')
+    resultFileCSV = _extractOption(args, '-resultfilecsv')
+    resultDb = _extractOption(args, '-resultdb')
+    forks = _extractForks(args)
+    if forks is None:
+        forks = 1
+    noResultDb = _extractFlag(args, '-noresultdb')
+    adaptive = _extractFlag(args, '-adaptive')
+    hostPolicy = _extractOption(args, '-hostcheck') or 'record'
+    if _extractFlag(args, '-failfast'):
+        sanitycheck.failFastMode = True
     vm = mx_graal_core.get_vm()
     if len(args) is 0:
         args = ['all']
@@ -133,11 +320,10 @@ def bench(args):
         prefix = group + ':'
         return [a[len(prefix):] for a in args if a.startswith(prefix)]
 
-    results = {}
     benchmarks = []
     # DaCapo
     if 'dacapo' in args or 'all' in args:
-        benchmarks += sanitycheck.getDacapos(level=sanitycheck.SanityCheckLevel.Benchmark)
+        benchmarks += sanitycheck.getDacapos(level=sanitycheck.SanityCheckLevel.Benchmark, adaptive=adaptive)
     else:
         dacapos = benchmarks_in_group('dacapo')
         for dacapo in dacapos:
@@ -145,10 +331,12 @@ def bench(args):
                 mx.abort('Unknown DaCapo : ' + dacapo)
             iterations = sanitycheck.dacapoSanityWarmup[dacapo][sanitycheck.SanityCheckLevel.Benchmark]
             if iterations > 0:
-                benchmarks += [sanitycheck.getDacapo(dacapo, ['-n', str(iterations)])]
+                if adaptive:
+                    iterations = sanitycheck.steadyStateMaxIterations
+                benchmarks += [sanitycheck.getDacapo(dacapo, ['-n', str(iterations)], adaptive=adaptive)]
 
     if 'scaladacapo' in args or 'all' in args:
-        benchmarks += sanitycheck.getScalaDacapos(level=sanitycheck.SanityCheckLevel.Benchmark)
+        benchmarks += sanitycheck.getScalaDacapos(level=sanitycheck.SanityCheckLevel.Benchmark, adaptive=adaptive)
     else:
         scaladacapos = benchmarks_in_group('scaladacapo')
         for scaladacapo in scaladacapos:
@@ -156,7 +344,9 @@ def bench(args):
                 mx.abort('Unknown Scala DaCapo : ' + scaladacapo)
             iterations = sanitycheck.dacapoScalaSanityWarmup[scaladacapo][sanitycheck.SanityCheckLevel.Benchmark]
             if iterations > 0:
-                benchmarks += [sanitycheck.getScalaDacapo(scaladacapo, ['-n', str(iterations)])]
+                if adaptive:
+                    iterations = sanitycheck.steadyStateMaxIterations
+                benchmarks += [sanitycheck.getScalaDacapo(scaladacapo, ['-n', str(iterations)], adaptive=adaptive)]
 
     # Bootstrap
     if 'bootstrap' in args or 'all' in args:
@@ -179,21 +369,37 @@ def bench(args):
         benchmarks.append(sanitycheck.getCTW(vm, sanitycheck.CTWMode.Full))
     if 'ctw-noinline' in args:
         benchmarks.append(sanitycheck.getCTW(vm, sanitycheck.CTWMode.NoInline))
+    if 'ctw-throughput' in args:
+        benchmarks.append(sanitycheck.getCTWThroughput())
 
     for f in extraBenchmarks:
         f(args, vm, benchmarks)
 
-    for test in benchmarks:
-        for (groupName, res) in test.bench(vm, extraVmOpts=vmArgs).items():
-            group = results.setdefault(groupName, {})
-            group.update(res)
-    mx.log(json.dumps(results))
-    if resultFile:
-        with open(resultFile, 'w') as f:
-            f.write(json.dumps(results))
+    import benchresults, hostcheck
+    # output replayed from BENCH_OUTPUT is not recorded
+    replayed = os.environ.get('BENCH_OUTPUT')
+    hostState = None if replayed else hostcheck.check(hostPolicy)
+    store = None
+    if not noResultDb and not replayed:
+        store = benchresults.ResultStore(resultDb)
+    samples = {}
+    details = {}
+    try:
+        if store:
+            run = store.addRun(command, mx.suite('graal-core'), mx_graal_core.get_jvmci_mode(), vm)
+            store.addHostState(run, hostState)
+        for test in benchmarks:
+            _mergeSamples(samples, _benchForks(test, vm, forks, vmArgs, store, run if store else None, details))
+    finally:
+        if store:
+            store.close()
+    results = _results(samples, details)
+    if hostState:
+        results['host'] = hostState
+    _writeResults(results, resultFile, detailsFile)
     if resultFileCSV:
         with open(resultFileCSV, 'w') as f:
-            for key1, value1 in results.iteritems():
+            for key1, value1 in benchresults.scoreGroups(results).iteritems():
                 f.write('%s;\n' % (str(key1)))
                 for key2, value2 in sorted(value1.iteritems()):
                     f.write('%s; %s;\n' % (str(key2), str(value2)))
@@ -201,8 +407,8 @@ def bench(args):
 def specjvm2008(args):
     """run one or more SPECjvm2008 benchmarks"""
 
-    def launcher(bm, harnessArgs, extraVmOpts):
-        return sanitycheck.getSPECjvm2008(harnessArgs + [bm]).bench(mx_graal_core.get_vm(), extraVmOpts=extraVmOpts)
+    def createTest(bm, harnessArgs):
+        return sanitycheck.getSPECjvm2008(harnessArgs + [bm])
 
     availableBenchmarks = set(sanitycheck.specjvm2008Names)
     if "all" not in args:
@@ -214,43 +420,525 @@ def specjvm2008(args):
                 group = parts[0]
                 availableBenchmarks.add(group)
 
-    _run_benchmark(args, sorted(availableBenchmarks), launcher)
+    _run_benchmark(args, sorted(availableBenchmarks), createTest)
 
 def specjbb2013(args):
     """run the composite SPECjbb2013 benchmark"""
 
-    def launcher(bm, harnessArgs, extraVmOpts):
+    def createTest(bm, harnessArgs):
         assert bm is None
-        return sanitycheck.getSPECjbb2013(harnessArgs).bench(mx_graal_core.get_vm(), extraVmOpts=extraVmOpts)
+        return sanitycheck.getSPECjbb2013(harnessArgs)
 
-    _run_benchmark(args, None, launcher)
+    _run_benchmark(args, None, createTest)
 
 def specjbb2015(args):
     """run the composite SPECjbb2015 benchmark"""
 
-    def launcher(bm, harnessArgs, extraVmOpts):
+    def createTest(bm, harnessArgs):
         assert bm is None
-        return sanitycheck.getSPECjbb2015(harnessArgs).bench(mx_graal_core.get_vm(), extraVmOpts=extraVmOpts)
+        return sanitycheck.getSPECjbb2015(harnessArgs)
 
-    _run_benchmark(args, None, launcher)
+    _run_benchmark(args, None, createTest)
 
 def specjbb2005(args):
     """run the composite SPECjbb2005 benchmark"""
 
-    def launcher(bm, harnessArgs, extraVmOpts):
+    def createTest(bm, harnessArgs):
         assert bm is None
-        return sanitycheck.getSPECjbb2005(harnessArgs).bench(mx_graal_core.get_vm(), extraVmOpts=extraVmOpts)
+        return sanitycheck.getSPECjbb2005(harnessArgs)
+
+    _run_benchmark(args, None, createTest)
+
+def _benchmarkListEntries(text):
+    """
+    Gets the (benchmark, mode) tuples of the entries of a META-INF/BenchmarkList
+    file generated by the JMH annotation processor. Older JMH versions separate
+    the fields of an entry with '===,===' while newer ones write typed tokens
+    (e.g. 'JMH S 13 com.foo.Bench S ...', a string being 'S <length> <value>').
+    """
+    entries = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if line.startswith('JMH '):
+            fields = []
+            i = len('JMH ')
+            while len(fields) < 4 and line.startswith('S ', i):
+                lengthEnd = line.index(' ', i + 2)
+                length = int(line[i + 2:lengthEnd])
+                fields.append(line[lengthEnd + 1:lengthEnd + 1 + length])
+                i = lengthEnd + 2 + length
+        else:
+            fields = line.split('===,===')
+        if len(fields) < 4:
+            mx.abort('Cannot parse BenchmarkList entry: ' + line)
+        userClass, _, method, mode = fields[:4]
+        entries.append((userClass + '.' + method, mode))
+    return entries
+
+"""
+JMH options that are not followed by a value. All other arguments of JMH
+starting with '-' take a value and the remaining arguments are regular
+expressions selecting the benchmarks.
+"""
+_jmhFlags = ['-h', '-l', '-lp', '-lprof', '-lrf']
+
+def _jmhIncludes(jmhArgs):
+    includes = []
+    i = 0
+    while i < len(jmhArgs):
+        arg = jmhArgs[i]
+        if arg.startswith('-'):
+            if arg not in _jmhFlags:
+                i += 1
+        elif arg:
+            includes.append(arg)
+        i += 1
+    return includes
+
+def _jmhProjectInfo():
+    """
+    Gets the names of the projects with a direct JMH dependency, their class
+    path and the benchmarks (see _benchmarkListEntries) they contain. These
+    are cached in the output directory of the graal-core suite and only
+    recomputed when a suite definition or a generated BenchmarkList changes.
+    """
+    cacheFile = join(mx.suite('graal-core').get_output_root(), 'microbench.json')
+    def stamp(path):
+        return os.path.getmtime(path) if exists(path) else None
+    suiteStamps = sorted([(s.name, stamp(join(s.mxDir, 'suite.py'))) for s in mx.suites()])
+
+    def key(projects):
+        stamps = [(name, stamp(join(mx.project(name).output_dir(), 'META-INF', 'BenchmarkList'))) for name in projects]
+        return json.loads(json.dumps([suiteStamps, stamps]))
+
+    if exists(cacheFile):
+        try:
+            with open(cacheFile) as fp:
+                cached = json.load(fp)
+            if cached['key'] == key(cached['projects']):
+                return cached['projects'], cached['classpath'], [tuple(e) for e in cached['benchmarks']]
+        except (ValueError, KeyError):
+            pass
+
+    projects = [p.name for p in mx.projects_opt_limit_to_suites() if 'JMH' in [x.name for x in p.deps]]
+    classpath = mx.classpath(projects)
+    benchmarks = []
+    for name in projects:
+        benchmarkList = join(mx.project(name).output_dir(), 'META-INF', 'BenchmarkList')
+        if exists(benchmarkList):
+            with open(benchmarkList) as fp:
+                benchmarks += _benchmarkListEntries(fp.read())
+    mx.ensure_dir_exists(dirname(cacheFile))
+    with open(cacheFile, 'w') as fp:
+        json.dump({'key' : key(projects), 'projects' : projects, 'classpath' : classpath, 'benchmarks' : benchmarks}, fp)
+    return projects, classpath, benchmarks
+
+def jmhClasspath():
+    """
+    Gets the class path of the projects with a direct JMH dependency.
+    """
+    return _jmhProjectInfo()[1]
+
+def _jmhBenchmarks(jar):
+    if jar:
+        import zipfile
+        with zipfile.ZipFile(jar) as zf:
+            try:
+                return _benchmarkListEntries(zf.read('META-INF/BenchmarkList'))
+            except KeyError:
+                mx.abort('No JMH benchmarks in ' + jar)
+    return _jmhProjectInfo()[2]
+
+def selectMicrobenchmarks(options, jmhArgs):
+    """
+    Resolves the benchmarks selected by the regular expressions in 'jmhArgs'
+    (all benchmarks if there are none) the way JMH does, without starting a
+    VM. With --list (see addMicrobenchArguments), the selected benchmarks are
+    printed and False is returned. Otherwise, this aborts if no benchmark is
+    selected and returns True.
+    """
+    includes = [re.compile(i) for i in _jmhIncludes(jmhArgs)]
+    benchmarks = sorted(set([(name, mode) for name, mode in _jmhBenchmarks(options.jar) if not includes or any([i.search(name) for i in includes])]))
+    if options.list:
+        for name, mode in benchmarks:
+            mx.log('{}  ({})'.format(name, mode))
+        return False
+    if not benchmarks:
+        if not includes:
+            mx.abort('No JMH benchmarks found (are the benchmark projects built?)')
+        mx.abort('No JMH benchmark matches ' + ' '.join([i.pattern for i in includes]) + ' (see mx microbench --list)')
+    return True
+
+def addMicrobenchArguments(parser):
+    """
+    Adds the options of selectMicrobenchmarks and runMicrobench to the
+    ArgumentParser of a microbench command.
+    """
+    parser.add_argument('--list', action='store_true', help='list the benchmarks selected by the JMH options without running them')
+    parser.add_argument('--resultfile', help='write the results in the format of bench to this file', metavar='<file>')
+    parser.add_argument('--detailsfile', help='write the results with the iteration scores, units and errors of the benchmarks to this file (see bench)', metavar='<file>')
+    parser.add_argument('--resultdb', help='benchmark result database (default: see benchquery)', metavar='<file>')
+    parser.add_argument('--noresultdb', action='store_true', help='do not record the results in the benchmark result database')
+
+def _jmhResultFile(jmhArgs):
+    """
+    Adds the JMH options for writing the results as JSON to 'jmhArgs' unless
+    a result file was requested already. Returns the JMH arguments, the file
+    the results are written to and whether it is a temporary file. The file
+    is None if results in another format were requested.
+    """
+    jmhArgs = list(jmhArgs)
+    resultFormat = None
+    if '-rf' in jmhArgs[:-1]:
+        resultFormat = jmhArgs[jmhArgs.index('-rf') + 1].lower()
+        if resultFormat != 'json':
+            mx.warn('The results are only recorded with -rf json')
+            return jmhArgs, None, False
+    if '-rff' in jmhArgs[:-1]:
+        if resultFormat is None:
+            jmhArgs += ['-rf', 'json']
+        return jmhArgs, jmhArgs[jmhArgs.index('-rff') + 1], False
+    fd, path = tempfile.mkstemp(prefix='jmh', suffix='.json')
+    os.close(fd)
+    if resultFormat is None:
+        jmhArgs += ['-rf', 'json']
+    return jmhArgs + ['-rff', path], path, True
+
+def _jmhName(benchmark):
+    name = benchmark['benchmark']
+    params = benchmark.get('params')
+    if params:
+        name += ':' + ','.join([k + '=' + v for k, v in sorted(params.iteritems())])
+    return name
+
+def _asNumber(value):
+    # JMH writes NaN (e.g. for the error of a single iteration) as a string or a bare literal
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+def jmhSamples(path):
+    """
+    Converts the JMH results in the JSON file 'path' into scores of the form
+    {group : {benchmark : [score per fork]}} and details (see _benchForks)
+    with the iteration scores, units and errors of each benchmark. The group
+    of the primary metric is 'JMH-' + the benchmark mode. The secondary
+    metrics (e.g. those of -prof gc) are in the 'JMH-secondary' group,
+    named benchmark + ':' + metric.
+    """
+    with open(path) as fp:
+        benchmarks = json.load(fp)
+    samples = {}
+    details = {}
+    def add(groupName, name, metric):
+        rawData = metric.get('rawData')
+        if rawData:
+            scores = [benchstats.mean(forkScores) for forkScores in rawData if forkScores]
+            details.setdefault('iterations', {}).setdefault(groupName, {})[name] = rawData
+        else:
+            # e.g. sample mode, for which JMH only writes a histogram
+            scores = [metric['score']]
+        samples.setdefault(groupName, {})[name] = scores
+        details.setdefault('units', {}).setdefault(groupName, {})[name] = str(metric.get('scoreUnit'))
+        details.setdefault('errors', {}).setdefault(groupName, {})[name] = _asNumber(metric.get('scoreError'))
+
+    for benchmark in benchmarks:
+        name = str(_jmhName(benchmark))
+        add('JMH-' + str(benchmark['mode']), name, benchmark['primaryMetric'])
+        for metricName, metric in benchmark.get('secondaryMetrics', {}).iteritems():
+            # JMH prefixes the names of profiler metrics with a middle dot
+            metricName = metricName.lstrip(u'\u00b7').encode('utf-8')
+            add('JMH-secondary', name + ':' + metricName, metric)
+    return samples, details
+
+def runMicrobench(command, options, vmArgs, jmhArgs, launch):
+    """
+    Runs JMH by calling 'launch(jmhArgs)' with JSON result output requested
+    and records the results like bench does, according to the 'options'
+    added by addMicrobenchArguments.
+    """
+    jmhArgs, jsonFile, temporary = _jmhResultFile(jmhArgs)
+    try:
+        launch(jmhArgs)
+        if jsonFile is None or '-l' in jmhArgs or '-h' in jmhArgs:
+            return
+        if not os.path.isfile(jsonFile) or os.path.getsize(jsonFile) == 0:
+            mx.warn('JMH did not write any results to ' + jsonFile)
+            return
+        samples, details = jmhSamples(jsonFile)
+    finally:
+        if temporary and os.path.exists(jsonFile):
+            os.remove(jsonFile)
+
+    if not options.noresultdb:
+        import benchresults
+        vm = mx_graal_core.get_vm()
+        with benchresults.ResultStore(options.resultdb) as store:
+            run = store.addRun(command, mx.suite('graal-core'), mx_graal_core.get_jvmci_mode(), vm)
+            forks = max([len(scores) for group in samples.itervalues() for scores in group.itervalues()] + [0])
+            for fork in range(forks):
+                groups = {}
+                iterations = {}
+                for groupName, group in samples.iteritems():
+                    for name, scores in group.iteritems():
+                        if fork < len(scores):
+                            groups.setdefault(groupName, {})[name] = scores[fork]
+                            forkIterations = details.get('iterations', {}).get(groupName, {}).get(name)
+                            if forkIterations:
+                                iterations.setdefault(groupName, {})[name] = forkIterations[fork]
+                store.addExecution(run, 'microbench', vmArgs, groups, fork=fork, iterations=iterations)
+    _writeResults(_results(samples, details), options.resultfile, options.detailsfile)
+
+def _loadSamples(source, store):
+    """
+    Loads the scores of 'source', which is either a result file or 'run:<id>'
+    denoting a run in the result database.
+    """
+    if source.startswith('run:'):
+        try:
+            run = int(source[len('run:'):])
+        except ValueError:
+            mx.abort('Invalid run id: ' + source)
+        return store().samples(run)
+    if not os.path.isfile(source):
+        mx.abort('Result file does not exist: ' + source)
+    import benchresults
+    return benchresults.fileSamples(source)
+
+def benchcompare(args):
+    """compare the scores of two benchmark runs
+
+    Each run is either a result file or details file of bench (or a suite
+    command run with -resultfile or -detailsfile) or run:<id> for a run in
+    the result database (see benchquery). For each benchmark present in both
+    runs, the change of its mean score is shown along with whether it is
+    statistically significant (Welch's t-test at the 5% level, which needs
+    at least 2 scores per run, e.g., from -forks with -detailsfile). For
+    each group, the change of the geometric mean of its scores is shown.
+    Changes are positive for improvements, i.e., when a time gets lower or a
+    throughput gets higher.
+
+    The command fails if a benchmark or group regresses by more than the
+    threshold unless the regression of the benchmark is not significant."""
+    parser = ArgumentParser(prog='mx benchcompare', description=benchcompare.__doc__)
+    parser.add_argument('--db', help='result database for run:<id> arguments', metavar='<path>')
+    parser.add_argument('-t', '--threshold', type=float, default=5.0, help='regression in percent that fails the comparison (default: 5)', metavar='<percent>')
+    parser.add_argument('-a', '--all', action='store_true', help='also show benchmarks without a significant change')
+    parser.add_argument('base', help='baseline results', metavar='<base>')
+    parser.add_argument('new', help='results compared to the baseline', metavar='<new>')
+    args = parser.parse_args(args)
+
+    import benchresults
+    stores = []
+    def store():
+        if not stores:
+            stores.append(benchresults.ResultStore(args.db))
+        return stores[0]
+    try:
+        base = _loadSamples(args.base, store)
+        new = _loadSamples(args.new, store)
+    finally:
+        for s in stores:
+            s.close()
+
+    def improvement(baseScore, newScore, lowerIsBetter):
+        # in percent, positive if better
+        if lowerIsBetter:
+            return (baseScore / newScore - 1.0) * 100.0
+        return (newScore / baseScore - 1.0) * 100.0
+
+    regressions = []
+    ratios = []
+    mx.log('{:<24} {:<32} {:>12} {:>12} {:>9}  {}'.format('group', 'benchmark', 'base', 'new', 'change', 'significant'))
+    for groupName in sorted(set(base.keys()) & set(new.keys())):
+        lowerIsBetter = groupName in benchresults.lowerIsBetterGroups
+        baseGroup = base[groupName]
+        newGroup = new[groupName]
+        common = sorted(set(baseGroup.keys()) & set(newGroup.keys()))
+        missing = sorted(set(baseGroup.keys()) ^ set(newGroup.keys()))
+        if missing:
+            mx.log('{}: only in one run: {}'.format(groupName, ', '.join(missing)))
+        baseMeans = []
+        newMeans = []
+        for name in common:
+            a = baseGroup[name]
+            b = newGroup[name]
+            baseMean = benchstats.mean(a)
+            newMean = benchstats.mean(b)
+            if baseMean <= 0 or newMean <= 0:
+                mx.log('{:<24} {:<32} {:>12.2f} {:>12.2f} {:>9}'.format(groupName, name, baseMean, newMean, 'n/a'))
+                continue
+            change = improvement(baseMean, newMean, lowerIsBetter)
+            significant = benchstats.significant(a, b)
+            informational = groupName in benchresults.informationalGroups or groupName + ':' + name in benchresults.informationalBenchmarks
+            if not informational:
+                baseMeans.append(baseMean)
+                newMeans.append(newMean)
+                ratios.append(1.0 + change / 100.0)
+                if change < -args.threshold and significant is not False:
+                    regressions.append('{}:{} ({:+.2f}%)'.format(groupName, name, change))
+            if args.all or significant is not False:
+                mx.log('{:<24} {:<32} {:>12.2f} {:>12.2f} {:>+8.2f}%  {}'.format(groupName, name, baseMean, newMean, change,
+                                                                                  {True : 'yes', False : 'no', None : '?'}[significant] + (' (informational)' if informational else '')))
+        if len(baseMeans) > 1:
+            change = improvement(benchstats.geomean(baseMeans), benchstats.geomean(newMeans), lowerIsBetter)
+            mx.log('{:<24} {:<32} {:>12.2f} {:>12.2f} {:>+8.2f}%'.format(groupName, '(geometric mean)', benchstats.geomean(baseMeans), benchstats.geomean(newMeans), change))
+            if change < -args.threshold:
+                regressions.append('{} geometric mean ({:+.2f}%)'.format(groupName, change))
+    if not ratios:
+        mx.abort('No benchmarks in common between ' + args.base + ' and ' + args.new)
+    mx.log('Overall change (geometric mean over {} benchmarks): {:+.2f}%'.format(len(ratios), (benchstats.geomean(ratios) - 1.0) * 100.0))
+    if regressions:
+        mx.abort('Regressions over {}%:\n  '.format(args.threshold) + '\n  '.join(regressions))
+
+"""
+Creates the tests whose output parsers are measured by 'parserbench'. The
+output matchers of the DaCapo tests do not depend on the benchmark so an
+arbitrary one is used.
+"""
+_parserBenchSuites = {
+    'dacapo' : lambda vm: [sanitycheck.getDacapo('avrora')],
+    'scaladacapo' : lambda vm: [sanitycheck.getScalaDacapo('actors')],
+    'specjvm2008' : lambda vm: [sanitycheck.getSPECjvm2008()],
+    'bootstrap' : lambda vm: sanitycheck.getBootstraps(),
+    'ctw' : lambda vm: [sanitycheck.getCTW(vm, sanitycheck.CTWMode.Full)],
+}
+
+def _substitutionParse(outputParser, output):
+    """
+    Parses 'output' like OutputParser.parse did before value templates were
+    compiled, i.e., by substituting the groups of each match into each
+    template with a regular expression. Used as the baseline of parserbench.
+    """
+    valueMaps = []
+    for matcher in outputParser.matchers:
+        for match in matcher.regex.finditer(output):
+            def replaceVar(m, match=match):
+                return match.group(m.group(1))
+            valueMap = {}
+            for keyTemplate, valueTemplate in matcher.valuesTemplate.items():
+                valueMap[re.sub(r'<([\w]+)>', replaceVar, keyTemplate)] = re.sub(r'<([\w]+)>', replaceVar, valueTemplate)
+            valueMaps.append(valueMap)
+    return valueMaps
+
+def parserbench(args):
+    """measure the streaming output parser against whole-output parsing
+
+    Each recorded log is parsed with the output parsers of the tests for the
+    given suite three times: by running each matcher over the complete output
+    and substituting each match into the value templates with a regular
+    expression (as done before the templates were compiled), by running each
+    matcher over the complete output with the compiled templates and line by
+    line with the merged matchers used while a VM is running. The results of
+    all three must be identical."""
+    parser = ArgumentParser(prog='mx parserbench', description=parserbench.__doc__)
+    parser.add_argument('-n', '--iterations', type=int, default=5, help='number of times each log is parsed per parser (default: 5)', metavar='<n>')
+    parser.add_argument('--test', action='store_true', help='parse the logs as sanity tests instead of benchmarks')
+    parser.add_argument('suite', choices=sorted(_parserBenchSuites.keys()), help='suite whose parsers are used')
+    parser.add_argument('logs', nargs='+', help='recorded VM output', metavar='<log>')
+    args = parser.parse_args(args)
 
-    _run_benchmark(args, None, launcher)
+    vm = mx_graal_core.get_vm()
+    tests = _parserBenchSuites[args.suite](vm)
+
+    def canonical(valueMaps):
+        return sorted([sorted(valueMap.items()) for valueMap in valueMaps])
+
+    for log in args.logs:
+        with open(log) as fp:
+            output = fp.read()
+        lines = output.splitlines(True)
+        for test in tests:
+            substitutionTimes = []
+            wholeTimes = []
+            streamTimes = []
+            for _ in range(args.iterations):
+                outputParser = test.createParser(vm, forBench=not args.test)
+                start = time.time()
+                substitutionValueMaps = _substitutionParse(outputParser, output)
+                substitutionTimes.append(time.time() - start)
+
+                outputParser = test.createParser(vm, forBench=not args.test)
+                start = time.time()
+                wholeValueMaps = outputParser.parse(output)
+                wholeTimes.append(time.time() - start)
+
+                outputParser = test.createParser(vm, forBench=not args.test)
+                start = time.time()
+                for line in lines:
+                    outputParser.eat(line)
+                streamTimes.append(time.time() - start)
+
+                if canonical(substitutionValueMaps) != canonical(wholeValueMaps) or canonical(wholeValueMaps) != canonical(outputParser.valueMaps):
+                    mx.abort('Parsers disagree on ' + log + ' for ' + test.name + ':\n  substitution: ' + str(substitutionValueMaps) + '\n  whole output: ' + str(wholeValueMaps) + '\n  line by line: ' + str(outputParser.valueMaps))
+
+            mb = len(output) / (1024.0 * 1024.0)
+            mx.log('{}: {} ({:.1f} MB, {} lines, {} values)'.format(log, test.name, mb, len(lines), len(wholeValueMaps)))
+            for label, times in [('substitution', substitutionTimes), ('whole output', wholeTimes), ('line by line', streamTimes)]:
+                t = min(times)
+                mx.log('  {}: {:8.3f} s  {:8.1f} MB/s'.format(label, t, mb / t if t else float('inf')))
+
+def startuptime(args):
+    """print the time taken to load the graal-core suite extensions"""
+    mx.log('graal-core extensions loaded in {:.1f} ms'.format(mx_graal_core.loadTime * 1000))
+
+_startupTimeRE = re.compile(r"^graal-core extensions loaded in (?P<time>[0-9.]+) ms")
+
+def startupbench(args):
+    """measure the start-up time of mx with the graal-core suite
+
+    Runs 'mx startuptime' in the given number of fresh mx processes and
+    reports the elapsed time of each process ('Startup:MxCommand') and the
+    part of it spent loading the graal-core extensions, including probing
+    the JDK and loading the JDK specific extensions
+    ('Startup:SuiteExtensions'), both in milliseconds."""
+    parser = ArgumentParser(prog='mx startupbench', description=startupbench.__doc__)
+    parser.add_argument('-n', '--runs', type=int, default=10, help='number of mx processes (default: 10)', metavar='<n>')
+    parser.add_argument('-resultfile', '--resultfile', help='file the results are written to', metavar='<file>')
+    args = parser.parse_args(args)
+    if args.runs < 1:
+        mx.abort('-n must be at least 1')
+
+    command = [sys.executable, os.path.abspath(sys.argv[0]), '-p', mx.suite('graal-core').dir, 'startuptime']
+    samples = {}
+    for i in range(args.runs):
+        loadTimes = []
+        def out(line):
+            m = _startupTimeRE.match(line)
+            if m:
+                loadTimes.append(float(m.group('time')))
+        start = time.time()
+        mx.run(command, out=out, err=out)
+        elapsed = (time.time() - start) * 1000
+        if not loadTimes:
+            mx.abort('Could not find the load time in the output of ' + ' '.join(command))
+        mx.log('run {}: {:.1f} ms, {:.1f} ms loading graal-core extensions'.format(i + 1, elapsed, loadTimes[0]))
+        startup = samples.setdefault('Startup', {})
+        startup.setdefault('MxCommand', []).append(elapsed)
+        startup.setdefault('SuiteExtensions', []).append(loadTimes[0])
+    _writeResults(_results(samples), args.resultfile)
+
+def benchquery(args):
+    """query the benchmark result database (see benchresults.benchquery)"""
+    import benchresults
+    benchresults.benchquery(args)
 
 mx.update_commands(mx.suite('graal-core'), {
-    'dacapo': [dacapo, '[VM options] benchmarks...|"all" [DaCapo options]'],
-    'scaladacapo': [scaladacapo, '[VM options] benchmarks...|"all" [Scala DaCapo options]'],
-    'specjvm2008': [specjvm2008, '[VM options] benchmarks...|"all" [SPECjvm2008 options]'],
-    'specjbb2013': [specjbb2013, '[VM options] [-- [SPECjbb2013 options]]'],
-    'specjbb2015': [specjbb2015, '[VM options] [-- [SPECjbb2015 options]]'],
-    'specjbb2005': [specjbb2005, '[VM options] [-- [SPECjbb2005 options]]'],
-    'bench' : [bench, '[-resultfile file] [all(default)|dacapo|specjvm2008|bootstrap]'],
+    'dacapo': [dacapo, '[-forks n] [-resultfile file] [-detailsfile file] [-adaptive] [VM options] benchmarks...|"all" [DaCapo options]'],
+    'scaladacapo': [scaladacapo, '[-forks n] [-resultfile file] [-detailsfile file] [-adaptive] [VM options] benchmarks...|"all" [Scala DaCapo options]'],
+    'specjvm2008': [specjvm2008, '[-forks n] [-resultfile file] [-detailsfile file] [VM options] benchmarks...|"all" [SPECjvm2008 options]'],
+    'specjbb2013': [specjbb2013, '[-forks n] [-resultfile file] [-detailsfile file] [VM options] [-- [SPECjbb2013 options]]'],
+    'specjbb2015': [specjbb2015, '[-forks n] [-resultfile file] [-detailsfile file] [VM options] [-- [SPECjbb2015 options]]'],
+    'specjbb2005': [specjbb2005, '[-forks n] [-resultfile file] [-detailsfile file] [VM options] [-- [SPECjbb2005 options]]'],
+    'bench' : [bench, '[-resultfile file] [-detailsfile file] [-resultdb file|-noresultdb] [-forks n] [-adaptive] [-failfast] [-hostcheck record|measure|wait|refuse] [all(default)|dacapo|specjvm2008|bootstrap]'],
+    'benchquery' : [benchquery, '[options]'],
+    'benchcompare' : [benchcompare, '[-t threshold] [--db path] base new'],
     'deoptalot' : [deoptalot, '[n]'],
+    'parserbench' : [parserbench, '[-n iterations] [--test] suite logs...'],
     'longtests' : [longtests, ''],
+    'startuptime' : [startuptime, ''],
+    'startupbench' : [startupbench, '[-n runs] [-resultfile file]'],
 })
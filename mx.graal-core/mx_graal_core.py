@@ -24,13 +24,89 @@
 #
 # ----------------------------------------------------------------------------------------------------
 
+import time
+_loadStart = time.time()
+
+import os, json
+from os.path import join, exists, expanduser, abspath
 import mx
-JDK9 = mx.get_jdk(tag='default').javaCompliance >= "1.9"
+
+class JDKDescriptor:
+    """
+    The properties of the default JDK needed while loading the graal-core
+    suite. Unlike mx.get_jdk, creating a descriptor does not start the JDK.
+    'jdk' is the mx.JDKConfig if the JDK had to be probed anyway.
+    """
+    def __init__(self, home, javaCompliance, jdk=None):
+        self.home = home
+        self.javaCompliance = javaCompliance
+        self.jdk = jdk
+
+"""
+The file caching the Java compliance of JDKs, keyed on the JDK home and
+the modification time of its java executable.
+"""
+jdkDescriptorCache = join(expanduser('~'), '.mx', 'jdk-descriptors.json')
+
+def _default_jdk_descriptor():
+    """
+    Gets a JDKDescriptor of the default JDK. mx.get_jdk probes the JDK by
+    running it, which would otherwise add the start-up of a JVM to every mx
+    command. The result of probing is therefore cached in
+    'jdkDescriptorCache'. The cache is not used if the default JDK is
+    selected by a tag (--jdk or DEFAULT_JDK) rather than JAVA_HOME.
+    """
+    opts = getattr(mx, '_opts', None)
+    home = getattr(opts, 'java_home', None) or mx.get_env('JAVA_HOME')
+    if not home or getattr(opts, 'jdk', None) or mx.get_env('DEFAULT_JDK'):
+        jdk = mx.get_jdk(tag='default')
+        return JDKDescriptor(jdk.home, jdk.javaCompliance, jdk)
+    home = abspath(home)
+    java = join(home, 'bin', mx.exe_suffix('java'))
+    if not exists(java):
+        # let mx report the problem
+        jdk = mx.get_jdk(tag='default')
+        return JDKDescriptor(jdk.home, jdk.javaCompliance, jdk)
+    key = home + os.pathsep + repr(os.path.getmtime(java))
+
+    cache = {}
+    try:
+        with open(jdkDescriptorCache) as fp:
+            cache = json.load(fp)
+    except (IOError, ValueError):
+        pass
+    if key in cache:
+        return JDKDescriptor(home, mx.JavaCompliance(cache[key]))
+
+    jdk = mx.get_jdk(tag='default')
+    # drop the entries of previous versions of this JDK
+    cache = dict([(k, v) for k, v in cache.iteritems() if not k.startswith(home + os.pathsep)])
+    cache[key] = str(jdk.javaCompliance)
+    try:
+        mx.ensure_dir_exists(os.path.dirname(jdkDescriptorCache))
+        with open(jdkDescriptorCache + '.tmp', 'w') as fp:
+            json.dump(cache, fp)
+        os.rename(jdkDescriptorCache + '.tmp', jdkDescriptorCache)
+    except (IOError, OSError) as e:
+        mx.warn('Could not update ' + jdkDescriptorCache + ': ' + str(e))
+    return JDKDescriptor(home, jdk.javaCompliance, jdk)
+
+jdkDescriptor = _default_jdk_descriptor()
+JDK9 = jdkDescriptor.javaCompliance >= "1.9"
 
 if JDK9:
-    from mx_graal_9 import mx_post_parse_cmd_line, run_vm, get_vm, isJVMCIEnabled # pylint: disable=unused-import
+    from mx_graal_9 import mx_post_parse_cmd_line, run_vm, get_vm, get_jvmci_mode, isJVMCIEnabled, sharedArchiveOptions # pylint: disable=unused-import
 
 else:
-    from mx_graal_8 import mx_post_parse_cmd_line, run_vm, get_vm, isJVMCIEnabled # pylint: disable=unused-import
+    from mx_graal_8 import mx_post_parse_cmd_line, run_vm, get_vm, get_jvmci_mode, isJVMCIEnabled, sharedArchiveOptions # pylint: disable=unused-import
 
+# The version specific extensions and mx_graal_bench are loaded for their
+# commands. They import the modules a command needs when it runs so that
+# loading them stays cheap for every mx command.
 import mx_graal_bench # pylint: disable=unused-import
+
+"""
+Seconds taken to load this module, including the version specific
+extensions (see mx_graal_bench.startuptime).
+"""
+loadTime = time.time() - _loadStart
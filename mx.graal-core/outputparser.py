@@ -25,13 +25,21 @@
 
 import re
 
+# Regular expression features that do not survive being merged into a
+# single alternation with other expressions (group references and
+# conditionals depend on group numbering and naming).
+_unmergeableRE = re.compile(r'\(\?P=|\(\?\(|\\[1-9]')
+
 class OutputParser:
 
     def __init__(self):
         self.matchers = []
+        self.valueMaps = []
+        self._scanner = None
 
     def addMatcher(self, matcher):
         self.matchers.append(matcher)
+        self._scanner = None
 
     def parse(self, output):
         valueMaps = []
@@ -39,6 +47,91 @@ class OutputParser:
             matcher.parse(output, valueMaps)
         return valueMaps
 
+    def eat(self, line):
+        """
+        Matches a single line of output as it is produced (e.g. as the 'out'
+        callback of mx.run). The value maps produced by the line are appended
+        to self.valueMaps and also returned. This allows the output of long
+        running programs to be parsed without retaining it.
+
+        The vast majority of output lines match none of the registered
+        matchers. To reject such lines with a single scan, the regular
+        expressions of the matchers are merged into one expression that is
+        only used to decide whether the individual matchers need to run.
+        """
+        if self._scanner is None:
+            self._scanner = _MatcherScanner(self.matchers)
+        valueMaps = []
+        for matcher in self._scanner.candidates(line):
+            matcher.parse(line, valueMaps)
+        self.valueMaps.extend(valueMaps)
+        return valueMaps
+
+class _MatcherScanner:
+    """
+    Selects the matchers of an OutputParser that need to be applied to a line
+    based on a single search with the union of their regular expressions.
+    Matchers whose expression cannot be merged are always applied.
+    """
+
+    def __init__(self, matchers):
+        self.matchers = matchers
+        self.unmerged = []
+        patterns = []
+        for matcher in matchers:
+            regex = matcher.regex
+            if regex.flags & ~(re.MULTILINE | re.UNICODE) or _unmergeableRE.search(regex.pattern):
+                self.unmerged.append(matcher)
+            else:
+                # Group names are only needed by the individual matchers and
+                # would clash between expressions
+                pattern = re.sub(r'\(\?P<[\w]+>', '(?:', regex.pattern)
+                if pattern not in patterns:
+                    patterns.append(pattern)
+        self.union = None
+        if patterns:
+            try:
+                # A multi-line union matches a superset of what each of
+                # its members matches (with or without re.MULTILINE)
+                self.union = re.compile('|'.join(['(?:' + p + ')' for p in patterns]), re.MULTILINE)
+            except (re.error, AssertionError, OverflowError):
+                # e.g. too many groups for a single expression
+                self.unmerged = matchers
+
+    def candidates(self, line):
+        if self.union is None or len(self.unmerged) == len(self.matchers) or self.union.search(line):
+            return self.matchers
+        return self.unmerged
+
+def _compile_template(template):
+    """
+    Compiles a template value (see ValuesMatcher) into a function computing
+    the value from a match object. Constant templates and templates that
+    consist of a single group reference are resolved without any string
+    processing.
+    """
+    parts = re.split(r'<([\w]+)>', template)
+    if len(parts) == 1:
+        return lambda match: template
+    if len(parts) == 3 and parts[0] == '' and parts[2] == '':
+        groupName = parts[1]
+        def group_value(match):
+            value = match.group(groupName)
+            return '' if value is None else value
+        return group_value
+    # parts alternates between literal text and group names
+    def substitute(match):
+        values = []
+        for i, part in enumerate(parts):
+            if i % 2 == 0:
+                values.append(part)
+            else:
+                value = match.group(part)
+                if value is not None:
+                    values.append(value)
+        return ''.join(values)
+    return substitute
+
 """
 Produces a value map for each match of a given regular expression
 in some text. The value map is specified by a template map
@@ -52,20 +145,13 @@ class ValuesMatcher:
         assert isinstance(valuesTemplate, dict)
         self.regex = regex
         self.valuesTemplate = valuesTemplate
+        self.compiledTemplate = [(_compile_template(k), _compile_template(v)) for k, v in valuesTemplate.items()]
 
     def parse(self, text, valueMaps):
         for match in self.regex.finditer(text):
             valueMap = {}
-            for keyTemplate, valueTemplate in self.valuesTemplate.items():
-                key = self.get_template_value(match, keyTemplate)
-                value = self.get_template_value(match, valueTemplate)
+            for key, value in self.compiledTemplate:
+                key = key(match)
                 assert not valueMap.has_key(key), key
-                valueMap[key] = value
+                valueMap[key] = value(match)
             valueMaps.append(valueMap)
-
-    def get_template_value(self, match, template):
-        def replace_var(m):
-            groupName = m.group(1)
-            return match.group(groupName)
-
-        return re.sub(r'<([\w]+)>', replace_var, template)
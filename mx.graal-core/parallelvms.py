@@ -0,0 +1,399 @@
+# ----------------------------------------------------------------------------------------------------
+#
+# Copyright (c) 2016, Oracle and/or its affiliates. All rights reserved.
+# DO NOT ALTER OR REMOVE COPYRIGHT NOTICES OR THIS FILE HEADER.
+#
+# This code is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 only, as
+# published by the Free Software Foundation.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# version 2 for more details (a copy is included in the LICENSE file that
+# accompanied this code).
+#
+# You should have received a copy of the GNU General Public License version
+# 2 along with this work; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Please contact Oracle, 500 Oracle Parkway, Redwood Shores, CA 94065 USA
+# or visit www.oracle.com if you need additional information or have any
+# questions.
+#
+# ----------------------------------------------------------------------------------------------------
+
+"""
+Support for running several VMs at once, each on its own set of CPUs, in
+its own scratch directory and with its output captured separately.
+
+Jobs are run by the worker threads of a JobPool. Each worker restricts its
+own CPU affinity to a disjoint subset of the CPUs available to mx. As the
+affinity of a thread is inherited by the processes it starts, the VMs
+launched by a job only see the CPUs of their worker (which also sizes their
+GC and compiler thread pools accordingly).
+"""
+
+import os, sys, re, time, shutil, tempfile, threading, multiprocessing, Queue
+import mx
+
+def availableCpus():
+    """
+    Gets the ids of the CPUs the calling thread may run on (e.g. those of the
+    job it runs).
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            status = '/proc/thread-self/status'
+            if not os.path.exists(status):
+                # before Linux 3.17
+                status = '/proc/self/status'
+            with open(status) as fp:
+                for line in fp:
+                    if line.startswith('Cpus_allowed_list:'):
+                        cpus = []
+                        for r in line.split(':', 1)[1].strip().split(','):
+                            bounds = r.split('-')
+                            cpus.extend(range(int(bounds[0]), int(bounds[-1]) + 1))
+                        return cpus
+        except (IOError, ValueError):
+            pass
+    return range(multiprocessing.cpu_count())
+
+def partitionCpus(n, cpus=None):
+    """
+    Splits 'cpus' (default: all available CPUs) into 'n' disjoint sets of
+    contiguous CPU ids whose sizes differ by at most one.
+    """
+    cpus = availableCpus() if cpus is None else cpus
+    assert 0 < n <= len(cpus), n
+    size, remainder = divmod(len(cpus), n)
+    partitions = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < remainder else 0)
+        partitions.append(cpus[start:end])
+        start = end
+    return partitions
+
+_affinityWarning = []
+
+def setThreadAffinity(cpus):
+    """
+    Restricts the calling thread (and the processes it subsequently starts)
+    to 'cpus'. Returns False if this is not supported on the current platform.
+    """
+    if sys.platform.startswith('linux'):
+        import ctypes, ctypes.util
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+            mask = (ctypes.c_ulong * (max(1024, max(cpus) + 1) // bits + 1))()
+            for cpu in cpus:
+                mask[cpu // bits] |= 1 << (cpu % bits)
+            # pid 0 denotes the calling thread
+            if libc.sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) == 0:
+                return True
+            reason = os.strerror(ctypes.get_errno())
+        except (OSError, AttributeError) as e:
+            reason = str(e)
+    else:
+        reason = 'not supported on ' + sys.platform
+    if not _affinityWarning:
+        _affinityWarning.append(reason)
+        mx.warn('Cannot restrict parallel jobs to disjoint CPU sets (' + reason + ')')
+    return False
+
+class _ThreadStream:
+    """
+    A stream that writes to a per-thread target stream if one has been set
+    and to the underlying stream otherwise. Installed as sys.stdout and
+    sys.stderr while a JobPool is active so that mx.log output and echoed VM
+    output of a job end up in the log of the job.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def _target(self):
+        return getattr(self.local, 'target', None) or self.stream
+
+    def write(self, s):
+        self._target().write(s)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def capturing():
+    """
+    Determines if the calling thread is running a job whose output is captured.
+    """
+    return isinstance(sys.stdout, _ThreadStream) and getattr(sys.stdout.local, 'target', None) is not None
+
+def jobOutput():
+    """
+    Gets the stream capturing the output of the job run by the calling thread
+    or sys.stdout if there is none. Unlike sys.stdout, the stream can be
+    written to from other threads, such as the threads mx.run uses to
+    redirect the output of a program.
+    """
+    if capturing():
+        return sys.stdout.local.target
+    return sys.stdout
+
+def captureOutput(out=None, err=None):
+    """
+    Gets the 'out' and 'err' arguments for mx.run that capture the output of
+    a program started by a job in the log of the job. Without them, mx.run
+    lets the program write to the standard streams of mx directly. This must
+    be called by the job itself as mx.run calls 'out' and 'err' from its own
+    threads.
+    """
+    if capturing():
+        log = jobOutput()
+        out = out or log.write
+        err = err or log.write
+    return out, err
+
+class _LineTee:
+    """
+    A stream that writes to a log and passes each complete line to 'out'.
+    """
+    def __init__(self, log, out):
+        self.log = log
+        self.out = out
+        self.partial = ''
+        # mx.run redirects the standard output and error of a program in separate threads
+        self.lock = threading.Lock()
+
+    def write(self, s):
+        with self.lock:
+            self.log.write(s)
+            lines = (self.partial + s).split('\n')
+            self.partial = lines.pop()
+            for line in lines:
+                self.out(line + '\n')
+
+    def flush(self):
+        self.log.flush()
+
+class JobFailure(Exception):
+    """
+    The failure of a job (see fail).
+    """
+
+_jobState = threading.local()
+
+def currentJob():
+    """
+    Gets the Job run by the calling thread or None.
+    """
+    return getattr(_jobState, 'job', None)
+
+def fail(message):
+    """
+    Reports a failure of the job run by the calling thread by raising a
+    JobFailure. Jobs must not call mx.abort as it kills the programs of all
+    jobs running at the same time. Outside of a job, this is mx.abort.
+    """
+    if currentJob() is None:
+        mx.abort(message)
+    raise JobFailure(message)
+
+"""
+Functions called by the thread creating a Job, each returning a context
+manager that is entered around the job in the thread running it. They carry
+per-thread state of mx over to the job, such as the JVMCI mode (see
+mx_graal_9.JVMCIMode).
+"""
+jobContexts = []
+
+class Job:
+    """
+    A unit of work run by a JobPool. 'func' is called with the Job as its only
+    argument. While it runs, 'cwd' is a fresh scratch directory (if 'scratch'
+    is true) and 'cpus' the CPUs the job is restricted to. If not None, 'out'
+    is called with each line of the captured output of the job, including
+    that of the programs it starts with the arguments of captureOutput.
+    """
+    def __init__(self, name, func, scratch=False, out=None):
+        self.name = name
+        self.func = func
+        self.scratch = scratch
+        self.out = out
+        self.contexts = [context() for context in jobContexts]
+        self.cwd = None
+        self.cpus = None
+        self.log = None
+        self.result = None
+        self.excInfo = None
+        self.start = None
+        self.duration = None
+        self._done = threading.Event()
+
+    def wait(self):
+        # wait with a timeout so that the main thread remains interruptible
+        while not self._done.wait(1):
+            pass
+        return self
+
+    def done(self):
+        return self._done.is_set()
+
+    def showLog(self, stream=None):
+        """
+        Copies the captured output of this job to 'stream' (default: the real sys.stdout).
+        """
+        stream = stream or _realStdout()
+        if self.log and os.path.exists(self.log):
+            with open(self.log) as fp:
+                for chunk in iter(lambda: fp.read(1024 * 1024), ''):
+                    stream.write(chunk)
+            stream.flush()
+
+    def get(self):
+        """
+        Waits for this job to complete, shows its output and returns its
+        result or re-raises the exception it raised. A JobFailure becomes an
+        mx.abort in the calling thread.
+        """
+        self.wait()
+        self.showLog()
+        if self.excInfo:
+            if isinstance(self.excInfo[1], JobFailure):
+                mx.abort(str(self.excInfo[1]))
+            raise self.excInfo[0], self.excInfo[1], self.excInfo[2]
+        return self.result
+
+def _realStdout():
+    stdout = sys.stdout
+    return stdout.stream if isinstance(stdout, _ThreadStream) else stdout
+
+class JobPool:
+    """
+    Runs jobs on up to 'jobs' worker threads, each restricted to a disjoint
+    set of CPUs. Use as a context manager:
+
+        with JobPool(4) as pool:
+            job = pool.submit(Job('name', func))
+            ...
+            result = job.get()
+    """
+    def __init__(self, jobs, logDir=None):
+        cpus = availableCpus()
+        if jobs > len(cpus):
+            mx.warn('Limiting parallel jobs to the %d available CPUs' % len(cpus))
+            jobs = len(cpus)
+        self.cpuSets = partitionCpus(jobs, cpus)
+        self.queue = Queue.Queue()
+        self.logDir = logDir
+        self.ownsLogDir = logDir is None
+        self.workers = []
+        self.jobs = []
+
+    def __enter__(self):
+        if self.logDir is None:
+            self.logDir = tempfile.mkdtemp(prefix='mx-jobs-')
+        else:
+            mx.ensure_dir_exists(self.logDir)
+        self.savedStreams = (sys.stdout, sys.stderr)
+        self.streams = installThreadStreams()
+        for cpus in self.cpuSets:
+            worker = threading.Thread(target=self._work, args=(cpus,))
+            # Workers must not keep mx alive after an abort
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for _ in self.workers:
+            self.queue.put(None)
+        if exc_type is None:
+            for job in self.jobs:
+                job.wait()
+        sys.stdout, sys.stderr = self.savedStreams
+        if self.ownsLogDir and exc_type is None:
+            shutil.rmtree(self.logDir, ignore_errors=True)
+
+    def submit(self, job):
+        createLog(job, self.logDir)
+        self.jobs.append(job)
+        self.queue.put(job)
+        return job
+
+    def _work(self, cpus):
+        setThreadAffinity(cpus)
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            runJob(job, cpus, self.streams)
+
+def installThreadStreams():
+    """
+    Installs _ThreadStreams as sys.stdout and sys.stderr (unless already
+    installed) and returns them. The caller is responsible for restoring the
+    previous streams.
+    """
+    if not isinstance(sys.stdout, _ThreadStream):
+        sys.stdout = _ThreadStream(sys.stdout)
+    if not isinstance(sys.stderr, _ThreadStream):
+        sys.stderr = _ThreadStream(sys.stderr)
+    return (sys.stdout, sys.stderr)
+
+def createLog(job, logDir):
+    """
+    Creates the file in 'logDir' capturing the output of 'job'.
+    """
+    fd, job.log = tempfile.mkstemp(prefix=re.sub(r'[^\w.-]', '_', job.name) + '-', suffix='.log', dir=logDir)
+    os.close(fd)
+
+def runJob(job, cpus, streams):
+    """
+    Runs 'job' in the calling thread, which must already be restricted to
+    'cpus'. Its output is captured in its log by 'streams' (see
+    installThreadStreams) and the exception it raises (if any) is recorded.
+    """
+    job.cpus = cpus
+    job.start = time.time()
+    with open(job.log, 'w') as log:
+        target = _LineTee(log, job.out) if job.out else log
+        for stream in streams:
+            stream.local.target = target
+        try:
+            if job.scratch:
+                job.cwd = tempfile.mkdtemp(prefix=re.sub(r'[^\w.-]', '_', job.name) + '-')
+            mx.log('[' + job.name + ' started ' + time.strftime('%d %b %Y %H:%M:%S', time.localtime(job.start)) + ' on CPUs ' + ','.join([str(c) for c in cpus]) + ']')
+            entered = []
+            _jobState.job = job
+            try:
+                for context in job.contexts:
+                    context.__enter__()
+                    entered.append(context)
+                job.result = job.func(job)
+            finally:
+                _jobState.job = None
+                for context in reversed(entered):
+                    context.__exit__(None, None, None)
+        except JobFailure as e:
+            job.excInfo = sys.exc_info()
+            print >> log, e
+        except SystemExit as e:
+            # raised by mx.abort
+            job.excInfo = sys.exc_info()
+            print >> log, e.code
+        except BaseException: # pylint: disable=broad-except
+            job.excInfo = sys.exc_info()
+            import traceback
+            traceback.print_exception(job.excInfo[0], job.excInfo[1], job.excInfo[2], file=log)
+        finally:
+            for stream in streams:
+                stream.local.target = None
+            if job.cwd:
+                shutil.rmtree(job.cwd, ignore_errors=True)
+            job.duration = time.time() - job.start
+            job._done.set()
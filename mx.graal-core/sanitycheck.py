@@ -24,11 +24,70 @@
 # ----------------------------------------------------------------------------------------------------
 
 from outputparser import OutputParser, ValuesMatcher
-import re, mx, mx_graal_core, os, sys, StringIO, subprocess
+from parallelvms import JobPool, Job, jobOutput
+from mx_gate import Task
+import benchstats
+import re, mx, mx_graal_core, os, sys, subprocess, itertools, threading, time, tempfile, collections
 from os.path import isfile, join, exists
 
 gc = 'UseSerialGC'
 
+"""
+If true, the VM running a sanity test or benchmark is terminated as soon as
+its output shows a failure instead of being left to run to completion. The
+default is taken from the SANITYCHECK_FAIL_FAST environment variable.
+"""
+failFastMode = mx.get_env('SANITYCHECK_FAIL_FAST', 'false').lower() == 'true'
+
+"""
+Number of sanity tests run at once by runGateTests. Defaults to the value
+of the SANITYCHECK_JOBS environment variable.
+"""
+parallelJobs = int(mx.get_env('SANITYCHECK_JOBS', '1'))
+
+"""
+Settings of the adaptive benchmark mode (see SteadyStateListener): the
+number of consecutive iterations that must agree, the maximum coefficient
+of variation among them and the maximum number of iterations run.
+"""
+steadyStateWindow = int(mx.get_env('STEADY_STATE_WINDOW', '5'))
+steadyStateVariation = float(mx.get_env('STEADY_STATE_VARIATION', '0.02'))
+steadyStateMaxIterations = int(mx.get_env('STEADY_STATE_MAX_ITERATIONS', '50'))
+
+"""
+Seconds to wait for a crashing VM to finish writing its hs_err_pid file
+before terminating it in fail-fast mode.
+"""
+jvmErrorGracePeriod = 30
+
+"""
+Controls how the output of a sanity test or benchmark VM is echoed to the
+console: 'full' echoes each line as it arrives, 'batched' echoes it in
+batches of lines and 'quiet' only shows it if the program fails. Defaults
+to the SANITYCHECK_OUTPUT environment variable.
+"""
+outputMode = mx.get_env('SANITYCHECK_OUTPUT', 'full')
+
+"""
+Number of trailing output lines kept in memory to be shown if a program
+fails while its output is not echoed in full.
+"""
+outputTailLines = int(mx.get_env('SANITYCHECK_OUTPUT_TAIL', '2000'))
+
+"""
+If not None, the complete output of each program is written to a file in
+this directory (and shown from there if the program fails).
+"""
+outputDir = mx.get_env('SANITYCHECK_OUTPUT_DIR')
+
+"""
+Maximum number of lines and seconds output is held back in 'batched' mode.
+A batch is shown when either limit is reached, even if the program has
+stopped producing output.
+"""
+outputBatchLines = 500
+outputBatchInterval = 2.0
+
 dacapoSanityWarmup = {
     'avrora':     [0, 0, 3, 6, 13],
     'batik':      [0, 0, 5, 5, 20],
@@ -204,17 +263,18 @@ def getSPECjvm2008(benchArgs=None):
 
     return Test("SPECjvm2008", ['-jar', 'SPECjvm2008.jar'] + _noneAsEmptyList(benchArgs), [success], [error], [matcher], vmOpts=['-Xms3g', '-XX:+' + gc, '-XX:-UseCompressedOops'], defaultCwd=specjvm2008)
 
-def getDacapos(level=SanityCheckLevel.Normal, gateBuildLevel=None, dacapoArgs=None, extraVmArguments=None):
+def getDacapos(level=SanityCheckLevel.Normal, gateBuildLevel=None, dacapoArgs=None, extraVmArguments=None, adaptive=False):
     checks = []
 
     for (bench, ns) in dacapoSanityWarmup.items():
         if ns[level] > 0:
             if gateBuildLevel is None or gateBuildLevel in dacapoGateBuildLevels[bench]:
-                checks.append(getDacapo(bench, ['-n', str(ns[level])] + _noneAsEmptyList(dacapoArgs), extraVmArguments=extraVmArguments))
+                n = steadyStateMaxIterations if adaptive else ns[level]
+                checks.append(getDacapo(bench, ['-n', str(n)] + _noneAsEmptyList(dacapoArgs), extraVmArguments=extraVmArguments, adaptive=adaptive))
 
     return checks
 
-def getDacapo(name, dacapoArgs=None, extraVmArguments=None):
+def getDacapo(name, dacapoArgs=None, extraVmArguments=None, adaptive=False):
     dacapo = mx.get_env('DACAPO_CP')
     if dacapo is None:
         l = mx.library('DACAPO', False)
@@ -225,32 +285,37 @@ def getDacapo(name, dacapoArgs=None, extraVmArguments=None):
 
     if not isfile(dacapo) or not dacapo.endswith('.jar'):
         mx.abort('Specified DaCapo jar file does not exist or is not a jar file: ' + dacapo)
+    # the test may run in a scratch directory
+    dacapo = os.path.abspath(dacapo)
 
     dacapoSuccess = re.compile(r"^===== DaCapo 9\.12 ([a-zA-Z0-9_]+) PASSED in ([0-9]+) msec =====", re.MULTILINE)
     dacapoFail = re.compile(r"^===== DaCapo 9\.12 ([a-zA-Z0-9_]+) FAILED (warmup|) =====", re.MULTILINE)
     dacapoTime = re.compile(r"===== DaCapo 9\.12 (?P<benchmark>[a-zA-Z0-9_]+) PASSED in (?P<time>[0-9]+) msec =====")
     dacapoTime1 = re.compile(r"===== DaCapo 9\.12 (?P<benchmark>[a-zA-Z0-9_]+) completed warmup 1 in (?P<time>[0-9]+) msec =====")
+    dacapoWarmup = re.compile(r"===== DaCapo 9\.12 (?P<benchmark>[a-zA-Z0-9_]+) completed warmup (?P<iteration>[0-9]+) in (?P<time>[0-9]+) msec =====")
 
     dacapoMatcher = ValuesMatcher(dacapoTime, {'group' : 'DaCapo', 'name' : '<benchmark>', 'score' : '<time>'})
     dacapoMatcher1 = ValuesMatcher(dacapoTime1, {'group' : 'DaCapo-1stRun', 'name' : '<benchmark>', 'score' : '<time>'})
+    dacapoIterationMatcher = ValuesMatcher(dacapoWarmup, {'group' : 'DaCapo', 'name' : '<benchmark>', 'iteration' : '<iteration>', 'score' : '<time>'})
 
     # Use ipv4 stack for dacapos; tomcat+solaris+ipv6_interface fails (see also: JDK-8072384)
     return Test("DaCapo-" + name, ['-jar', mx._cygpathU2W(dacapo), name] + _noneAsEmptyList(dacapoArgs), [dacapoSuccess], [dacapoFail],
-                [dacapoMatcher, dacapoMatcher1],
+                [dacapoMatcher, dacapoMatcher1, dacapoIterationMatcher],
                 ['-Xms2g', '-XX:+' + gc, '-XX:-UseCompressedOops', "-Djava.net.preferIPv4Stack=true", '-G:+ExitVMOnException'] +
-                _noneAsEmptyList(extraVmArguments))
+                _noneAsEmptyList(extraVmArguments), adaptive=adaptive)
 
-def getScalaDacapos(level=SanityCheckLevel.Normal, gateBuildLevel=None, dacapoArgs=None, extraVmArguments=None):
+def getScalaDacapos(level=SanityCheckLevel.Normal, gateBuildLevel=None, dacapoArgs=None, extraVmArguments=None, adaptive=False):
     checks = []
 
     for (bench, ns) in dacapoScalaSanityWarmup.items():
         if ns[level] > 0:
             if gateBuildLevel is None or gateBuildLevel in dacapoScalaGateBuildLevels[bench]:
-                checks.append(getScalaDacapo(bench, ['-n', str(ns[level])] + _noneAsEmptyList(dacapoArgs), extraVmArguments=extraVmArguments))
+                n = steadyStateMaxIterations if adaptive else ns[level]
+                checks.append(getScalaDacapo(bench, ['-n', str(n)] + _noneAsEmptyList(dacapoArgs), extraVmArguments=extraVmArguments, adaptive=adaptive))
 
     return checks
 
-def getScalaDacapo(name, dacapoArgs=None, extraVmArguments=None):
+def getScalaDacapo(name, dacapoArgs=None, extraVmArguments=None, adaptive=False):
     dacapo = mx.get_env('DACAPO_SCALA_CP')
     if dacapo is None:
         l = mx.library('DACAPO_SCALA', False)
@@ -261,14 +326,17 @@ def getScalaDacapo(name, dacapoArgs=None, extraVmArguments=None):
 
     if not isfile(dacapo) or not dacapo.endswith('.jar'):
         mx.abort('Specified Scala DaCapo jar file does not exist or is not a jar file: ' + dacapo)
+    dacapo = os.path.abspath(dacapo)
 
     dacapoSuccess = re.compile(r"^===== DaCapo 0\.1\.0(-SNAPSHOT)? ([a-zA-Z0-9_]+) PASSED in ([0-9]+) msec =====", re.MULTILINE)
     dacapoFail = re.compile(r"^===== DaCapo 0\.1\.0(-SNAPSHOT)? ([a-zA-Z0-9_]+) FAILED (warmup|) =====", re.MULTILINE)
     dacapoTime = re.compile(r"===== DaCapo 0\.1\.0(-SNAPSHOT)? (?P<benchmark>[a-zA-Z0-9_]+) PASSED in (?P<time>[0-9]+) msec =====")
+    dacapoWarmup = re.compile(r"===== DaCapo 0\.1\.0(-SNAPSHOT)? (?P<benchmark>[a-zA-Z0-9_]+) completed warmup (?P<iteration>[0-9]+) in (?P<time>[0-9]+) msec =====")
 
     dacapoMatcher = ValuesMatcher(dacapoTime, {'group' : "Scala-DaCapo", 'name' : '<benchmark>', 'score' : '<time>'})
+    dacapoIterationMatcher = ValuesMatcher(dacapoWarmup, {'group' : "Scala-DaCapo", 'name' : '<benchmark>', 'iteration' : '<iteration>', 'score' : '<time>'})
 
-    return Test("Scala-DaCapo-" + name, ['-jar', mx._cygpathU2W(dacapo), name] + _noneAsEmptyList(dacapoArgs), [dacapoSuccess], [dacapoFail], [dacapoMatcher], ['-Xms2g', '-XX:+' + gc, '-XX:-UseCompressedOops'] + _noneAsEmptyList(extraVmArguments))
+    return Test("Scala-DaCapo-" + name, ['-jar', mx._cygpathU2W(dacapo), name] + _noneAsEmptyList(dacapoArgs), [dacapoSuccess], [dacapoFail], [dacapoMatcher, dacapoIterationMatcher], ['-Xms2g', '-XX:+' + gc, '-XX:-UseCompressedOops'] + _noneAsEmptyList(extraVmArguments), adaptive=adaptive)
 
 def getBootstraps():
     time = re.compile(r"Bootstrapping Graal\.+ in (?P<time>[0-9]+) ms( \(compiled (?P<methods>[0-9]+) methods\))?")
@@ -277,11 +345,60 @@ def getBootstraps():
     scoreMatcherBig = ValuesMatcher(time, {'group' : 'Bootstrap-bigHeap', 'name' : 'BootstrapTime', 'score' : '<time>'})
     methodMatcherBig = ValuesMatcher(time, {'group' : 'Bootstrap-bigHeap', 'name' : 'BootstrapMethods', 'score' : '<methods>'})
 
+    vmOpts = []
+    ignoredVMs = ['client', 'server']
+    if mx_graal_core.JDK9 and mx_graal_core.get_jvmci_mode() == 'jit':
+        # Graal is the JIT compiler of the server VM
+        vmOpts = ['-XX:+BootstrapJVMCI']
+        ignoredVMs = ['client']
+
     tests = []
-    tests.append(Test("Bootstrap", ['-version'], successREs=[time], scoreMatchers=[scoreMatcher, methodMatcher], ignoredVMs=['client', 'server'], benchmarkCompilationRate=False))
-    tests.append(Test("Bootstrap-bigHeap", ['-version'], successREs=[time], scoreMatchers=[scoreMatcherBig, methodMatcherBig], vmOpts=['-Xms2g'], ignoredVMs=['client', 'server'], benchmarkCompilationRate=False))
+    tests.append(Test("Bootstrap", ['-version'], successREs=[time], scoreMatchers=[scoreMatcher, methodMatcher], vmOpts=vmOpts, ignoredVMs=ignoredVMs, benchmarkCompilationRate=False))
+    tests.append(Test("Bootstrap-bigHeap", ['-version'], successREs=[time], scoreMatchers=[scoreMatcherBig, methodMatcherBig], vmOpts=vmOpts + ['-Xms2g'], ignoredVMs=ignoredVMs, benchmarkCompilationRate=False))
+
+    # compared with Bootstrap, shows the start-up gained by class data sharing
+    cdsOpts = mx_graal_core.sharedArchiveOptions()
+    if cdsOpts is not None:
+        scoreMatcherCds = ValuesMatcher(time, {'group' : 'Bootstrap-cds', 'name' : 'BootstrapTime', 'score' : '<time>'})
+        methodMatcherCds = ValuesMatcher(time, {'group' : 'Bootstrap-cds', 'name' : 'BootstrapMethods', 'score' : '<methods>'})
+        tests.append(Test("Bootstrap-cds", ['-version'], successREs=[time], scoreMatchers=[scoreMatcherCds, methodMatcherCds], vmOpts=vmOpts + cdsOpts, ignoredVMs=ignoredVMs, benchmarkCompilationRate=False))
     return tests
 
+def runGateTests(tests, tasks, titleSuffix, vm='jvmci', jobs=None):
+    """
+    Runs each of 'tests' as a sanity test in a gate task titled str(test) +
+    'titleSuffix'. If 'jobs' (default: 'parallelJobs') is greater than 1, up
+    to that many tests run at once, each on its own set of CPUs and in its
+    own scratch directory (see parallelvms). Their output is shown and their
+    tasks complete in the order of 'tests'.
+    """
+    jobs = parallelJobs if jobs is None else jobs
+    if jobs <= 1:
+        for test in tests:
+            with Task(str(test) + titleSuffix, tasks) as t:
+                if t and not test.test(vm):
+                    t.abort(test.name + ' Failed')
+        return
+
+    # Apply the gate task filters before any test is started. Each Task is
+    # only created once its test has completed (see gatescheduler.runGateTasks).
+    from gatescheduler import skippedByFilters
+    selected = [test for test in tests if not skippedByFilters(str(test) + titleSuffix)]
+    with JobPool(jobs) as pool:
+        running = []
+        for test in selected:
+            def runTest(job, test=test):
+                return test.test(vm, cwd=job.cwd)
+            running.append((test, pool.submit(Job(test.name, runTest, scratch=test.defaultCwd is None))))
+        for test, job in running:
+            job.wait()
+            with Task(str(test) + titleSuffix, tasks) as t:
+                if t:
+                    # report the duration of the test rather than the wait for it
+                    t.start = time.time() - job.duration
+                    if not job.get():
+                        t.abort(test.name + ' Failed')
+
 class CTWMode:
     Full, NoInline = range(2)
 
@@ -306,19 +423,282 @@ def getCTW(vm, mode):
 
     return Test("CompileTheWorld", args, successREs=[time], scoreMatchers=[scoreMatcher], benchmarkCompilationRate=False)
 
+"""
+Settings of the CompileTheWorld throughput benchmark (see getCTWThroughput):
+the number of iterations over the corpus and the number of classes in the
+corpus, which consists of the first classes of the JDK class library unless
+CTW_THROUGHPUT_CLASSPATH is set.
+"""
+ctwThroughputIterations = int(mx.get_env('CTW_THROUGHPUT_ITERATIONS', '10'))
+ctwThroughputClasses = int(mx.get_env('CTW_THROUGHPUT_CLASSES', '2000'))
+
+def getCTWThroughput(iterations=None, classpath=None):
+    """
+    Gets a benchmark compiling a fixed corpus of methods with CompileTheWorld
+    in 'iterations' iterations of a single VM. The score of each iteration is
+    the number of methods and bytecodes compiled per second of compile time.
+    As the compiler is warmed up by the earlier iterations, the scores of the
+    later ones measure the throughput of the compiled compiler rather than
+    its own warmup. The score of the benchmark is that of the last iteration.
+    """
+    iterations = ctwThroughputIterations if iterations is None else iterations
+    if classpath is None:
+        classpath = mx.get_env('CTW_THROUGHPUT_CLASSPATH')
+    if classpath is None:
+        jdk = mx.get_jdk(tag='default')
+        if mx_graal_core.JDK9:
+            classpath = join(jdk.home, 'modules', 'java.base') + os.pathsep + join(jdk.home, 'lib', 'modules', 'bootmodules.jimage')
+        else:
+            classpath = join(jdk.home, 'jre', 'lib', 'rt.jar')
+
+    throughput = re.compile(r"CompileTheWorld : iteration (?P<iteration>[0-9]+) throughput \((?P<methods>[0-9]+) methods/s, (?P<bytecodes>[0-9]+) bytecodes/s\)")
+    scoreMatchers = []
+    for name, group in [('MethodsPerSecond', '<methods>'), ('BytecodesPerSecond', '<bytecodes>')]:
+        # the score of the last iteration is the score of the benchmark (see Test.bench)
+        scoreMatchers.append(ValuesMatcher(throughput, {'group' : 'CompileTheWorld-throughput', 'name' : name, 'iteration' : '<iteration>', 'score' : group}))
+
+    args = ['-G:CompileTheWorldClasspath=' + classpath, '-G:CompileTheWorldIterations=' + str(iterations),
+            '-G:CompileTheWorldStopAt=' + str(ctwThroughputClasses), '-G:-CompileTheWorldVerbose',
+            '-XX:ReservedCodeCacheSize=300m', '-Djava.awt.headless=true']
+    ignoredVMs = ['client', 'server']
+    if mx_graal_core.JDK9:
+        # the server VM is the JVMCI VM
+        ignoredVMs = ['client']
+    else:
+        args.append('-XX:-UseJVMCIClassLoader')
+    args.append('com.oracle.graal.hotspot.CompileTheWorld')
+    return Test("CompileTheWorld-throughput", args, successREs=[throughput], scoreMatchers=scoreMatchers, ignoredVMs=ignoredVMs, benchmarkCompilationRate=False)
+
 
 class Tee:
-    def __init__(self):
-        self.output = StringIO.StringIO()
+    """
+    Echoes VM output to the console while feeding each line to an
+    OutputParser so that the output does not need to be retained.
+    Each listener is called with the value maps matched by a line
+    as soon as the line is seen.
+
+    Only the last 'tailLines' lines of output are kept in memory. If
+    'spillFile' is given, the complete output is also written to that file.
+    The 'mode' argument selects how output is echoed (see 'outputMode').
+    dump() shows the output not yet echoed, typically after a failure.
+    """
+    def __init__(self, parser, listeners=None, mode=None, tailLines=None, spillFile=None, console=None):
+        self.parser = parser
+        self.listeners = _noneAsEmptyList(listeners)
+        self.mode = outputMode if mode is None else mode
+        if self.mode not in ('full', 'batched', 'quiet'):
+            mx.abort('Unknown sanity check output mode: ' + self.mode)
+        self.tail = collections.deque(maxlen=outputTailLines if tailLines is None else tailLines)
+        self.lines = 0
+        self.spillFile = spillFile
+        self.spill = open(spillFile, 'w') if spillFile else None
+        # resolved here as the output is eaten by the threads of mx.run
+        self.console = console or jobOutput()
+        self.batch = []
+        # guards 'batch' against the timer flushing it (see _scheduleFlush)
+        self.lock = threading.Lock()
+        self.timer = None
+
     def eat(self, line):
-        self.output.write(line)
-        sys.stdout.write(line)
+        valueMaps = self.parser.eat(line)
+        self.lines += 1
+        self.tail.append(line)
+        if self.spill:
+            self.spill.write(line)
+        if self.mode == 'full':
+            self.console.write(line)
+        elif self.mode == 'batched':
+            with self.lock:
+                self.batch.append(line)
+                if len(self.batch) >= outputBatchLines:
+                    self._flush()
+                elif self.timer is None:
+                    self._scheduleFlush()
+        if valueMaps:
+            for listener in self.listeners:
+                listener(valueMaps)
+
+    def _scheduleFlush(self):
+        """
+        Shows the current batch after 'outputBatchInterval' seconds unless it
+        has been shown by then.
+        """
+        self.timer = threading.Timer(outputBatchInterval, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        if self.batch:
+            self.console.write(''.join(self.batch))
+            self.batch = []
+        self.console.flush()
+
+    def close(self):
+        self.flush()
+        if self.spill:
+            self.spill.close()
+            self.spill = None
+
+    def dump(self):
+        """
+        Shows the output of a failed program if it has not been echoed already.
+        """
+        if self.mode != 'quiet':
+            return
+        if self.spillFile:
+            mx.log('Output (' + self.spillFile + '):')
+            with open(self.spillFile) as fp:
+                for chunk in iter(lambda: fp.read(1024 * 1024), ''):
+                    self.console.write(chunk)
+        else:
+            omitted = self.lines - len(self.tail)
+            if omitted > 0:
+                mx.log('Output (last %d lines, %d lines omitted):' % (len(self.tail), omitted))
+            else:
+                mx.log('Output:')
+            self.console.write(''.join(self.tail))
+        self.console.flush()
+
+def _spillFile(name):
+    """
+    Gets a fresh file in 'outputDir' for the output of the program 'name'
+    or None if output is not being spilled.
+    """
+    if outputDir is None:
+        return None
+    mx.ensure_dir_exists(outputDir)
+    fd, path = tempfile.mkstemp(prefix=re.sub(r'[^\w.-]', '_', name) + '-', suffix='.log', dir=outputDir)
+    os.close(fd)
+    return path
+
+_vmTags = itertools.count()
+
+class TerminatableVM:
+    """
+    Allows a VM launched via mx_graal_core.run_vm to be terminated from one
+    of its output listeners. As mx.run does not expose the process it starts,
+    the VM command line is tagged with a unique system property (see 'tag')
+    by which the process is found among the subprocesses tracked by mx.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.tag = '-Dsanitycheck.vm=%d.%d' % (os.getpid(), next(_vmTags))
+        self.reason = None
+        self.lock = threading.Lock()
+
+    def terminate(self, reason):
+        """
+        Terminates the VM if it is still running. Only the first reason
+        given is retained.
+        """
+        with self.lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+        subprocesses = getattr(mx, '_currentSubprocesses', None)
+        if subprocesses is None:
+            mx.warn('Cannot terminate ' + self.name + ' early as this version of mx does not expose its subprocesses')
+            return
+        found = False
+        for entry in list(subprocesses):
+            p, args = entry[0], entry[1]
+            if self.tag in args:
+                found = True
+                mx.log('Terminating ' + self.name + ': ' + reason)
+                try:
+                    p.kill()
+                except OSError:
+                    # already exited
+                    pass
+        if not found:
+            mx.warn('Cannot terminate ' + self.name + ' (' + reason + ') as no running process has ' + self.tag + ' on its command line')
+
+class FailFastListener:
+    """
+    Terminates a VM as soon as a failure pattern or the path of an
+    hs_err_pid file appears in its output.
+    """
+    def __init__(self, vm):
+        self.vm = vm
+        self.timer = None
+
+    def __call__(self, valueMaps):
+        for valueMap in valueMaps:
+            if valueMap.get('failed') == '1':
+                self.vm.terminate('failure detected in output')
+            elif valueMap.get('jvmError') and self.timer is None:
+                # The VM prints the path of the crash log before writing it and
+                # normally exits by itself once it is written. Only terminate it
+                # if it hangs.
+                self.timer = threading.Timer(jvmErrorGracePeriod, self.vm.terminate, ['crashed (' + valueMap['jvmError'] + ')'])
+                self.timer.daemon = True
+                self.timer.start()
+
+    def close(self):
+        if self.timer:
+            self.timer.cancel()
+
+class SteadyStateListener:
+    """
+    Watches the iteration times of a benchmark and terminates its VM once
+    they have reached a steady state. This is the case when the coefficient
+    of variation of the last 'window' iterations is at most 'variation' and
+    their mean does not differ significantly (see benchstats.significant)
+    from that of the 'window' iterations before them. The steady-state score
+    is the mean of the last 'window' iterations and the iteration the steady
+    state is reached at is the first of them.
+    """
+    def __init__(self, window=None, variation=None):
+        self.window = window or steadyStateWindow
+        self.variation = variation or steadyStateVariation
+        self.vm = None
+        self.times = {}
+        self.reached = None
+
+    def __call__(self, valueMaps):
+        for valueMap in valueMaps:
+            if not valueMap.has_key('iteration') or self.reached:
+                continue
+            key = (valueMap['group'], valueMap['name'])
+            times = self.times.setdefault(key, [])
+            times.append(benchstats.parseScore(valueMap['score']))
+            if len(times) < 2 * self.window:
+                continue
+            current = times[-self.window:]
+            previous = times[-2 * self.window:-self.window]
+            if benchstats.stddev(current) > self.variation * benchstats.mean(current):
+                continue
+            if benchstats.significant(previous, current):
+                continue
+            iteration = len(times) - self.window + 1
+            self.reached = (key, iteration, benchstats.mean(current))
+            if self.vm:
+                self.vm.terminate('steady state reached at iteration %d' % iteration)
+
+    def close(self):
+        pass
+
+def _dumpJvmError(jvmErrorFile):
+    mx.log('/!\\JVM Error : dumping error log...')
+    if not exists(jvmErrorFile):
+        mx.log('<' + jvmErrorFile + ' is missing>')
+        return
+    with open(jvmErrorFile, 'rb') as fp:
+        mx.log(fp.read())
+    os.unlink(jvmErrorFile)
 
 """
 Encapsulates a single program that is a sanity test and/or a benchmark.
 """
 class Test:
-    def __init__(self, name, cmd, successREs=None, failureREs=None, scoreMatchers=None, vmOpts=None, defaultCwd=None, ignoredVMs=None, benchmarkCompilationRate=False):
+    def __init__(self, name, cmd, successREs=None, failureREs=None, scoreMatchers=None, vmOpts=None, defaultCwd=None, ignoredVMs=None, benchmarkCompilationRate=False, adaptive=False):
 
         self.name = name
         self.successREs = _noneAsEmptyList(successREs)
@@ -329,20 +709,19 @@ class Test:
         self.defaultCwd = defaultCwd
         self.ignoredVMs = _noneAsEmptyList(ignoredVMs)
         self.benchmarkCompilationRate = benchmarkCompilationRate
+        # run as a benchmark until its iteration scores reach a steady state
+        self.adaptive = adaptive
         if benchmarkCompilationRate:
             self.vmOpts = self.vmOpts + ['-XX:+CITime']
 
     def __str__(self):
         return self.name
 
-    def test(self, vm, cwd=None, extraVmOpts=None, vmbuild=None):
+    def createParser(self, vm, forBench=False):
         """
-        Run this program as a sanity test.
+        Creates the parser for the output of this program when run on 'vm'
+        as a sanity test or as a benchmark (if 'forBench' is true).
         """
-        if vm in self.ignoredVMs:
-            return True
-        if cwd is None:
-            cwd = self.defaultCwd
         parser = OutputParser()
         jvmError = re.compile(r"(?P<jvmerror>([A-Z]:|/).*[/\\]hs_err_pid[0-9]+\.log)")
         parser.addMatcher(ValuesMatcher(jvmError, {'jvmError' : '<jvmerror>'}))
@@ -352,60 +731,130 @@ class Test:
         for failureRE in self.failureREs:
             parser.addMatcher(ValuesMatcher(failureRE, {'failed' : '1'}))
 
-        tee = Tee()
-        retcode = mx_graal_core.run_vm(self.vmOpts + _noneAsEmptyList(extraVmOpts) + self.cmd, vm, nonZeroIsFatal=False, out=tee.eat, err=subprocess.STDOUT, cwd=cwd, vmbuild=vmbuild)
-        output = tee.output.getvalue()
-        valueMaps = parser.parse(output)
+        if forBench:
+            for scoreMatcher in self.scoreMatchers:
+                parser.addMatcher(scoreMatcher)
+
+            if self.benchmarkCompilationRate:
+                if vm == 'jvmci':
+                    bps = re.compile(r"ParsedBytecodesPerSecond@final: (?P<rate>[0-9]+)")
+                    ibps = re.compile(r"InlinedBytecodesPerSecond@final: (?P<rate>[0-9]+)")
+                    parser.addMatcher(ValuesMatcher(bps, {'group' : 'ParsedBytecodesPerSecond', 'name' : self.name, 'score' : '<rate>'}))
+                    parser.addMatcher(ValuesMatcher(ibps, {'group' : 'InlinedBytecodesPerSecond', 'name' : self.name, 'score' : '<rate>'}))
+                else:
+                    ibps = re.compile(r"(?P<compiler>[\w]+) compilation speed: +(?P<rate>[0-9]+) bytes/s {standard")
+                    parser.addMatcher(ValuesMatcher(ibps, {'group' : 'InlinedBytecodesPerSecond', 'name' : '<compiler>:' + self.name, 'score' : '<rate>'}))
+        return parser
+
+    def createTee(self, parser):
+        """
+        Creates the object capturing the output of this program
+        according to the module level output settings.
+        """
+        return Tee(parser, spillFile=_spillFile(self.name))
+
+    def run(self, vm, tee, cwd=None, extraVmOpts=None, vmbuild=None, failFast=None, steadyState=None):
+        """
+        Runs this program and feeds its output to 'tee'. If 'failFast' is
+        true (default: 'failFastMode'), the VM is terminated as soon as its
+        output shows a failure. If a SteadyStateListener is given as
+        'steadyState', the VM is terminated once it detects a steady state.
+
+        Returns a tuple of the VM exit code and the reason the VM was
+        terminated early or None if it ran to completion.
+        """
+        if failFast is None:
+            failFast = failFastMode
+        vmOpts = self.vmOpts + _noneAsEmptyList(extraVmOpts)
+        listeners = []
+        process = None
+        if failFast or steadyState:
+            process = TerminatableVM(self.name)
+            vmOpts = [process.tag] + vmOpts
+        if failFast:
+            listeners.append(FailFastListener(process))
+        if steadyState:
+            steadyState.vm = process
+            listeners.append(steadyState)
+        tee.listeners.extend(listeners)
+        try:
+            retcode = mx_graal_core.run_vm(vmOpts + self.cmd, vm, nonZeroIsFatal=False, out=tee.eat, err=subprocess.STDOUT, cwd=cwd, vmbuild=vmbuild)
+        finally:
+            for listener in listeners:
+                listener.close()
+            tee.close()
+        return retcode, process.reason if process else None
+
+    def test(self, vm, cwd=None, extraVmOpts=None, vmbuild=None, failFast=None):
+        """
+        Run this program as a sanity test.
+        """
+        if vm in self.ignoredVMs:
+            return True
+        if cwd is None:
+            cwd = self.defaultCwd
+        parser = self.createParser(vm)
+        tee = self.createTee(parser)
+
+        retcode, terminated = self.run(vm, tee, cwd=cwd, extraVmOpts=extraVmOpts, vmbuild=vmbuild, failFast=failFast)
+        if terminated:
+            mx.log(self.name + ' was terminated early: ' + terminated)
+        valueMaps = parser.valueMaps
 
         if len(valueMaps) == 0:
+            tee.dump()
             return False
 
         record = {}
         for valueMap in valueMaps:
             for key, value in valueMap.items():
                 if record.has_key(key) and record[key] != value:
+                    tee.dump()
                     mx.abort('Inconsistant values returned by test machers : ' + str(valueMaps))
                 record[key] = value
 
         jvmErrorFile = record.get('jvmError')
         if jvmErrorFile:
-            mx.log('/!\\JVM Error : dumping error log...')
-            with open(jvmErrorFile, 'rb') as fp:
-                mx.log(fp.read())
-            os.unlink(jvmErrorFile)
+            tee.dump()
+            _dumpJvmError(jvmErrorFile)
             return False
 
         if record.get('failed') == '1':
+            tee.dump()
             return False
 
-        return retcode == 0 and record.get('passed') == '1'
+        passed = retcode == 0 and record.get('passed') == '1'
+        if not passed:
+            tee.dump()
+        return passed
 
-    def bench(self, vm, cwd=None, extraVmOpts=None, vmbuild=None):
+    def bench(self, vm, cwd=None, extraVmOpts=None, vmbuild=None, failFast=None, iterations=None, steadyStates=None):
         """
-        Run this program as a benchmark.
+        Run this program as a benchmark. If 'iterations' is a dictionary, the
+        scores of the individual iterations of each benchmark whose harness
+        reports them are added to it as {group : {benchmark : [score, ...]}},
+        followed by the final score if the harness reports one separately.
+        A benchmark without separate final score is scored by its last
+        iteration.
+
+        If this is an adaptive benchmark, it is stopped as soon as its
+        iteration scores reach a steady state. Its score is then the
+        steady-state score and the iteration the steady state was reached at
+        is added to 'steadyStates' (if given) as {group : {benchmark :
+        iteration}}.
         """
         if vm in self.ignoredVMs:
             return {}
         if cwd is None:
             cwd = self.defaultCwd
-        parser = OutputParser()
+        parser = self.createParser(vm, forBench=True)
+        tee = None
+        steadyState = SteadyStateListener() if self.adaptive else None
 
-        for successRE in self.successREs:
-            parser.addMatcher(ValuesMatcher(successRE, {'passed' : '1'}))
-        for failureRE in self.failureREs:
-            parser.addMatcher(ValuesMatcher(failureRE, {'failed' : '1'}))
-        for scoreMatcher in self.scoreMatchers:
-            parser.addMatcher(scoreMatcher)
-
-        if self.benchmarkCompilationRate:
-            if vm == 'jvmci':
-                bps = re.compile(r"ParsedBytecodesPerSecond@final: (?P<rate>[0-9]+)")
-                ibps = re.compile(r"InlinedBytecodesPerSecond@final: (?P<rate>[0-9]+)")
-                parser.addMatcher(ValuesMatcher(bps, {'group' : 'ParsedBytecodesPerSecond', 'name' : self.name, 'score' : '<rate>'}))
-                parser.addMatcher(ValuesMatcher(ibps, {'group' : 'InlinedBytecodesPerSecond', 'name' : self.name, 'score' : '<rate>'}))
-            else:
-                ibps = re.compile(r"(?P<compiler>[\w]+) compilation speed: +(?P<rate>[0-9]+) bytes/s {standard")
-                parser.addMatcher(ValuesMatcher(ibps, {'group' : 'InlinedBytecodesPerSecond', 'name' : '<compiler>:' + self.name, 'score' : '<rate>'}))
+        def fail(message):
+            if tee:
+                tee.dump()
+            mx.abort(message)
 
         startDelim = 'START: ' + self.name
         endDelim = 'END: ' + self.name
@@ -423,31 +872,68 @@ class Test:
                 mx.log(startDelim)
                 mx.log(output)
                 mx.log(endDelim)
+                for line in output.splitlines(True):
+                    valueMaps = parser.eat(line)
+                    if steadyState and valueMaps:
+                        steadyState(valueMaps)
+                        if steadyState.reached:
+                            break
         else:
-            tee = Tee()
+            tee = self.createTee(parser)
             mx.log(startDelim)
-            if mx_graal_core.run_vm(self.vmOpts + _noneAsEmptyList(extraVmOpts) + self.cmd, vm, nonZeroIsFatal=False, out=tee.eat, err=subprocess.STDOUT, cwd=cwd, vmbuild=vmbuild) != 0:
-                mx.abort("Benchmark failed (non-zero retcode)")
+            retcode, terminated = self.run(vm, tee, cwd=cwd, extraVmOpts=extraVmOpts, vmbuild=vmbuild, failFast=failFast, steadyState=steadyState)
             mx.log(endDelim)
-            output = tee.output.getvalue()
+            if retcode != 0 and not (steadyState and steadyState.reached):
+                tee.dump()
+                for valueMap in parser.valueMaps:
+                    if valueMap.get('jvmError'):
+                        _dumpJvmError(valueMap['jvmError'])
+                if terminated:
+                    mx.abort("Benchmark failed (terminated early: " + terminated + ")")
+                mx.abort("Benchmark failed (non-zero retcode)")
 
         groups = {}
+        series = {}
         passed = False
-        for valueMap in parser.parse(output):
-            assert (valueMap.has_key('name') and valueMap.has_key('score') and valueMap.has_key('group')) or valueMap.has_key('passed') or valueMap.has_key('failed'), valueMap
+        for valueMap in parser.valueMaps:
+            assert (valueMap.has_key('name') and valueMap.has_key('score') and valueMap.has_key('group')) or valueMap.has_key('passed') or valueMap.has_key('failed') or valueMap.has_key('jvmError'), valueMap
             if valueMap.get('failed') == '1':
-                mx.abort("Benchmark failed")
+                fail("Benchmark failed")
             if valueMap.get('passed') == '1':
                 passed = True
             groupName = valueMap.get('group')
             if groupName:
-                group = groups.setdefault(groupName, {})
                 name = valueMap.get('name')
                 score = valueMap.get('score')
+                if valueMap.has_key('iteration'):
+                    series.setdefault(groupName, {}).setdefault(name, []).append((int(valueMap['iteration']), score))
+                    continue
+                group = groups.setdefault(groupName, {})
                 if name and score:
                     group[name] = score
 
+        for groupName, group in series.iteritems():
+            for name, scores in group.iteritems():
+                scores = [score for _, score in sorted(scores)]
+                final = groups.get(groupName, {}).get(name)
+                if iterations is not None:
+                    iterations.setdefault(groupName, {})[name] = scores + ([final] if final else [])
+                if not final:
+                    groups.setdefault(groupName, {})[name] = scores[-1]
+
+        if steadyState:
+            if steadyState.reached:
+                (groupName, name), iteration, score = steadyState.reached
+                mx.log('{}: steady state reached at iteration {} with a score of {:.2f}'.format(self.name, iteration, score))
+                groups.setdefault(groupName, {})[name] = score
+                if steadyStates is not None:
+                    steadyStates.setdefault(groupName, {})[name] = iteration
+                # the VM was stopped before the harness could report success
+                passed = True
+            else:
+                mx.warn('{}: no steady state within the iterations run'.format(self.name))
+
         if not passed:
-            mx.abort("Benchmark failed (not passed)")
+            fail("Benchmark failed (not passed)")
 
         return groups
@@ -0,0 +1,238 @@
+# ----------------------------------------------------------------------------------------------------
+#
+# Copyright (c) 2016, Oracle and/or its affiliates. All rights reserved.
+# DO NOT ALTER OR REMOVE COPYRIGHT NOTICES OR THIS FILE HEADER.
+#
+# This code is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 only, as
+# published by the Free Software Foundation.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# version 2 for more details (a copy is included in the LICENSE file that
+# accompanied this code).
+#
+# You should have received a copy of the GNU General Public License version
+# 2 along with this work; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Please contact Oracle, 500 Oracle Parkway, Redwood Shores, CA 94065 USA
+# or visit www.oracle.com if you need additional information or have any
+# questions.
+#
+# ----------------------------------------------------------------------------------------------------
+
+
+"""
+Support for running the unit tests of several suites in parallel VMs
+(shards). The test classes are distributed over the shards by the longest
+processing time first rule, based on how long each class took in earlier
+runs (see durationsFile). The failures of all shards are merged into one
+report.
+"""
+
+import os, re, json, time, heapq, tempfile
+from os.path import join, expanduser, dirname
+
+import mx
+import mx_unittest
+import benchstats
+from mx_unittest import unittest
+from parallelvms import JobPool, Job
+
+"""
+Number of VMs the unit tests of the gate are split across. Defaults to the
+value of the UNITTEST_SHARDS environment variable.
+"""
+shardCount = int(mx.get_env('UNITTEST_SHARDS', '1'))
+
+"""
+The file recording the duration (in seconds) of each test class in the last
+run that measured it.
+"""
+durationsFile = join(expanduser('~'), '.mx', 'unittest-durations.json')
+
+"""
+Duration assumed for each test class if no duration has been recorded yet.
+Classes without recorded duration otherwise take the median duration of
+those with one.
+"""
+defaultDuration = 1.0
+
+# The JUnit runner prints a line per test class that is completed when the
+# class is finished. The duration of a class is the time between its line
+# and the previous line of the runner.
+_classRE = re.compile(r"^(?P<cls>[\w$]+(?:\.[\w$]+)+) started(?: \([0-9]+ of [0-9]+\))?")
+_failureRE = re.compile(r"^[0-9]+\) (?P<test>[^(\s]+)\((?P<cls>[\w$.]+)\)\s*$")
+_okRE = re.compile(r"^OK \((?P<tests>[0-9]+) tests?\)")
+_failuresRE = re.compile(r"^Tests run: (?P<tests>[0-9]+),\s+Failures: (?P<failures>[0-9]+)")
+
+def testClasses(suites):
+    """
+    Gets the names of the test classes in the projects of 'suites', found in
+    the same way as by the unittest command.
+    """
+    classes = set()
+    for p in mx.projects():
+        if p.isJavaProject() and p.suite.name in suites:
+            classes.update(mx_unittest._find_classes_with_annotations(p, None, ['@Test']).keys())
+    return sorted(classes)
+
+def loadDurations():
+    try:
+        with open(durationsFile) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+def saveDurations(durations):
+    """
+    Records 'durations' in 'durationsFile', keeping the recorded durations of
+    other classes.
+    """
+    recorded = loadDurations()
+    recorded.update(durations)
+    try:
+        mx.ensure_dir_exists(dirname(durationsFile))
+        with open(durationsFile, 'w') as fp:
+            json.dump(recorded, fp, indent=1, sort_keys=True)
+    except IOError as e:
+        mx.warn('Could not record unit test durations in ' + durationsFile + ': ' + str(e))
+
+def assignShards(classes, shards, durations):
+    """
+    Distributes 'classes' over at most 'shards' shards by assigning the
+    longest remaining class to the shard with the least estimated duration.
+    Returns a list of ShardResults.
+    """
+    known = [durations[c] for c in classes if c in durations]
+    default = benchstats.median(known) if known else defaultDuration
+    estimates = dict([(c, durations.get(c, default)) for c in classes])
+    shards = min(shards, len(classes))
+    assigned = [[] for _ in range(shards)]
+    loads = [(0.0, i) for i in range(shards)]
+    for c in sorted(classes, key=lambda c: (-estimates[c], c)):
+        load, i = heapq.heappop(loads)
+        assigned[i].append(c)
+        heapq.heappush(loads, (load + estimates[c], i))
+    return [ShardResult(i + 1, shards, sorted(assigned[i]), sum([estimates[c] for c in assigned[i]])) for i in range(shards)]
+
+class ShardResult:
+    """
+    The test classes of a shard and the results extracted from its output.
+    """
+    def __init__(self, index, shards, classes, estimate):
+        self.name = 'UnitTestShard-%d-of-%d' % (index, shards)
+        self.index = index
+        self.classes = classes
+        self.estimate = estimate
+        self.durations = {}
+        self.failures = []
+        self.tests = None
+        self.error = None
+        self.start = None
+        self.last = None
+        self.elapsed = None
+
+    def eat(self, line):
+        line = line.rstrip()
+        now = time.time()
+        m = _classRE.match(line)
+        if m:
+            self.durations[m.group('cls')] = now - (self.last or self.start)
+            self.last = now
+            return
+        if self.last is None:
+            # the first class starts after the runner's banner
+            self.last = now
+        m = _failureRE.match(line)
+        if m:
+            self.failures.append(m.group('cls') + '.' + m.group('test'))
+            return
+        m = _okRE.match(line) or _failuresRE.match(line)
+        if m:
+            self.tests = int(m.group('tests'))
+
+    def status(self):
+        tests = ' in %d tests' % self.tests if self.tests is not None else ''
+        if self.failures:
+            return '%d failures%s' % (len(self.failures), tests)
+        if self.error is not None:
+            return 'failed (' + str(self.error) + ')'
+        return 'OK' + (' (%d tests)' % self.tests if self.tests is not None else '')
+
+def run(suites, shards, args, vmLauncher=None):
+    """
+    Runs the unit tests of 'suites' in 'shards' VMs at once, passing 'args'
+    (unittest command options and VM options) to the unittest command of
+    each shard. If given, the (name, launcher) pair 'vmLauncher' (see
+    mx_unittest.set_vm_launcher) replaces the unit test VM launcher while the
+    shards run. Shows the output of the shards followed by a merged report
+    and aborts if a shard failed.
+    """
+    classes = testClasses(suites)
+    if not classes:
+        mx.abort('No unit tests found in ' + ', '.join(suites))
+    results = assignShards(classes, shards, loadDurations())
+
+    start = time.time()
+    jobs = []
+    with _VmLauncher(vmLauncher), JobPool(len(results)) as pool:
+        for result in results:
+            def runShard(job, result=result):
+                fd, whitelist = tempfile.mkstemp(prefix='unittest-', suffix='.whitelist')
+                with os.fdopen(fd, 'w') as fp:
+                    fp.write('\n'.join(result.classes) + '\n')
+                result.start = time.time()
+                try:
+                    unittest(['--whitelist', whitelist] + args)
+                finally:
+                    result.elapsed = time.time() - result.start
+                    os.remove(whitelist)
+            jobs.append((result, pool.submit(Job(result.name, runShard, out=result.eat))))
+        for result, job in jobs:
+            job.wait()
+            job.showLog()
+            if job.excInfo:
+                result.error = job.excInfo[1]
+
+    durations = {}
+    for result in results:
+        durations.update(result.durations)
+    saveDurations(durations)
+    report(results, time.time() - start)
+
+    failed = [result for result in results if result.error is not None or result.failures]
+    if failed:
+        mx.abort('Unit test failures in %d of %d shards' % (len(failed), len(results)))
+
+class _VmLauncher:
+    """
+    Replaces the unit test VM launcher with the (name, launcher) pair
+    'vmLauncher' (if given) until exited.
+    """
+    def __init__(self, vmLauncher):
+        self.vmLauncher = vmLauncher
+
+    def __enter__(self):
+        if self.vmLauncher:
+            self.saved = mx_unittest._vm_launcher
+            # set_vm_launcher refuses to replace a launcher
+            mx_unittest._vm_launcher = None
+            mx_unittest.set_vm_launcher(*self.vmLauncher)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.vmLauncher:
+            mx_unittest._vm_launcher = self.saved
+
+def report(results, elapsed):
+    mx.log('Unit test shards (%d VMs, %.1f s):' % (len(results), elapsed))
+    for result in results:
+        mx.log('  Shard %d: %d classes, %.1f s (estimated %.1f s), %s' % (result.index, len(result.classes), result.elapsed or 0.0, result.estimate, result.status()))
+    failures = [(failure, result) for result in results for failure in result.failures]
+    if failures:
+        mx.log('Failures:')
+        for failure, result in sorted(failures):
+            mx.log('  ' + failure + ' (shard %d)' % result.index)